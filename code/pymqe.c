@@ -59,12 +59,26 @@ same way the native 'C' compiler does. (Hint: use the Python struct.py \
 package. See pymqi.py for an example). IN/OUT parameters are not\
 updated in place, but returned as parameters in a tuple.\
 \
+MQPUT, MQPUT1, MQGET and MQGET_INTO also accept the native structure \
+types pymqe.MQMD, pymqe.MQGMO and pymqe.MQPMO in place of the MQMD, \
+MQGMO and MQPMO string buffers. Their members are attributes, the \
+structures are passed to MQI by reference and updated in place, and \
+the same objects are returned in the tuple.\
+\
 All calls return the MQI completion code & reason as the last two\
 elements of a tuple.\
 \
 The MQ verbs implemented here are:\
   MQCONN, MQCONNX, MQDISC, MQOPEN, MQCLOSE, MQPUT, MQPUT1, MQGET,\
-  MQCMIT, MQBACK, MQBEGIN, MQINQ, MQSET, MQSUB, MQCRTMH, MQSETMP, MQINQMP\
+  MQPUT_MANY (a batch of MQPUTs in one call),\
+  MQGET_INTO (MQGET into a caller-supplied buffer),\
+  MQGET_MANY (a batch of MQGETs in one call),\
+  MQCMIT, MQBACK, MQBEGIN, MQINQ, MQSET, MQSUB, MQCRTMH, MQSETMP, MQINQMP,\
+  MQSETMP_MANY (several properties of a message handle in one call),\
+  MQINQMP_ALL (all the properties of a message handle in one call),\
+  MQDLTMH, MQMHBUF, MQBUFMH,\
+  MQCB, MQCTL (asynchronous consumption through Python callbacks),\
+  MQSTAT\
 \
 The PCF MQAI call mqExecute is also implemented.\
 \
@@ -129,6 +143,10 @@ static PyObject *ErrorObj;
 #define PYMQI_MQSMPO_SIZEOF sizeof(MQSMPO)
 #define PYMQI_MQIMPO_SIZEOF sizeof(MQIMPO)
 #define PYMQI_MQPD_SIZEOF sizeof(MQPD)
+#define PYMQI_MQSTS_SIZEOF sizeof(MQSTS)
+#define PYMQI_MQDMHO_SIZEOF sizeof(MQDMHO)
+#define PYMQI_MQBMHO_SIZEOF sizeof(MQBMHO)
+#define PYMQI_MQMHBO_SIZEOF sizeof(MQMHBO)
 #endif
 
 /* Macro for cleaning up MQAI filters-related object.
@@ -152,6 +170,447 @@ static int checkArgSize(size_t given, size_t expected, const char *name) {
   return 0;
 }
 
+/*
+ * Access to the memory of an object exporting the buffer interface,
+ * such as a bytearray, memoryview or mmap. The new-style buffer
+ * protocol is tried first because it stops the exporter from being
+ * resized while MQI uses its memory with the GIL released. Objects
+ * which only implement the old protocol (mmap under Python 2) are
+ * accepted too. Every successful getBuffer must be paired with a
+ * releaseBuffer.
+ *
+ * A unicode object is read as its default encoding, as with the "s#"
+ * format, and not as its internal UCS-2/UCS-4 storage.
+ */
+typedef struct {
+  Py_buffer view;
+  int hasView;
+  void *ptr;
+  Py_ssize_t len;
+} pymqiBuffer;
+
+static int getBuffer(PyObject *obj, int writable, pymqiBuffer *buffer) {
+  buffer->hasView = 0;
+  if (PyUnicode_Check(obj)) {
+    if (writable) {
+      PyErr_SetString(PyExc_TypeError, "a unicode object is not a writable buffer");
+      return 1;
+    }
+    /* Borrowed reference, cached by the unicode object */
+    if (!(obj = _PyUnicode_AsDefaultEncodedString(obj, NULL))) {
+      return 1;
+    }
+  }
+  if (PyObject_CheckBuffer(obj)) {
+    if (PyObject_GetBuffer(obj, &buffer->view,
+                           writable ? PyBUF_WRITABLE : PyBUF_SIMPLE) < 0) {
+      return 1;
+    }
+    buffer->hasView = 1;
+    buffer->ptr = buffer->view.buf;
+    buffer->len = buffer->view.len;
+    return 0;
+  }
+  if (writable) {
+    if (PyObject_AsWriteBuffer(obj, &buffer->ptr, &buffer->len) < 0) {
+      return 1;
+    }
+  } else {
+    if (PyObject_AsReadBuffer(obj, (const void **)&buffer->ptr, &buffer->len) < 0) {
+      return 1;
+    }
+  }
+  return 0;
+}
+
+static void releaseBuffer(pymqiBuffer *buffer) {
+  if (buffer->hasView) {
+    PyBuffer_Release(&buffer->view);
+    buffer->hasView = 0;
+  }
+}
+
+
+/*
+ * Native MQMD, MQGMO & MQPMO structures. The pymqe.MQMD, pymqe.MQGMO &
+ * pymqe.MQPMO types hold the MQI structure in the object itself and
+ * expose its members as attributes. MQPUT, MQPUT1, MQGET & MQGET_INTO
+ * accept them in place of the string buffers, pass the structures to
+ * MQI by reference and return the same objects, updated in place, so
+ * that nothing needs to be packed or unpacked around the calls.
+ */
+#define PYMQI_FIELD_LONG 0
+#define PYMQI_FIELD_FLAG 1
+#define PYMQI_FIELD_BYTES 2
+#define PYMQI_FIELD_INT64 3
+#define PYMQI_FIELD_PTR 4
+
+typedef struct {
+  char *name;
+  size_t offset;
+  size_t size;
+  int kind;
+} pymqiField;
+
+#define PYMQI_MEMBER(s, m, kind) {#m, offsetof(s, m), sizeof(((s *)0)->m), kind}
+
+static pymqiField mdFields[] = {
+  PYMQI_MEMBER(MQMD, StrucId, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQMD, Version, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQMD, Report, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQMD, MsgType, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQMD, Expiry, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQMD, Feedback, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQMD, Encoding, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQMD, CodedCharSetId, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQMD, Format, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQMD, Priority, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQMD, Persistence, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQMD, MsgId, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQMD, CorrelId, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQMD, BackoutCount, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQMD, ReplyToQ, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQMD, ReplyToQMgr, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQMD, UserIdentifier, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQMD, AccountingToken, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQMD, ApplIdentityData, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQMD, PutApplType, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQMD, PutApplName, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQMD, PutDate, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQMD, PutTime, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQMD, ApplOriginData, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQMD, GroupId, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQMD, MsgSeqNumber, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQMD, Offset, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQMD, MsgFlags, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQMD, OriginalLength, PYMQI_FIELD_LONG),
+  {NULL}
+};
+
+static pymqiField gmoFields[] = {
+  PYMQI_MEMBER(MQGMO, StrucId, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQGMO, Version, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQGMO, Options, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQGMO, WaitInterval, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQGMO, Signal1, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQGMO, Signal2, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQGMO, ResolvedQName, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQGMO, MatchOptions, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQGMO, GroupStatus, PYMQI_FIELD_FLAG),
+  PYMQI_MEMBER(MQGMO, SegmentStatus, PYMQI_FIELD_FLAG),
+  PYMQI_MEMBER(MQGMO, Segmentation, PYMQI_FIELD_FLAG),
+  PYMQI_MEMBER(MQGMO, Reserved1, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQGMO, MsgToken, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQGMO, ReturnedLength, PYMQI_FIELD_LONG),
+#ifdef MQCMDL_LEVEL_700
+  PYMQI_MEMBER(MQGMO, Reserved2, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQGMO, MsgHandle, PYMQI_FIELD_INT64),
+#endif
+  {NULL}
+};
+
+static pymqiField pmoFields[] = {
+  PYMQI_MEMBER(MQPMO, StrucId, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQPMO, Version, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQPMO, Options, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQPMO, Timeout, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQPMO, Context, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQPMO, KnownDestCount, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQPMO, UnknownDestCount, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQPMO, InvalidDestCount, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQPMO, ResolvedQName, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQPMO, ResolvedQMgrName, PYMQI_FIELD_BYTES),
+  PYMQI_MEMBER(MQPMO, RecsPresent, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQPMO, PutMsgRecFields, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQPMO, PutMsgRecOffset, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQPMO, ResponseRecOffset, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQPMO, PutMsgRecPtr, PYMQI_FIELD_PTR),
+  PYMQI_MEMBER(MQPMO, ResponseRecPtr, PYMQI_FIELD_PTR),
+#ifdef MQCMDL_LEVEL_700
+  PYMQI_MEMBER(MQPMO, OriginalMsgHandle, PYMQI_FIELD_INT64),
+  PYMQI_MEMBER(MQPMO, NewMsgHandle, PYMQI_FIELD_INT64),
+  PYMQI_MEMBER(MQPMO, Action, PYMQI_FIELD_LONG),
+  PYMQI_MEMBER(MQPMO, PubLevel, PYMQI_FIELD_LONG),
+#endif
+  {NULL}
+};
+
+typedef struct {
+  PyObject_HEAD
+  union {
+    MQMD md;
+    MQGMO gmo;
+    MQPMO pmo;
+  } s;
+} pymqiStruct;
+
+static PyTypeObject MQMD_Type;
+static PyTypeObject MQGMO_Type;
+static PyTypeObject MQPMO_Type;
+
+static MQMD defaultMD = {MQMD_DEFAULT};
+static MQGMO defaultGMO = {MQGMO_DEFAULT};
+static MQPMO defaultPMO = {MQPMO_DEFAULT};
+
+/*
+ * Return the native structure type of obj, or NULL if obj isn't a
+ * native structure object.
+ */
+static PyTypeObject *structType(PyObject *obj) {
+  if (PyObject_TypeCheck(obj, &MQMD_Type)) {
+    return &MQMD_Type;
+  }
+  if (PyObject_TypeCheck(obj, &MQGMO_Type)) {
+    return &MQGMO_Type;
+  }
+  if (PyObject_TypeCheck(obj, &MQPMO_Type)) {
+    return &MQPMO_Type;
+  }
+  return NULL;
+}
+
+/*
+ * Return the length of the MQI structure held by a native structure
+ * object and, if defaults isn't NULL, its MQI default value.
+ */
+static size_t structLength(PyObject *obj, void **defaults) {
+  PyTypeObject *type = structType(obj);
+
+  if (type == &MQMD_Type) {
+    if (defaults) *defaults = &defaultMD;
+    return PYMQI_MQMD_SIZEOF;
+  }
+  if (type == &MQGMO_Type) {
+    if (defaults) *defaults = &defaultGMO;
+    return PYMQI_MQGMO_SIZEOF;
+  }
+  if (defaults) *defaults = &defaultPMO;
+  return PYMQI_MQPMO_SIZEOF;
+}
+
+/*
+ * Copy the structure in buffObj, a string buffer or a native structure
+ * object of the same type, into self.
+ */
+static int structCopy(pymqiStruct *self, PyObject *buffObj) {
+  size_t length = structLength((PyObject *)self, NULL);
+  char *buffer;
+  Py_ssize_t bufferLength;
+
+  if ((PyObject *)self == buffObj) {
+    return 0;
+  }
+  if (structType(buffObj) == structType((PyObject *)self)) {
+    memcpy(&self->s, &((pymqiStruct *)buffObj)->s, length);
+    return 0;
+  }
+  if (PyString_AsStringAndSize(buffObj, &buffer, &bufferLength)) {
+    return 1;
+  }
+  if (checkArgSize(bufferLength, length, structType((PyObject *)self)->tp_name)) {
+    return 1;
+  }
+  memcpy(&self->s, buffer, length);
+  return 0;
+}
+
+static int structInit(pymqiStruct *self, PyObject *args, PyObject *kwds) {
+  PyObject *buffObj = NULL, *key, *value;
+  Py_ssize_t pos = 0;
+  void *defaults;
+  size_t length;
+
+  if (!PyArg_ParseTuple(args, "|O", &buffObj)) {
+    return -1;
+  }
+  if (buffObj) {
+    if (structCopy(self, buffObj)) {
+      return -1;
+    }
+  } else {
+    length = structLength((PyObject *)self, &defaults);
+    memcpy(&self->s, defaults, length);
+  }
+  /* Members given as keywords, unknown ones raise AttributeError */
+  while (kwds && PyDict_Next(kwds, &pos, &key, &value)) {
+    if (PyObject_SetAttr((PyObject *)self, key, value)) {
+      return -1;
+    }
+  }
+  return 0;
+}
+
+static PyObject *structPack(pymqiStruct *self) {
+  return PyString_FromStringAndSize((char *)&self->s, structLength((PyObject *)self, NULL));
+}
+
+static PyObject *structUnpack(pymqiStruct *self, PyObject *args) {
+  PyObject *buffObj;
+
+  if (!PyArg_ParseTuple(args, "O", &buffObj)) {
+    return NULL;
+  }
+  if (structCopy(self, buffObj)) {
+    return NULL;
+  }
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+
+static PyObject *structGetField(pymqiStruct *self, void *closure) {
+  pymqiField *field = (pymqiField *)closure;
+  char *member = (char *)&self->s + field->offset;
+
+  switch (field->kind) {
+  case PYMQI_FIELD_LONG:
+    return PyInt_FromLong(*(MQLONG *)member);
+  case PYMQI_FIELD_FLAG:
+    return PyInt_FromLong(*(signed char *)member);
+  case PYMQI_FIELD_INT64:
+    return PyLong_FromLongLong(*(MQINT64 *)member);
+  case PYMQI_FIELD_PTR:
+    return PyLong_FromVoidPtr(*(void **)member);
+  default:
+    return PyString_FromStringAndSize(member, field->size);
+  }
+}
+
+/*
+ * Set a structure member. As with the struct module formats used by
+ * the pymqi.MQOpts structures, character members shorter than the
+ * member are padded with nulls and longer ones are truncated.
+ */
+static int structSetField(pymqiStruct *self, PyObject *value, void *closure) {
+  pymqiField *field = (pymqiField *)closure;
+  char *member = (char *)&self->s + field->offset;
+  long longValue;
+  PY_LONG_LONG int64Value;
+  void *ptrValue;
+  char *buffer;
+  Py_ssize_t bufferLength;
+
+  if (!value) {
+    PyErr_Format(PyExc_TypeError, "can't delete the %s member", field->name);
+    return -1;
+  }
+  switch (field->kind) {
+  case PYMQI_FIELD_LONG:
+  case PYMQI_FIELD_FLAG:
+    longValue = PyInt_AsLong(value);
+    if (longValue == -1 && PyErr_Occurred()) {
+      return -1;
+    }
+    if ((field->kind == PYMQI_FIELD_LONG &&
+         (longValue < -0x7fffffffL - 1 || longValue > 0x7fffffffL)) ||
+        (field->kind == PYMQI_FIELD_FLAG &&
+         (longValue < -0x80 || longValue > 0x7f))) {
+      PyErr_Format(PyExc_OverflowError, "%s out of range", field->name);
+      return -1;
+    }
+    if (field->kind == PYMQI_FIELD_LONG) {
+      *(MQLONG *)member = (MQLONG)longValue;
+    } else {
+      *(signed char *)member = (signed char)longValue;
+    }
+    return 0;
+  case PYMQI_FIELD_INT64:
+    int64Value = PyLong_AsLongLong(value);
+    if (int64Value == -1 && PyErr_Occurred()) {
+      return -1;
+    }
+    *(MQINT64 *)member = (MQINT64)int64Value;
+    return 0;
+  case PYMQI_FIELD_PTR:
+    ptrValue = PyLong_AsVoidPtr(value);
+    if (!ptrValue && PyErr_Occurred()) {
+      return -1;
+    }
+    *(void **)member = ptrValue;
+    return 0;
+  default:
+    if (PyString_AsStringAndSize(value, &buffer, &bufferLength)) {
+      return -1;
+    }
+    memset(member, 0, field->size);
+    memcpy(member, buffer, (size_t)bufferLength < field->size ? (size_t)bufferLength : field->size);
+    return 0;
+  }
+}
+
+static PyMethodDef structMethods[] = {
+  {"pack", (PyCFunction)structPack, METH_NOARGS,
+   "pack()\n\nReturn the structure as a string buffer."},
+  {"unpack", (PyCFunction)structUnpack, METH_VARARGS,
+   "unpack(buff)\n\nCopy the structure 'buff', a string buffer or a structure of the same type, into self."},
+  {NULL, NULL}
+};
+
+static int initStructType(PyTypeObject *type, char *name, char *doc, pymqiField *fields) {
+  PyGetSetDef *getset;
+  int count, i;
+
+  for (count = 0; fields[count].name; count++);
+  if (!(getset = PyMem_New(PyGetSetDef, count + 1))) {
+    PyErr_NoMemory();
+    return -1;
+  }
+  memset(getset, 0, (count + 1) * sizeof(PyGetSetDef));
+  for (i = 0; i < count; i++) {
+    getset[i].name = fields[i].name;
+    getset[i].get = (getter)structGetField;
+    getset[i].set = (setter)structSetField;
+    getset[i].closure = &fields[i];
+  }
+
+  Py_TYPE(type) = &PyType_Type;
+  Py_REFCNT(type) = 1;
+  type->tp_name = name;
+  type->tp_basicsize = sizeof(pymqiStruct);
+  type->tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE;
+  type->tp_doc = doc;
+  type->tp_methods = structMethods;
+  type->tp_getset = getset;
+  type->tp_init = (initproc)structInit;
+  /* object's own, so that copy_reg may make instances with
+   * object.__new__(cls), as in the pickles of the MQOpts based
+   * pymqi.md, gmo & pmo */
+  type->tp_new = PyBaseObject_Type.tp_new;
+  return PyType_Ready(type);
+}
+
+/*
+ * Return a pointer to the MQI structure in obj, a native structure
+ * object of the given type or a string buffer of the structure's
+ * length. Returns NULL with an exception set otherwise.
+ */
+static void *structArg(PyObject *obj, PyTypeObject *type, size_t length, const char *name) {
+  char *buffer;
+  Py_ssize_t bufferLength;
+
+  if (PyObject_TypeCheck(obj, type)) {
+    return &((pymqiStruct *)obj)->s;
+  }
+  if (PyString_AsStringAndSize(obj, &buffer, &bufferLength)) {
+    return NULL;
+  }
+  if (checkArgSize(bufferLength, length, name)) {
+    return NULL;
+  }
+  return buffer;
+}
+
+/*
+ * Return the updated MQI structure passed as obj to structArg: the
+ * native structure object itself, or a copy of the string buffer.
+ */
+static PyObject *structResult(PyObject *obj, void *structP, size_t length) {
+  if (PyString_Check(obj)) {
+    return PyString_FromStringAndSize((char *)structP, length);
+  }
+  Py_INCREF(obj);
+  return obj;
+}
+
 static char pymqe_MQCONN__doc__[] =
 "MQCONN(mgrName) \
  \
@@ -355,35 +814,34 @@ static PyObject * pymqe_MQCLOSE(PyObject *self, PyObject *args) {
  */
 static PyObject *mqputN(int put1Flag, PyObject *self, PyObject *args) {
   MQLONG compCode, compReason;
-  char *mDescBuffer;
-  int mDescBufferLength;
+  PyObject *mDescObj;
   MQMD *mDescP;
-  char *putOptsBuffer;
-  int putOptsBufferLength;
+  PyObject *putOptsObj;
   MQPMO *pmoP;
-  char *msgBuffer;
-  int msgBufferLength;
+  PyObject *msgObj;
+  pymqiBuffer msgBuffer;
   char *qDescBuffer;
   int qDescBufferLength;
   MQOD *qDescP = NULL;
 
   long lQmgrHandle, lqHandle;
 
+  /*
+   * The message may be any object exporting the buffer interface
+   * (str, bytearray, memoryview, mmap ...), its memory is passed to
+   * MQI as-is.
+   */
   if (!put1Flag) {
     /* PUT call, expects qHandle for an open q */
-    if (!PyArg_ParseTuple(args, "lls#s#s#", &lQmgrHandle, &lqHandle,
-              &mDescBuffer, &mDescBufferLength,
-              &putOptsBuffer, &putOptsBufferLength,
-              &msgBuffer, &msgBufferLength)) {
+    if (!PyArg_ParseTuple(args, "llOOO", &lQmgrHandle, &lqHandle,
+              &mDescObj, &putOptsObj, &msgObj)) {
       return NULL;
     }
   } else {
     /* PUT1 call, expects od for a queue to be opened */
-    if (!PyArg_ParseTuple(args, "ls#s#s#s#", &lQmgrHandle,
+    if (!PyArg_ParseTuple(args, "ls#OOO", &lQmgrHandle,
               &qDescBuffer, &qDescBufferLength,
-              &mDescBuffer, &mDescBufferLength,
-              &putOptsBuffer, &putOptsBufferLength,
-              &msgBuffer, &msgBufferLength)) {
+              &mDescObj, &putOptsObj, &msgObj)) {
       return NULL;
 
     }
@@ -393,28 +851,31 @@ static PyObject *mqputN(int put1Flag, PyObject *self, PyObject *args) {
     qDescP = (MQOD *)qDescBuffer;
   }
 
-  if (checkArgSize(mDescBufferLength, PYMQI_MQMD_SIZEOF, "MQMD")) {
+  if (!(mDescP = structArg(mDescObj, &MQMD_Type, PYMQI_MQMD_SIZEOF, "MQMD"))) {
+    return NULL;
+  }
+  if (!(pmoP = structArg(putOptsObj, &MQPMO_Type, PYMQI_MQPMO_SIZEOF, "MQPMO"))) {
     return NULL;
   }
-  mDescP = (MQMD *)mDescBuffer;
 
-  if (checkArgSize(putOptsBufferLength, PYMQI_MQPMO_SIZEOF, "MQPMO")) {
+  if (getBuffer(msgObj, 0, &msgBuffer)) {
     return NULL;
   }
-  pmoP = (MQPMO *)putOptsBuffer;
   if (!put1Flag) {
     Py_BEGIN_ALLOW_THREADS
-    MQPUT((MQHCONN) lQmgrHandle, (MQHOBJ) lqHandle, mDescP, pmoP, (MQLONG) msgBufferLength, msgBuffer,
+    MQPUT((MQHCONN) lQmgrHandle, (MQHOBJ) lqHandle, mDescP, pmoP, (MQLONG) msgBuffer.len, msgBuffer.ptr,
       &compCode, &compReason);
     Py_END_ALLOW_THREADS
   } else {
     Py_BEGIN_ALLOW_THREADS
-    MQPUT1((MQHCONN) lQmgrHandle, qDescP, mDescP, pmoP, (MQLONG) msgBufferLength, msgBuffer,
+    MQPUT1((MQHCONN) lQmgrHandle, qDescP, mDescP, pmoP, (MQLONG) msgBuffer.len, msgBuffer.ptr,
        &compCode, &compReason);
     Py_END_ALLOW_THREADS
   }
-  return Py_BuildValue("(s#s#ll)", mDescP, PYMQI_MQMD_SIZEOF,
-               pmoP, PYMQI_MQPMO_SIZEOF, (long) compCode, (long) compReason);
+  releaseBuffer(&msgBuffer);
+  return Py_BuildValue("(NNll)", structResult(mDescObj, mDescP, PYMQI_MQMD_SIZEOF),
+               structResult(putOptsObj, pmoP, PYMQI_MQPMO_SIZEOF),
+               (long) compCode, (long) compReason);
 }
 
 
@@ -423,7 +884,9 @@ static char pymqe_MQPUT__doc__[] =
  \
 Calls the MQI MQPUT(qMgr, qHandle, mDesc, putOpts, msg) function to \
 put msg on the queue referenced by qMgr & qHandle. The message msg may \
-contain embedded nulls. mDesc & putOpts are string buffers containing \
+contain embedded nulls and may be any object exporting the buffer \
+interface, such as a string, bytearray, memoryview or mmap; it is not \
+copied. mDesc & putOpts are string buffers containing \
 a MQMD Message Descriptor structure and a MQPMO Put Message Option \
 structure. \
  \
@@ -444,7 +907,8 @@ static char pymqe_MQPUT1__doc__[] =
  \
 Calls the MQI MQPUT1(qMgr, qDesc, mDesc, putOpts, msg) function to put \
 the message msg on the queue referenced by qMgr & qDesc. The message \
-msg may contain embedded nulls. mDesc & putOpts are string buffers \
+msg may contain embedded nulls and may be any object exporting the \
+buffer interface, as for MQPUT. mDesc & putOpts are string buffers \
 containing a MQMD Message Descriptor structure and a MQPMO Put Message \
 Option structure. \
  \
@@ -464,6 +928,261 @@ static PyObject *pymqe_MQPUT1(PyObject *self, PyObject *args) {
 }
 
 
+static char pymqe_MQPUT_MANY__doc__[] =
+"MQPUT_MANY(qMgr, qHandle, mDesc, putOpts, messages, commitEvery) \
+ \
+Puts every message of the list messages on the queue referenced by \
+qMgr & qHandle by calling MQPUT in a loop, with the GIL released for \
+the whole loop. Each item of messages is a tuple (msg, msgId, \
+correlId, priority) where msg is any object exporting the buffer \
+interface. mDesc & putOpts are string buffers containing the MQMD \
+used as the template of every message and the MQPMO used for every \
+MQPUT. msgId & correlId are 24 byte strings and priority an integer \
+overriding the template's fields for that message, or None. \
+ \
+If commitEvery is positive, MQCMIT is called after every commitEvery \
+MQPUTs and after the last one. putOpts should then specify \
+MQPMO_SYNCPOINT. \
+ \
+The tuple (msgIds, failures) is returned. msgIds holds the MsgId of \
+each message put, or None if it was not. failures is a list of \
+(index, comp, reason) tuples for the messages which were not put. A \
+failing MQCMIT adds an entry for each message of the unit of work \
+which was backed out. The loop is abandoned on MQRC_CONNECTION_BROKEN, \
+MQRC_HCONN_ERROR and MQRC_HOBJ_ERROR; the uncommitted unit of work \
+is then backed out, and its messages and the remaining ones reported \
+with that reason. \
+ \
+If mDesc or putOpts are the wrong size, or an item of messages is \
+malformed, an exception is raised before any MQPUT; a priority out of \
+the range of an MQLONG raises OverflowError. \
+";
+
+/*
+ * A message of MQPUT_MANY, resolved with the GIL held so the loop
+ * itself doesn't touch any Python object.
+ */
+typedef struct {
+  pymqiBuffer msg;
+  char *msgId;
+  char *correlId;
+  int hasPriority;
+  MQLONG priority;
+  MQLONG compCode;
+  MQLONG compReason;
+  MQBYTE24 newMsgId;
+} pymqiPutItem;
+
+static int getPutItemId(PyObject *obj, char **id, const char *name) {
+  char *buffer;
+  Py_ssize_t length;
+
+  *id = NULL;
+  if (obj == Py_None) {
+    return 0;
+  }
+  if (PyString_AsStringAndSize(obj, &buffer, &length) < 0) {
+    return 1;
+  }
+  if (checkArgSize(length, sizeof(MQBYTE24), name)) {
+    return 1;
+  }
+  *id = buffer;
+  return 0;
+}
+
+static PyObject *pymqe_MQPUT_MANY(PyObject *self, PyObject *args) {
+  MQLONG compCode = MQCC_OK, compReason = MQRC_NONE;
+  char *mDescBuffer;
+  int mDescBufferLength;
+  char *putOptsBuffer;
+  int putOptsBufferLength;
+  MQMD mDesc;
+  MQPMO pmo;
+  PyObject *messagesObj, *messages, *item;
+  PyObject *msgIds = NULL, *failures = NULL, *entry;
+  pymqiPutItem *items;
+  Py_ssize_t count, ready, i, uowStart = 0, stopped = -1;
+  long commitEvery, pending = 0;
+
+  long lQmgrHandle, lqHandle;
+
+  if (!PyArg_ParseTuple(args, "lls#s#Ol", &lQmgrHandle, &lqHandle,
+            &mDescBuffer, &mDescBufferLength,
+            &putOptsBuffer, &putOptsBufferLength,
+            &messagesObj, &commitEvery)) {
+    return NULL;
+  }
+  if (checkArgSize(mDescBufferLength, PYMQI_MQMD_SIZEOF, "MQMD")) {
+    return NULL;
+  }
+  if (checkArgSize(putOptsBufferLength, PYMQI_MQPMO_SIZEOF, "MQPMO")) {
+    return NULL;
+  }
+  messages = PySequence_Fast(messagesObj, "messages must be a sequence");
+  if (!messages) {
+    return NULL;
+  }
+  count = PySequence_Fast_GET_SIZE(messages);
+  items = malloc((count ? count : 1) * sizeof(pymqiPutItem));
+  if (!items) {
+    Py_DECREF(messages);
+    PyErr_SetString(ErrorObj, "No memory for messages");
+    return NULL;
+  }
+
+  for (ready = 0; ready < count; ready++) {
+    PyObject *msgObj, *msgIdObj, *correlIdObj, *priorityObj;
+    pymqiPutItem *p = &items[ready];
+
+    item = PySequence_Fast_GET_ITEM(messages, ready);
+    if (!PyArg_ParseTuple(item, "OOOO", &msgObj, &msgIdObj, &correlIdObj, &priorityObj)) {
+      goto cleanup;
+    }
+    if (getPutItemId(msgIdObj, &p->msgId, "MsgId") ||
+        getPutItemId(correlIdObj, &p->correlId, "CorrelId")) {
+      goto cleanup;
+    }
+    p->hasPriority = priorityObj != Py_None;
+    if (p->hasPriority) {
+      long priority = PyInt_AsLong(priorityObj);
+      if (priority == -1 && PyErr_Occurred()) {
+        goto cleanup;
+      }
+      if (priority < -0x7fffffffL - 1 || priority > 0x7fffffffL) {
+        PyErr_SetString(PyExc_OverflowError, "Priority out of range");
+        goto cleanup;
+      }
+      p->priority = (MQLONG) priority;
+    }
+    if (getBuffer(msgObj, 0, &p->msg)) {
+      goto cleanup;
+    }
+  }
+
+  Py_BEGIN_ALLOW_THREADS
+  for (i = 0; i < count; i++) {
+    pymqiPutItem *p = &items[i];
+
+    memcpy(&mDesc, mDescBuffer, PYMQI_MQMD_SIZEOF);
+    memcpy(&pmo, putOptsBuffer, PYMQI_MQPMO_SIZEOF);
+    if (p->msgId) {
+      memcpy(mDesc.MsgId, p->msgId, sizeof(MQBYTE24));
+    }
+    if (p->correlId) {
+      memcpy(mDesc.CorrelId, p->correlId, sizeof(MQBYTE24));
+    }
+    if (p->hasPriority) {
+      mDesc.Priority = p->priority;
+    }
+    MQPUT((MQHCONN) lQmgrHandle, (MQHOBJ) lqHandle, &mDesc, &pmo,
+          (MQLONG) p->msg.len, p->msg.ptr, &p->compCode, &p->compReason);
+    memcpy(p->newMsgId, mDesc.MsgId, sizeof(MQBYTE24));
+
+    if (p->compCode == MQCC_FAILED) {
+      if (p->compReason == MQRC_CONNECTION_BROKEN ||
+          p->compReason == MQRC_HCONN_ERROR ||
+          p->compReason == MQRC_HOBJ_ERROR) {
+        stopped = i + 1;
+        compCode = p->compCode;
+        compReason = p->compReason;
+        break;
+      }
+      continue;
+    }
+
+    if (commitEvery > 0 && ++pending == commitEvery) {
+      MQCMIT((MQHCONN) lQmgrHandle, &compCode, &compReason);
+      if (compCode == MQCC_FAILED) {
+        for (; uowStart <= i; uowStart++) {
+          if (items[uowStart].compCode != MQCC_FAILED) {
+            items[uowStart].compCode = compCode;
+            items[uowStart].compReason = compReason;
+          }
+        }
+      }
+      uowStart = i + 1;
+      pending = 0;
+    }
+  }
+  if (commitEvery > 0 && pending && stopped >= 0) {
+    /*
+     * The puts of the unit of work are reported as failed, don't leave
+     * them pending on the connection for a later MQCMIT to commit.
+     */
+    MQLONG backCode, backReason;
+
+    MQBACK((MQHCONN) lQmgrHandle, &backCode, &backReason);
+  } else if (commitEvery > 0 && pending) {
+    MQCMIT((MQHCONN) lQmgrHandle, &compCode, &compReason);
+    if (compCode == MQCC_FAILED) {
+      for (; uowStart < count; uowStart++) {
+        if (items[uowStart].compCode != MQCC_FAILED) {
+          items[uowStart].compCode = compCode;
+          items[uowStart].compReason = compReason;
+        }
+      }
+    }
+  }
+  Py_END_ALLOW_THREADS
+
+  /*
+   * Messages which were never put because the loop was abandoned get
+   * the reason which stopped it, as do those of the unit of work
+   * which was left uncommitted.
+   */
+  if (stopped >= 0) {
+    for (i = commitEvery > 0 ? uowStart : stopped; i < count; i++) {
+      if (i >= stopped || items[i].compCode != MQCC_FAILED) {
+        items[i].compCode = compCode;
+        items[i].compReason = compReason;
+      }
+    }
+  }
+
+  msgIds = PyList_New(count);
+  failures = PyList_New(0);
+  if (!msgIds || !failures) {
+    goto cleanup;
+  }
+  for (i = 0; i < count; i++) {
+    if (items[i].compCode == MQCC_FAILED) {
+      Py_INCREF(Py_None);
+      PyList_SET_ITEM(msgIds, i, Py_None);
+      entry = Py_BuildValue("(nll)", i, (long) items[i].compCode, (long) items[i].compReason);
+      if (!entry || PyList_Append(failures, entry)) {
+        Py_XDECREF(entry);
+        goto cleanup;
+      }
+      Py_DECREF(entry);
+    } else {
+      entry = PyString_FromStringAndSize((char *) items[i].newMsgId, sizeof(MQBYTE24));
+      if (!entry) {
+        goto cleanup;
+      }
+      PyList_SET_ITEM(msgIds, i, entry);
+    }
+  }
+
+  for (i = 0; i < ready; i++) {
+    releaseBuffer(&items[i].msg);
+  }
+  free(items);
+  Py_DECREF(messages);
+  return Py_BuildValue("(NN)", msgIds, failures);
+
+ cleanup:
+  for (i = 0; i < ready; i++) {
+    releaseBuffer(&items[i].msg);
+  }
+  free(items);
+  Py_DECREF(messages);
+  Py_XDECREF(msgIds);
+  Py_XDECREF(failures);
+  return NULL;
+}
+
+
 static char pymqe_MQGET__doc__[] =
 "MQGET(qMgr, qHandle, mDesc, getOpts, maxlen) \
  \
@@ -488,11 +1207,9 @@ If mDesc or getOpts are the wrong size, an exception is raised. \
 
 static PyObject *pymqe_MQGET(PyObject *self, PyObject *args) {
   MQLONG compCode, compReason;
-  char *mDescBuffer;
-  int mDescBufferLength;
+  PyObject *mDescObj;
   MQMD *mDescP;
-  char *getOptsBuffer;
-  int getOptsBufferLength;
+  PyObject *getOptsObj;
   MQGMO *gmoP;
   long maxLength, returnLength;
   MQLONG actualLength;
@@ -501,21 +1218,16 @@ static PyObject *pymqe_MQGET(PyObject *self, PyObject *args) {
 
   long lQmgrHandle, lqHandle;
 
-  if (!PyArg_ParseTuple(args, "lls#s#l", &lQmgrHandle, &lqHandle,
-            &mDescBuffer, &mDescBufferLength,
-            &getOptsBuffer, &getOptsBufferLength, &maxLength)) {
+  if (!PyArg_ParseTuple(args, "llOOl", &lQmgrHandle, &lqHandle,
+            &mDescObj, &getOptsObj, &maxLength)) {
     return NULL;
   }
-  if (checkArgSize(mDescBufferLength, PYMQI_MQMD_SIZEOF, "MQMD")) {
+  if (!(mDescP = structArg(mDescObj, &MQMD_Type, PYMQI_MQMD_SIZEOF, "MQMD"))) {
     return NULL;
   }
-
-  mDescP = (MQMD *)mDescBuffer;
-
-  if (checkArgSize(getOptsBufferLength, PYMQI_MQGMO_SIZEOF, "MQGMO")) {
+  if (!(gmoP = structArg(getOptsObj, &MQGMO_Type, PYMQI_MQGMO_SIZEOF, "MQGMO"))) {
     return NULL;
   }
-  gmoP = (MQGMO *)getOptsBuffer;
 
   /* Allocate temp. storage for message */
   if (!(msgBuffer = malloc(maxLength))) {
@@ -539,14 +1251,200 @@ static PyObject *pymqe_MQGET(PyObject *self, PyObject *args) {
     returnLength = actualLength;
   }
 
-  rv = Py_BuildValue("(s#s#s#lll)", msgBuffer, (int) returnLength,
-             mDescP, PYMQI_MQMD_SIZEOF, gmoP, PYMQI_MQGMO_SIZEOF,
+  rv = Py_BuildValue("(s#NNlll)", msgBuffer, (int) returnLength,
+             structResult(mDescObj, mDescP, PYMQI_MQMD_SIZEOF),
+             structResult(getOptsObj, gmoP, PYMQI_MQGMO_SIZEOF),
              (long) actualLength, (long) compCode, (long) compReason);
   free(msgBuffer);
   return rv;
 }
 
 
+static char pymqe_MQGET_INTO__doc__[] =
+"MQGET_INTO(qMgr, qHandle, mDesc, getOpts, buffer) \
+ \
+Calls the MQI MQGET(qMgr, qHandle, mDesc, getOpts, maxlen) function to \
+get a message from the queue referred to by qMgr & qHandle directly \
+into buffer, which may be any writable object exporting the buffer \
+interface, such as a bytearray, memoryview or mmap. The length of the \
+buffer is used as maxlen. No intermediate copy of the message is made, \
+so one buffer may be reused for any number of calls. \
+ \
+The tuple (mDesc, getOpts, actualLen, comp, reason) is returned, where \
+mDesc & getOpts are copies of the (possibly) updated MQMD & MQGMO \
+structures and actualLen is the actual length of the message in the \
+Queue. If this is bigger than the buffer, then as much data as \
+possible is copied into the buffer, as with MQGET. \
+ \
+If mDesc or getOpts are the wrong size, an exception is raised. \
+";
+
+static PyObject *pymqe_MQGET_INTO(PyObject *self, PyObject *args) {
+  MQLONG compCode, compReason;
+  PyObject *mDescObj;
+  MQMD *mDescP;
+  PyObject *getOptsObj;
+  MQGMO *gmoP;
+  MQLONG actualLength;
+  PyObject *msgObj;
+  pymqiBuffer msgBuffer;
+  PyObject *rv;
+
+  long lQmgrHandle, lqHandle;
+
+  if (!PyArg_ParseTuple(args, "llOOO", &lQmgrHandle, &lqHandle,
+            &mDescObj, &getOptsObj, &msgObj)) {
+    return NULL;
+  }
+  if (!(mDescP = structArg(mDescObj, &MQMD_Type, PYMQI_MQMD_SIZEOF, "MQMD"))) {
+    return NULL;
+  }
+  if (!(gmoP = structArg(getOptsObj, &MQGMO_Type, PYMQI_MQGMO_SIZEOF, "MQGMO"))) {
+    return NULL;
+  }
+
+  if (getBuffer(msgObj, 1, &msgBuffer)) {
+    return NULL;
+  }
+
+  actualLength = 0;
+  Py_BEGIN_ALLOW_THREADS
+  MQGET((MQHCONN) lQmgrHandle, (MQHOBJ) lqHandle, mDescP, gmoP, (MQLONG) msgBuffer.len,
+    msgBuffer.ptr, &actualLength, &compCode, &compReason);
+  Py_END_ALLOW_THREADS
+  releaseBuffer(&msgBuffer);
+
+  rv = Py_BuildValue("(NNlll)", structResult(mDescObj, mDescP, PYMQI_MQMD_SIZEOF),
+             structResult(getOptsObj, gmoP, PYMQI_MQGMO_SIZEOF),
+             (long) actualLength, (long) compCode, (long) compReason);
+  return rv;
+}
+
+
+static char pymqe_MQGET_MANY__doc__[] =
+"MQGET_MANY(qMgr, qHandle, mDesc, getOpts, maxMessages, maxBytes) \
+ \
+Gets up to maxMessages messages from the queue referred to by qMgr & \
+qHandle by calling MQGET in a loop, with the GIL released for the \
+whole loop. mDesc & getOpts are string buffers containing the MQMD \
+and MQGMO used for every MQGET. If getOpts specifies MQGMO_WAIT, only \
+the first MQGET waits, the following ones return immediately when \
+the queue is empty. All the messages must fit in maxBytes bytes. \
+ \
+The loop stops after maxMessages messages, on the first MQGET that \
+doesn't return a message (typically MQRC_NO_MSG_AVAILABLE or \
+MQRC_TRUNCATED_MSG_FAILED when maxBytes is used up) or after a \
+warning. \
+ \
+The tuple (messages, getOpts, actualLen, comp, reason) is returned, \
+where messages is a list of (msg, mDesc) tuples, getOpts is the MQGMO \
+as updated by the last MQGET, and actualLen, comp & reason come from \
+the MQGET which stopped the loop (comp is MQCC_OK if maxMessages \
+messages were received). \
+ \
+If mDesc or getOpts are the wrong size, an exception is raised. \
+";
+
+static PyObject *pymqe_MQGET_MANY(PyObject *self, PyObject *args) {
+  MQLONG compCode = MQCC_OK, compReason = MQRC_NONE;
+  char *mDescBuffer;
+  int mDescBufferLength;
+  char *getOptsBuffer;
+  int getOptsBufferLength;
+  MQGMO gmo;
+  MQMD *mDescs;
+  MQLONG *lengths;
+  MQLONG actualLength = 0;
+  long maxMessages, maxBytes;
+  long count = 0, used = 0, i;
+  char *msgBuffer;
+  PyObject *messages, *item;
+
+  long lQmgrHandle, lqHandle;
+
+  if (!PyArg_ParseTuple(args, "lls#s#ll", &lQmgrHandle, &lqHandle,
+            &mDescBuffer, &mDescBufferLength,
+            &getOptsBuffer, &getOptsBufferLength, &maxMessages, &maxBytes)) {
+    return NULL;
+  }
+  if (checkArgSize(mDescBufferLength, PYMQI_MQMD_SIZEOF, "MQMD")) {
+    return NULL;
+  }
+  if (checkArgSize(getOptsBufferLength, PYMQI_MQGMO_SIZEOF, "MQGMO")) {
+    return NULL;
+  }
+  if (maxMessages < 1 || maxBytes < 0) {
+    PyErr_SetString(ErrorObj, "maxMessages must be positive and maxBytes not negative");
+    return NULL;
+  }
+  memcpy(&gmo, getOptsBuffer, PYMQI_MQGMO_SIZEOF);
+
+  /* Temp. storage for the messages and their descriptors */
+  msgBuffer = malloc(maxBytes ? maxBytes : 1);
+  mDescs = malloc(maxMessages * sizeof(MQMD));
+  lengths = malloc(maxMessages * sizeof(MQLONG));
+  if (!msgBuffer || !mDescs || !lengths) {
+    free(msgBuffer);
+    free(mDescs);
+    free(lengths);
+    PyErr_SetString(ErrorObj, "No memory for messages");
+    return NULL;
+  }
+
+  Py_BEGIN_ALLOW_THREADS
+  while (count < maxMessages) {
+    memcpy(&mDescs[count], mDescBuffer, PYMQI_MQMD_SIZEOF);
+    actualLength = 0;
+    MQGET((MQHCONN) lQmgrHandle, (MQHOBJ) lqHandle, &mDescs[count], &gmo,
+      (MQLONG) (maxBytes - used), msgBuffer + used, &actualLength,
+      &compCode, &compReason);
+
+    /* MQRC_TRUNCATED_MSG_FAILED is a warning, but leaves the message
+     * on the queue: it is no more received than after a failure. */
+    if (compCode == MQCC_FAILED || compReason == MQRC_TRUNCATED_MSG_FAILED) {
+      break;
+    }
+
+    /* A message has been received, possibly truncated. */
+    lengths[count] = actualLength < maxBytes - used ? actualLength : (MQLONG) (maxBytes - used);
+    used += lengths[count];
+    count++;
+
+    if (compCode != MQCC_OK) {
+      break;
+    }
+
+    /* Only wait for the first message of the batch */
+    gmo.Options &= ~MQGMO_WAIT;
+  }
+  Py_END_ALLOW_THREADS
+
+  messages = PyList_New(count);
+  if (messages) {
+    for (i = 0, used = 0; i < count; i++) {
+      item = Py_BuildValue("(s#s#)", msgBuffer + used, (int) lengths[i],
+                           &mDescs[i], PYMQI_MQMD_SIZEOF);
+      if (!item) {
+        Py_DECREF(messages);
+        messages = NULL;
+        break;
+      }
+      PyList_SET_ITEM(messages, i, item);
+      used += lengths[i];
+    }
+  }
+  free(msgBuffer);
+  free(mDescs);
+  free(lengths);
+
+  if (!messages) {
+    return NULL;
+  }
+  return Py_BuildValue("(Ns#lll)", messages, &gmo, PYMQI_MQGMO_SIZEOF,
+                       (long) actualLength, (long) compCode, (long) compReason);
+}
+
+
 static char pymqe_MQBEGIN__doc__[] =
 "MQBEGIN(handle)  \
 \
@@ -715,54 +1613,250 @@ static PyObject *pymqe_MQSET(PyObject *self, PyObject *args) {
   }
 
   Py_BEGIN_ALLOW_THREADS
-  MQSET((MQHCONN) lQmgrHandle, (MQHOBJ) lObjHandle, selectorCount, selectors,
-        intAttrCount, intAttrs, charAttrCount, charAttrs, &compCode, &compReason);
+  MQSET((MQHCONN) lQmgrHandle, (MQHOBJ) lObjHandle, selectorCount, selectors,
+        intAttrCount, intAttrs, charAttrCount, charAttrs, &compCode, &compReason);
+  Py_END_ALLOW_THREADS
+  return Py_BuildValue("(ll)", (long) compCode, (long) compReason);
+}
+
+/* Publish/subscribe - Hannes Wagener 2011 */
+#ifdef MQCMDL_LEVEL_700
+
+static char pymqe_MQSUB__doc__[] =
+"MQSUB(connectionHandle, sd, objectHandle, subHandle, compCode, reasonCode) \
+ \
+Calls the MQI MQSUB(connectionHandle, subDesc, objectHandle, subHandle, compCode, reasonCode) \
+";
+
+static PyObject * pymqe_MQSUB(PyObject *self, PyObject *args) {
+  MQSD *subDescP;
+  MQHOBJ subHandle;
+  MQHOBJ objectHandle;
+  MQLONG compCode, compReason;
+  PyObject *rv;
+
+  char *subDescBuffer;
+  int subDescBufferLength;
+
+
+  long lQmgrHandle;
+
+  if (!PyArg_ParseTuple(args, "ls#l", &lQmgrHandle,
+            &subDescBuffer, &subDescBufferLength,
+            &objectHandle)) {
+    return NULL;
+  }
+  if (checkArgSize(subDescBufferLength, PYMQI_MQSD_SIZEOF, "MQSD")) {
+    return NULL;
+  }
+
+  subDescP = (MQSD *)subDescBuffer;
+
+  Py_BEGIN_ALLOW_THREADS
+  MQSUB((MQHCONN) lQmgrHandle, subDescP, &objectHandle, &subHandle,
+    &compCode, &compReason);
+  Py_END_ALLOW_THREADS
+
+  rv = Py_BuildValue("(s#llll)", subDescP, PYMQI_MQSD_SIZEOF, objectHandle, subHandle,
+             (long) compCode, (long) compReason);
+  return rv;
+
+}
+
+
+/*
+ * Asynchronous consumption. MQCB registers a Python callable as the
+ * message consumer of an object handle, MQCTL starts and stops the
+ * dispatching of messages to the consumers of a connection. The
+ * callable and copies of the MQMD & MQGMO live in a pymqiCallback
+ * allocated by MQCB and released on the MQCBCT_DEREGISTER_CALL that
+ * MQ makes when the consumer is deregistered or its handle closed.
+ */
+typedef struct {
+  PyObject *callable;
+  MQMD mDesc;
+  MQGMO getOpts;
+} pymqiCallback;
+
+static void MQENTRY pymqiCallbackFunction(MQHCONN hConn, MQMD *mDescP, MQGMO *gmoP,
+                                          MQBYTE *buffer, MQCBC *contextP) {
+  pymqiCallback *callback = (pymqiCallback *)contextP->CallbackArea;
+  PyGILState_STATE gilState;
+  PyObject *rv;
+
+  if (!callback) {
+    return;
+  }
+
+  /* Called on an MQ thread: the GIL is only held to call into Python */
+  gilState = PyGILState_Ensure();
+  if (contextP->CallType == MQCBCT_DEREGISTER_CALL) {
+    Py_DECREF(callback->callable);
+    free(callback);
+  } else {
+    rv = PyObject_CallFunction(callback->callable, "(lls#s#s#ll)",
+                               (long) contextP->Hobj, (long) contextP->CallType,
+                               buffer ? (char *) buffer : "",
+                               buffer ? (int) contextP->DataLength : 0,
+                               mDescP ? (char *) mDescP : "",
+                               mDescP ? PYMQI_MQMD_SIZEOF : 0,
+                               gmoP ? (char *) gmoP : "",
+                               gmoP ? PYMQI_MQGMO_SIZEOF : 0,
+                               (long) contextP->CompCode, (long) contextP->Reason);
+    if (rv) {
+      Py_DECREF(rv);
+    } else {
+      PyErr_WriteUnraisable(callback->callable);
+    }
+  }
+  PyGILState_Release(gilState);
+}
+
+static char pymqe_MQCB__doc__[] =
+"MQCB(qMgr, operation, callback, qHandle, mDesc, getOpts, maxlen) \
+ \
+Calls the MQI MQCB(qMgr, operation, callbackDesc, qHandle, mDesc, \
+getOpts) function. With MQOP_REGISTER, callback is registered as the \
+message consumer of qHandle, getting messages of up to maxlen bytes \
+(MQCBD_FULL_MSG_LENGTH for no limit) as described by the mDesc & \
+getOpts string buffers. Once the connection is started with MQCTL, \
+callback is called on an MQ thread as \
+ \
+  callback(qHandle, callType, msg, mDesc, getOpts, comp, reason) \
+ \
+where mDesc & getOpts are the MQMD & MQGMO of the message, empty \
+strings if there is none. Exceptions raised by callback are printed \
+and ignored. The other operations (MQOP_DEREGISTER, MQOP_SUSPEND, \
+MQOP_RESUME) ignore the callback, mDesc, getOpts & maxlen. \
+ \
+The tuple (comp, reason) is returned. \
+";
+
+static PyObject *pymqe_MQCB(PyObject *self, PyObject *args) {
+  MQLONG compCode, compReason;
+  MQCBD callbackDesc = {MQCBD_DEFAULT};
+  char *mDescBuffer;
+  int mDescBufferLength;
+  char *getOptsBuffer;
+  int getOptsBufferLength;
+  pymqiCallback *callback = NULL;
+  PyObject *callable;
+
+  long lQmgrHandle, lqHandle, operation, maxLength;
+
+  if (!PyArg_ParseTuple(args, "llOls#s#l", &lQmgrHandle, &operation,
+            &callable, &lqHandle, &mDescBuffer, &mDescBufferLength,
+            &getOptsBuffer, &getOptsBufferLength, &maxLength)) {
+    return NULL;
+  }
+
+  if (operation == MQOP_REGISTER) {
+    if (!PyCallable_Check(callable)) {
+      PyErr_SetString(PyExc_TypeError, "callback must be callable");
+      return NULL;
+    }
+    if (checkArgSize(mDescBufferLength, PYMQI_MQMD_SIZEOF, "MQMD")) {
+      return NULL;
+    }
+    if (checkArgSize(getOptsBufferLength, PYMQI_MQGMO_SIZEOF, "MQGMO")) {
+      return NULL;
+    }
+    if (!(callback = malloc(sizeof(pymqiCallback)))) {
+      PyErr_SetString(ErrorObj, "No memory for callback");
+      return NULL;
+    }
+    Py_INCREF(callable);
+    callback->callable = callable;
+    memcpy(&callback->mDesc, mDescBuffer, sizeof(MQMD));
+    memcpy(&callback->getOpts, getOptsBuffer, sizeof(MQGMO));
+
+    callbackDesc.CallbackType = MQCBT_MESSAGE_CONSUMER;
+    callbackDesc.Options = MQCBDO_DEREGISTER_CALL | MQCBDO_FAIL_IF_QUIESCING;
+    callbackDesc.CallbackArea = callback;
+    callbackDesc.CallbackFunction = (MQPTR) pymqiCallbackFunction;
+    callbackDesc.MaxMsgLength = (MQLONG) maxLength;
+  }
+
+  Py_BEGIN_ALLOW_THREADS
+  MQCB((MQHCONN) lQmgrHandle, (MQLONG) operation, &callbackDesc, (MQHOBJ) lqHandle,
+       callback ? &callback->mDesc : NULL, callback ? &callback->getOpts : NULL,
+       &compCode, &compReason);
+  Py_END_ALLOW_THREADS
+
+  /* No deregister call will come for a consumer that was not registered */
+  if (callback && compCode == MQCC_FAILED) {
+    Py_DECREF(callback->callable);
+    free(callback);
+  }
+  return Py_BuildValue("(ll)", (long) compCode, (long) compReason);
+}
+
+static char pymqe_MQCTL__doc__[] =
+"MQCTL(qMgr, operation, options) \
+ \
+Calls the MQI MQCTL(qMgr, operation, controlOpts) function, with the \
+Options of the MQCTLO set to options, to start (MQOP_START, \
+MQOP_START_WAIT), stop, suspend or resume the delivery of messages \
+to the callbacks registered with MQCB. The GIL is released for the \
+duration of the call. The tuple (comp, reason) is returned. \
+";
+
+static PyObject *pymqe_MQCTL(PyObject *self, PyObject *args) {
+  MQLONG compCode, compReason;
+  MQCTLO controlOpts = {MQCTLO_DEFAULT};
+
+  long lQmgrHandle, operation, options;
+
+  if (!PyArg_ParseTuple(args, "lll", &lQmgrHandle, &operation, &options)) {
+    return NULL;
+  }
+  controlOpts.Options = (MQLONG) options;
+
+  Py_BEGIN_ALLOW_THREADS
+  MQCTL((MQHCONN) lQmgrHandle, (MQLONG) operation, &controlOpts,
+        &compCode, &compReason);
   Py_END_ALLOW_THREADS
   return Py_BuildValue("(ll)", (long) compCode, (long) compReason);
 }
 
-/* Publish/subscribe - Hannes Wagener 2011 */
-#ifdef MQCMDL_LEVEL_700
-
-static char pymqe_MQSUB__doc__[] =
-"MQSUB(connectionHandle, sd, objectHandle, subHandle, compCode, reasonCode) \
+static char pymqe_MQSTAT__doc__[] =
+"MQSTAT(qMgr, type, sts) \
  \
-Calls the MQI MQSUB(connectionHandle, subDesc, objectHandle, subHandle, compCode, reasonCode) \
+Calls the MQI MQSTAT(qMgr, type, sts) function to retrieve status \
+information of the connection, such as the outcome of the puts made \
+with MQPMO_ASYNC_RESPONSE since the previous call, when type is \
+MQSTAT_TYPE_ASYNC_ERROR. sts is a string buffer containing a MQSTS \
+structure. \
+ \
+The tuple (sts, comp, reason) is returned, where sts is a copy of the \
+updated MQSTS structure. \
+ \
+If sts is the wrong size, an exception is raised. \
 ";
 
-static PyObject * pymqe_MQSUB(PyObject *self, PyObject *args) {
-  MQSD *subDescP;
-  MQHOBJ subHandle;
-  MQHOBJ objectHandle;
+static PyObject *pymqe_MQSTAT(PyObject *self, PyObject *args) {
   MQLONG compCode, compReason;
-  PyObject *rv;
-
-  char *subDescBuffer;
-  int subDescBufferLength;
-
+  char *stsBuffer;
+  int stsBufferLength;
+  MQSTS sts;
 
-  long lQmgrHandle;
+  long lQmgrHandle, statType;
 
-  if (!PyArg_ParseTuple(args, "ls#l", &lQmgrHandle,
-            &subDescBuffer, &subDescBufferLength,
-            &objectHandle)) {
+  if (!PyArg_ParseTuple(args, "lls#", &lQmgrHandle, &statType,
+            &stsBuffer, &stsBufferLength)) {
     return NULL;
   }
-  if (checkArgSize(subDescBufferLength, PYMQI_MQSD_SIZEOF, "MQSD")) {
+  if (checkArgSize(stsBufferLength, PYMQI_MQSTS_SIZEOF, "MQSTS")) {
     return NULL;
   }
-
-  subDescP = (MQSD *)subDescBuffer;
+  memcpy(&sts, stsBuffer, PYMQI_MQSTS_SIZEOF);
 
   Py_BEGIN_ALLOW_THREADS
-  MQSUB((MQHCONN) lQmgrHandle, subDescP, &objectHandle, &subHandle,
-    &compCode, &compReason);
+  MQSTAT((MQHCONN) lQmgrHandle, (MQLONG) statType, &sts, &compCode, &compReason);
   Py_END_ALLOW_THREADS
 
-  rv = Py_BuildValue("(s#llll)", subDescP, PYMQI_MQSD_SIZEOF, objectHandle, subHandle,
-             (long) compCode, (long) compReason);
-  return rv;
-
+  return Py_BuildValue("(s#ll)", (char *) &sts, PYMQI_MQSTS_SIZEOF,
+                       (long) compCode, (long) compReason);
 }
 
 #endif /* MQCMDL_LEVEL_700 */
@@ -837,16 +1931,17 @@ static PyObject* pymqe_MQSETMP(PyObject *self, PyObject *args) {
   long property_type;
 
   char *property_value;
+  int property_value_length;
   long value_length;
 
   MQLONG comp_code = MQCC_UNKNOWN, comp_reason = MQRC_NONE;
   PyObject *rv;
 
-  if (!PyArg_ParseTuple(args, "lls#s#s#lsl", &conn_handle, &msg_handle, &smpo_buffer,
+  if (!PyArg_ParseTuple(args, "lls#s#s#ls#l", &conn_handle, &msg_handle, &smpo_buffer,
                         &smpo_buffer_length,
                         &property_name, &property_name_length,
                         &pd_buffer, &pd_buffer_length, &property_type,
-                        &property_value, &value_length)) {
+                        &property_value, &property_value_length, &value_length)) {
     return NULL;
   }
 
@@ -874,6 +1969,189 @@ static PyObject* pymqe_MQSETMP(PyObject *self, PyObject *args) {
 
 }
 
+/*
+ * Convert a Python object to a property value of the given MQTYPE,
+ * into the storage of 'value', or pointing into the object itself for
+ * strings. Returns -1 with an exception set if it can't be converted.
+ */
+typedef union {
+  MQBOOL b;
+  MQINT8 i8;
+  MQINT16 i16;
+  MQINT32 i32;
+  MQINT64 i64;
+  MQFLOAT32 f32;
+  MQFLOAT64 f64;
+} pymqiPropertyValue;
+
+static int propertyBuffer(MQLONG type, PyObject *obj, pymqiPropertyValue *value,
+                          MQBYTE **buffer, MQLONG *length) {
+  const void *data;
+  Py_ssize_t dataLength;
+
+  *buffer = (MQBYTE *)value;
+  switch (type) {
+  case MQTYPE_NULL:
+    *buffer = NULL;
+    *length = 0;
+    return 0;
+  case MQTYPE_BOOLEAN:
+    if ((value->b = PyObject_IsTrue(obj)) < 0) {
+      return -1;
+    }
+    *length = sizeof(MQBOOL);
+    return 0;
+  case MQTYPE_INT8:
+  case MQTYPE_INT16:
+  case MQTYPE_INT32:
+  case MQTYPE_INT64:
+    value->i64 = PyLong_AsLongLong(obj);
+    if (value->i64 == -1 && PyErr_Occurred()) {
+      return -1;
+    }
+    if ((type == MQTYPE_INT8 && (value->i64 < -0x80 || value->i64 > 0x7f)) ||
+        (type == MQTYPE_INT16 && (value->i64 < -0x8000 || value->i64 > 0x7fff)) ||
+        (type == MQTYPE_INT32 && (value->i64 < -0x7fffffffLL - 1 ||
+                                  value->i64 > 0x7fffffffLL))) {
+      PyErr_SetString(PyExc_OverflowError,
+                      "property value out of range for its MQTYPE");
+      return -1;
+    }
+    if (type == MQTYPE_INT8) {
+      value->i8 = (MQINT8) value->i64;
+      *length = sizeof(MQINT8);
+    } else if (type == MQTYPE_INT16) {
+      value->i16 = (MQINT16) value->i64;
+      *length = sizeof(MQINT16);
+    } else if (type == MQTYPE_INT32) {
+      value->i32 = (MQINT32) value->i64;
+      *length = sizeof(MQINT32);
+    } else {
+      *length = sizeof(MQINT64);
+    }
+    return 0;
+  case MQTYPE_FLOAT32:
+  case MQTYPE_FLOAT64:
+    value->f64 = PyFloat_AsDouble(obj);
+    if (value->f64 == -1.0 && PyErr_Occurred()) {
+      return -1;
+    }
+    if (type == MQTYPE_FLOAT32) {
+      value->f32 = (MQFLOAT32) value->f64;
+      *length = sizeof(MQFLOAT32);
+    } else {
+      *length = sizeof(MQFLOAT64);
+    }
+    return 0;
+  default:
+    /* As for messages, a unicode string goes in the default encoding;
+     * its raw internal buffer is no byte string. */
+    if (PyUnicode_Check(obj)) {
+      if (type != MQTYPE_STRING) {
+        PyErr_SetString(PyExc_TypeError,
+                        "a unicode value must be an MQTYPE_STRING property");
+        return -1;
+      }
+      if (!(obj = _PyUnicode_AsDefaultEncodedString(obj, NULL))) {
+        return -1;
+      }
+    }
+    if (PyObject_AsReadBuffer(obj, &data, &dataLength)) {
+      return -1;
+    }
+    *buffer = (MQBYTE *)data;
+    *length = (MQLONG) dataLength;
+    return 0;
+  }
+}
+
+static char pymqe_MQSETMP_MANY__doc__[] =
+"MQSETMP_MANY(conn_handle, msg_handle, smpo, pd, properties) \
+ \
+Calls the MQI's MQSETMP function for each (name, type, value) tuple \
+of the sequence properties, with the same smpo & pd string buffers. \
+value is converted according to type: ints or longs for the integer \
+types, floats for the floating point ones, any true or false value \
+for MQTYPE_BOOLEAN, a string or other object exporting the buffer \
+interface for MQTYPE_STRING & MQTYPE_BYTE_STRING, or a unicode string, \
+in the default encoding, for MQTYPE_STRING. It is ignored for \
+MQTYPE_NULL. An integer out of the range of its type raises \
+OverflowError. The calls stop at the first failure. \
+ \
+The tuple (comp, reason, index) is returned, where index is the index \
+of the property which failed, -1 if none did. \
+";
+
+static PyObject* pymqe_MQSETMP_MANY(PyObject *self, PyObject *args) {
+
+  long conn_handle, msg_handle;
+
+  char *smpo_buffer;
+  int smpo_buffer_length;
+
+  char *pd_buffer;
+  int pd_buffer_length;
+
+  MQSMPO smpo;
+  MQPD pd;
+
+  MQCHARV name = {MQCHARV_DEFAULT};
+  char *property_name;
+  int property_name_length;
+  long property_type;
+  PyObject *properties, *fast, *item, *obj;
+
+  pymqiPropertyValue value;
+  MQBYTE *buffer;
+  MQLONG length;
+
+  MQLONG comp_code = MQCC_OK, comp_reason = MQRC_NONE;
+  Py_ssize_t i, count;
+
+  if (!PyArg_ParseTuple(args, "lls#s#O", &conn_handle, &msg_handle,
+                        &smpo_buffer, &smpo_buffer_length,
+                        &pd_buffer, &pd_buffer_length, &properties)) {
+    return NULL;
+  }
+  if (checkArgSize(smpo_buffer_length, PYMQI_MQSMPO_SIZEOF, "MQSMPO")) {
+    return NULL;
+  }
+  if (checkArgSize(pd_buffer_length, PYMQI_MQPD_SIZEOF, "MQPD")) {
+    return NULL;
+  }
+  if (!(fast = PySequence_Fast(properties, "properties must be a sequence"))) {
+    return NULL;
+  }
+
+  count = PySequence_Fast_GET_SIZE(fast);
+  for (i = 0; i < count; i++) {
+    item = PySequence_Fast_GET_ITEM(fast, i);
+    if (!PyArg_ParseTuple(item, "s#lO", &property_name, &property_name_length,
+                          &property_type, &obj) ||
+        propertyBuffer((MQLONG) property_type, obj, &value, &buffer, &length)) {
+      Py_DECREF(fast);
+      return NULL;
+    }
+
+    /* MQSETMP may update them, every property starts from the caller's */
+    memcpy(&smpo, smpo_buffer, PYMQI_MQSMPO_SIZEOF);
+    memcpy(&pd, pd_buffer, PYMQI_MQPD_SIZEOF);
+    name.VSPtr = property_name;
+    name.VSLength = property_name_length;
+
+    /* The GIL is kept: the properties go to the storage of the handle */
+    MQSETMP(conn_handle, msg_handle, &smpo, &name, &pd, (MQLONG) property_type, length,
+            buffer, &comp_code, &comp_reason);
+    if (comp_code == MQCC_FAILED) {
+      break;
+    }
+  }
+  Py_DECREF(fast);
+
+  return Py_BuildValue("(lll)", (long)comp_code, (long)comp_reason,
+                       (long)(comp_code == MQCC_FAILED ? i : -1));
+}
+
 static char pymqe_MQINQMP__doc__[] =
 "MQINQMP(conn_handle, msg_handle, smpo, name, pd, type, max_value_length) \
  \
@@ -906,20 +2184,368 @@ static PyObject* pymqe_MQINQMP(PyObject *self, PyObject *args) {
     return NULL;
   }
 
-  value = malloc(max_value_length * sizeof(MQBYTE));
-  
+  if (!(value = malloc(max_value_length * sizeof(MQBYTE)))) {
+    PyErr_SetString(ErrorObj, "No memory for property value");
+    return NULL;
+  }
+
   impo.Options = impo_options;
   pd.Options = pd_options;
 
   name.VSPtr = property_name;
   name.VSLength = property_name_length;
 
-  MQINQMP(conn_handle, msg_handle, &impo, &name, &pd, &property_type, sizeof(value),
+  actual_value_length = 0;
+  Py_BEGIN_ALLOW_THREADS
+  MQINQMP(conn_handle, msg_handle, &impo, &name, &pd, &property_type, (MQLONG) max_value_length,
     value, &actual_value_length, &comp_code, &comp_reason);
+  Py_END_ALLOW_THREADS
 
-  rv = Py_BuildValue("(lls)", (long)comp_code, (long)comp_reason, (char *)value);
+  /* A value too big for the buffer is truncated to its length */
+  if (actual_value_length > max_value_length) {
+    actual_value_length = max_value_length;
+  }
+
+  rv = Py_BuildValue("(lls#)", (long)comp_code, (long)comp_reason, (char *)value,
+                     (int) actual_value_length);
   free(value);
-  
+
+  return rv;
+
+}
+
+static char pymqe_MQDLTMH__doc__[] =
+"MQDLTMH(conn_handle, msg_handle, dmho) \
+ \
+Calls the MQI's MQDLTMH function to delete the message handle and \
+release its properties. The tuple (comp, reason) is returned. \
+";
+
+static PyObject* pymqe_MQDLTMH(PyObject *self, PyObject *args) {
+
+  long conn_handle, msg_handle;
+
+  char *dmho_buffer;
+  int dmho_buffer_length;
+  MQDMHO *dmho;
+  MQHMSG hmsg;
+
+  MQLONG comp_code = MQCC_UNKNOWN, comp_reason = MQRC_NONE;
+
+  if (!PyArg_ParseTuple(args, "lls#", &conn_handle, &msg_handle,
+                        &dmho_buffer, &dmho_buffer_length)) {
+    return NULL;
+  }
+  if (checkArgSize(dmho_buffer_length, PYMQI_MQDMHO_SIZEOF, "MQDMHO")) {
+    return NULL;
+  }
+  dmho = (MQDMHO *)dmho_buffer;
+  hmsg = (MQHMSG) msg_handle;
+
+  Py_BEGIN_ALLOW_THREADS
+  MQDLTMH(conn_handle, &hmsg, dmho, &comp_code, &comp_reason);
+  Py_END_ALLOW_THREADS
+
+  return Py_BuildValue("(ll)", (long)comp_code, (long)comp_reason);
+}
+
+static char pymqe_MQMHBUF__doc__[] =
+"MQMHBUF(conn_handle, msg_handle, mhbo, name, mDesc, maxlen) \
+ \
+Calls the MQI's MQMHBUF function to convert the properties of the \
+message handle whose names match name, such as '%' for all of them, \
+to a buffer of at most maxlen bytes, in MQRFH2 format with the \
+MQMHBO_PROPERTIES_IN_MQRFH2 option. mhbo & mDesc are string buffers \
+containing a MQMHBO and a MQMD structure. \
+ \
+The tuple (buffer, mDesc, dataLength, comp, reason) is returned, where \
+mDesc is a copy of the updated MQMD and dataLength the length of the \
+converted properties, which may exceed maxlen. \
+";
+
+static PyObject* pymqe_MQMHBUF(PyObject *self, PyObject *args) {
+
+  long conn_handle, msg_handle;
+
+  char *mhbo_buffer;
+  int mhbo_buffer_length;
+  char *mDescBuffer;
+  int mDescBufferLength;
+  MQMHBO *mhbo;
+  MQMD mDesc;
+
+  MQCHARV name = {MQCHARV_DEFAULT};
+  char *property_name;
+  int property_name_length;
+
+  long maxLength;
+  MQLONG dataLength = 0;
+  char *buffer;
+  PyObject *rv;
+
+  MQLONG comp_code = MQCC_UNKNOWN, comp_reason = MQRC_NONE;
+
+  if (!PyArg_ParseTuple(args, "lls#s#s#l", &conn_handle, &msg_handle,
+                        &mhbo_buffer, &mhbo_buffer_length,
+                        &property_name, &property_name_length,
+                        &mDescBuffer, &mDescBufferLength, &maxLength)) {
+    return NULL;
+  }
+  if (checkArgSize(mhbo_buffer_length, PYMQI_MQMHBO_SIZEOF, "MQMHBO")) {
+    return NULL;
+  }
+  if (checkArgSize(mDescBufferLength, PYMQI_MQMD_SIZEOF, "MQMD")) {
+    return NULL;
+  }
+  mhbo = (MQMHBO *)mhbo_buffer;
+  memcpy(&mDesc, mDescBuffer, PYMQI_MQMD_SIZEOF);
+
+  name.VSPtr = property_name;
+  name.VSLength = property_name_length;
+
+  if (!(buffer = malloc(maxLength > 0 ? maxLength : 1))) {
+    PyErr_SetString(ErrorObj, "No memory for properties");
+    return NULL;
+  }
+
+  Py_BEGIN_ALLOW_THREADS
+  MQMHBUF(conn_handle, msg_handle, mhbo, &name, &mDesc, (MQLONG) maxLength, buffer,
+          &dataLength, &comp_code, &comp_reason);
+  Py_END_ALLOW_THREADS
+
+  rv = Py_BuildValue("(s#s#lll)", buffer, (int) (dataLength < maxLength ? dataLength : maxLength),
+                     (char *) &mDesc, PYMQI_MQMD_SIZEOF, (long) dataLength,
+                     (long)comp_code, (long)comp_reason);
+  free(buffer);
+  return rv;
+}
+
+static char pymqe_MQBUFMH__doc__[] =
+"MQBUFMH(conn_handle, msg_handle, bmho, mDesc, buffer) \
+ \
+Calls the MQI's MQBUFMH function to move the MQRFH2 properties at the \
+start of the message buffer to the message handle. bmho & mDesc are \
+string buffers containing a MQBMHO and a MQMD structure. \
+ \
+The tuple (buffer, mDesc, comp, reason) is returned, where buffer is \
+the message without the properties, with MQBMHO_DELETE_PROPERTIES, and \
+mDesc a copy of the updated MQMD. \
+";
+
+static PyObject* pymqe_MQBUFMH(PyObject *self, PyObject *args) {
+
+  long conn_handle, msg_handle;
+
+  char *bmho_buffer;
+  int bmho_buffer_length;
+  char *mDescBuffer;
+  int mDescBufferLength;
+  MQBMHO *bmho;
+  MQMD mDesc;
+
+  char *msgBuffer;
+  int msgBufferLength;
+  MQLONG dataLength = 0;
+  char *buffer;
+  PyObject *rv;
+
+  MQLONG comp_code = MQCC_UNKNOWN, comp_reason = MQRC_NONE;
+
+  if (!PyArg_ParseTuple(args, "lls#s#s#", &conn_handle, &msg_handle,
+                        &bmho_buffer, &bmho_buffer_length,
+                        &mDescBuffer, &mDescBufferLength,
+                        &msgBuffer, &msgBufferLength)) {
+    return NULL;
+  }
+  if (checkArgSize(bmho_buffer_length, PYMQI_MQBMHO_SIZEOF, "MQBMHO")) {
+    return NULL;
+  }
+  if (checkArgSize(mDescBufferLength, PYMQI_MQMD_SIZEOF, "MQMD")) {
+    return NULL;
+  }
+  bmho = (MQBMHO *)bmho_buffer;
+  memcpy(&mDesc, mDescBuffer, PYMQI_MQMD_SIZEOF);
+
+  /* MQBUFMH updates the buffer in place, work on a copy */
+  if (!(buffer = malloc(msgBufferLength > 0 ? msgBufferLength : 1))) {
+    PyErr_SetString(ErrorObj, "No memory for message");
+    return NULL;
+  }
+  memcpy(buffer, msgBuffer, msgBufferLength);
+
+  Py_BEGIN_ALLOW_THREADS
+  MQBUFMH(conn_handle, msg_handle, bmho, &mDesc, (MQLONG) msgBufferLength, buffer,
+          &dataLength, &comp_code, &comp_reason);
+  Py_END_ALLOW_THREADS
+
+  if (comp_code == MQCC_FAILED) {
+    dataLength = msgBufferLength;
+  }
+  rv = Py_BuildValue("(s#s#ll)", buffer, (int) dataLength,
+                     (char *) &mDesc, PYMQI_MQMD_SIZEOF,
+                     (long)comp_code, (long)comp_reason);
+  free(buffer);
+  return rv;
+}
+
+/*
+ * Convert a property value of the given MQTYPE to a new Python
+ * object. Strings and byte strings are both returned as strings.
+ */
+static PyObject *propertyValue(MQLONG type, MQBYTE *value, MQLONG length) {
+  switch (type) {
+  case MQTYPE_NULL:
+    Py_INCREF(Py_None);
+    return Py_None;
+  case MQTYPE_BOOLEAN:
+    return PyBool_FromLong(*(MQBOOL *)value);
+  case MQTYPE_INT8:
+    return PyInt_FromLong(*(MQINT8 *)value);
+  case MQTYPE_INT16:
+    return PyInt_FromLong(*(MQINT16 *)value);
+  case MQTYPE_INT32:
+    return PyInt_FromLong(*(MQINT32 *)value);
+  case MQTYPE_INT64:
+    return PyLong_FromLongLong(*(MQINT64 *)value);
+  case MQTYPE_FLOAT32:
+    return PyFloat_FromDouble(*(MQFLOAT32 *)value);
+  case MQTYPE_FLOAT64:
+    return PyFloat_FromDouble(*(MQFLOAT64 *)value);
+  default:
+    return PyString_FromStringAndSize((char *)value, length);
+  }
+}
+
+static char pymqe_MQINQMP_ALL__doc__[] =
+"MQINQMP_ALL(conn_handle, msg_handle, name, impo_options, value_length) \
+ \
+Calls the MQI's MQINQMP function, with MQIMPO_INQ_FIRST and then \
+MQIMPO_INQ_NEXT, until all the properties whose name matches name, \
+such as '%' for all of them, have been read. The value buffer starts at value_length bytes and \
+grows as needed. \
+ \
+The tuple (properties, comp, reason) is returned, where properties is \
+a dictionary of the property names and their values, converted to \
+bools, ints, longs, floats, None or strings according to their MQTYPE. \
+";
+
+static PyObject* pymqe_MQINQMP_ALL(PyObject *self, PyObject *args) {
+
+  long conn_handle, msg_handle;
+  long impo_options;
+  long value_length;
+
+  MQCHARV name = {MQCHARV_DEFAULT};
+  char *property_name;
+  int property_name_length = 0;
+
+  MQLONG property_type;
+  MQLONG actual_value_length;
+  MQLONG comp_code = MQCC_UNKNOWN, comp_reason = MQRC_NONE;
+
+  MQBYTE *value, *grown;
+  char *returned_name, *grown_name;
+  MQLONG returned_name_size = 256;
+  MQIMPO impo = {MQIMPO_DEFAULT};
+  MQPD pd = {MQPD_DEFAULT};
+
+  PyObject *properties, *key, *item, *rv;
+
+  if (!PyArg_ParseTuple(args, "lls#ll", &conn_handle, &msg_handle,
+                        &property_name, &property_name_length,
+                        &impo_options, &value_length)) {
+    return NULL;
+  }
+  if (value_length < 16) {
+    value_length = 16;
+  }
+
+  value = malloc(value_length);
+  returned_name = malloc(returned_name_size);
+  if (!value || !returned_name) {
+    free(value);
+    free(returned_name);
+    PyErr_SetString(ErrorObj, "No memory for properties");
+    return NULL;
+  }
+  if (!(properties = PyDict_New())) {
+    free(value);
+    free(returned_name);
+    return NULL;
+  }
+
+  name.VSPtr = property_name;
+  name.VSLength = property_name_length;
+  /* Start from the first property, whatever the cursor of the handle */
+  impo_options &= ~(MQIMPO_INQ_NEXT | MQIMPO_INQ_PROP_UNDER_CURSOR);
+  impo.Options = impo_options | MQIMPO_INQ_FIRST;
+
+  /*
+   * The GIL is kept: the properties are read from the storage of the
+   * message handle, without going to the queue manager.
+   */
+  for (;;) {
+    impo.ReturnedName.VSPtr = returned_name;
+    impo.ReturnedName.VSBufSize = returned_name_size;
+    property_type = MQTYPE_AS_SET;
+    actual_value_length = 0;
+
+    MQINQMP(conn_handle, msg_handle, &impo, &name, &pd, &property_type, (MQLONG) value_length,
+      value, &actual_value_length, &comp_code, &comp_reason);
+
+    /* The cursor is on the property, inquire it again with larger buffers */
+    if (comp_reason == MQRC_PROPERTY_VALUE_TOO_BIG) {
+      value_length = actual_value_length > value_length ? actual_value_length : 2 * value_length;
+      if (!(grown = realloc(value, value_length))) {
+        break;
+      }
+      value = grown;
+      impo.Options = impo_options | MQIMPO_INQ_PROP_UNDER_CURSOR;
+      continue;
+    }
+    if (comp_reason == MQRC_PROPERTY_NAME_TOO_BIG) {
+      returned_name_size = impo.ReturnedName.VSLength > returned_name_size ?
+        impo.ReturnedName.VSLength : 2 * returned_name_size;
+      if (!(grown_name = realloc(returned_name, returned_name_size))) {
+        break;
+      }
+      returned_name = grown_name;
+      impo.Options = impo_options | MQIMPO_INQ_PROP_UNDER_CURSOR;
+      continue;
+    }
+    if (comp_code == MQCC_FAILED) {
+      if (comp_reason == MQRC_PROPERTY_NOT_AVAILABLE) {
+        comp_code = MQCC_OK;
+        comp_reason = MQRC_NONE;
+      }
+      break;
+    }
+
+    key = PyString_FromStringAndSize(returned_name, impo.ReturnedName.VSLength);
+    item = propertyValue(property_type, value, actual_value_length);
+    if (!key || !item || PyDict_SetItem(properties, key, item)) {
+      Py_XDECREF(key);
+      Py_XDECREF(item);
+      Py_DECREF(properties);
+      free(value);
+      free(returned_name);
+      return NULL;
+    }
+    Py_DECREF(key);
+    Py_DECREF(item);
+    impo.Options = impo_options | MQIMPO_INQ_NEXT;
+  }
+
+  free(value);
+  free(returned_name);
+  if (comp_reason == MQRC_PROPERTY_VALUE_TOO_BIG || comp_reason == MQRC_PROPERTY_NAME_TOO_BIG) {
+    Py_DECREF(properties);
+    PyErr_SetString(ErrorObj, "No memory for property");
+    return NULL;
+  }
+
+  rv = Py_BuildValue("(Oll)", properties, (long)comp_code, (long)comp_reason);
+  Py_DECREF(properties);
   return rv;
 
 }
@@ -1490,7 +3116,10 @@ static struct PyMethodDef pymqe_methods[] = {
   {"MQCLOSE", (PyCFunction)pymqe_MQCLOSE, METH_VARARGS, pymqe_MQCLOSE__doc__},
   {"MQPUT", (PyCFunction)pymqe_MQPUT, METH_VARARGS, pymqe_MQPUT__doc__},
   {"MQPUT1", (PyCFunction)pymqe_MQPUT1, METH_VARARGS, pymqe_MQPUT1__doc__},
+  {"MQPUT_MANY", (PyCFunction)pymqe_MQPUT_MANY, METH_VARARGS, pymqe_MQPUT_MANY__doc__},
   {"MQGET", (PyCFunction)pymqe_MQGET, METH_VARARGS, pymqe_MQGET__doc__},
+  {"MQGET_INTO", (PyCFunction)pymqe_MQGET_INTO, METH_VARARGS, pymqe_MQGET_INTO__doc__},
+  {"MQGET_MANY", (PyCFunction)pymqe_MQGET_MANY, METH_VARARGS, pymqe_MQGET_MANY__doc__},
   {"MQBEGIN", (PyCFunction)pymqe_MQBEGIN, METH_VARARGS, pymqe_MQBEGIN__doc__},
   {"MQCMIT", (PyCFunction)pymqe_MQCMIT, METH_VARARGS, pymqe_MQCMIT__doc__},
   {"MQBACK", (PyCFunction)pymqe_MQBACK, METH_VARARGS, pymqe_MQBACK__doc__},
@@ -1501,9 +3130,17 @@ static struct PyMethodDef pymqe_methods[] = {
 #endif
 #ifdef MQCMDL_LEVEL_700
   {"MQSUB", (PyCFunction)pymqe_MQSUB, METH_VARARGS, pymqe_MQSUB__doc__},
+  {"MQCB", (PyCFunction)pymqe_MQCB, METH_VARARGS, pymqe_MQCB__doc__},
+  {"MQCTL", (PyCFunction)pymqe_MQCTL, METH_VARARGS, pymqe_MQCTL__doc__},
+  {"MQSTAT", (PyCFunction)pymqe_MQSTAT, METH_VARARGS, pymqe_MQSTAT__doc__},
   {"MQCRTMH", (PyCFunction)pymqe_MQCRTMH, METH_VARARGS, pymqe_MQCRTMH__doc__},
   {"MQSETMP", (PyCFunction)pymqe_MQSETMP, METH_VARARGS, pymqe_MQSETMP__doc__},
+  {"MQSETMP_MANY", (PyCFunction)pymqe_MQSETMP_MANY, METH_VARARGS, pymqe_MQSETMP_MANY__doc__},
   {"MQINQMP", (PyCFunction)pymqe_MQINQMP, METH_VARARGS, pymqe_MQINQMP__doc__},
+  {"MQINQMP_ALL", (PyCFunction)pymqe_MQINQMP_ALL, METH_VARARGS, pymqe_MQINQMP_ALL__doc__},
+  {"MQDLTMH", (PyCFunction)pymqe_MQDLTMH, METH_VARARGS, pymqe_MQDLTMH__doc__},
+  {"MQMHBUF", (PyCFunction)pymqe_MQMHBUF, METH_VARARGS, pymqe_MQMHBUF__doc__},
+  {"MQBUFMH", (PyCFunction)pymqe_MQBUFMH, METH_VARARGS, pymqe_MQBUFMH__doc__},
 #endif
   {NULL, (PyCFunction)NULL, 0, NULL}        /* sentinel */
 };
@@ -1521,6 +3158,9 @@ __declspec(dllexport)
      void initpymqe(void) {
   PyObject *m, *d;
 
+  /* Callbacks registered with MQCB run on threads created by MQ */
+  PyEval_InitThreads();
+
   /* Create the module and add the functions */
   m = Py_InitModule4("pymqe", pymqe_methods,
              pymqe_module_documentation,
@@ -1531,6 +3171,16 @@ __declspec(dllexport)
   ErrorObj = PyErr_NewException("pymqe.error", NULL, NULL);
   PyDict_SetItemString(d, "pymqe.error", ErrorObj);
 
+  /* The native MQI structures */
+  if (initStructType(&MQMD_Type, "pymqe.MQMD", "MQMD([buff], **kw)\n\nMQMD Message Descriptor structure.", mdFields) ||
+      initStructType(&MQGMO_Type, "pymqe.MQGMO", "MQGMO([buff], **kw)\n\nMQGMO Get Message Options structure.", gmoFields) ||
+      initStructType(&MQPMO_Type, "pymqe.MQPMO", "MQPMO([buff], **kw)\n\nMQPMO Put Message Options structure.", pmoFields)) {
+    return;
+  }
+  PyDict_SetItemString(d, "MQMD", (PyObject *)&MQMD_Type);
+  PyDict_SetItemString(d, "MQGMO", (PyObject *)&MQGMO_Type);
+  PyDict_SetItemString(d, "MQPMO", (PyObject *)&MQPMO_Type);
+
   PyDict_SetItemString(d, "__doc__", PyString_FromString(pymqe_doc));
   PyDict_SetItemString(d,"__version__", PyString_FromString(__version__));
 
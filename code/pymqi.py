@@ -37,6 +37,8 @@ The classes are:
     * SMPO - MQI MQSMPO structure class
     * SRO - MQI MQSRO structure class
     * SD - MQI MQSD structure class
+    * STS - MQI MQSTS structure class
+    * DMHO, BMHO, MHBO - MQI MQDMHO, MQBMHO and MQMHBO structure classes
     * TM - MQI MQTM structure class
     * TMC2- MQI MQTMC2 structure class
     * Filter/StringFilter/IntegerFilter - PCF/MQAI filters
@@ -54,12 +56,16 @@ The following MQI operations are supported:
     * MQCONN, MQDISC (QueueManager.connect()/QueueManager.disconnect())
     * MQCONNX (QueueManager.connectWithOptions())
     * MQOPEN/MQCLOSE (Queue.open(), Queue.close(), Topic.open(), Topic.close())
-    * MQPUT/MQPUT1/MQGET (Queue.put(), QueueManager.put1(), Queue.get())
+    * MQPUT/MQPUT1/MQGET (Queue.put(), QueueManager.put1(), Queue.get(),
+      Queue.get_into(), Queue.put_many(), AsyncQueue.get(), AsyncQueue.put())
     * MQCMIT/MQBACK (QueueManager.commit()/QueueManager.backout())
     * MQBEGIN (QueueuManager.begin())
     * MQINQ (QueueManager.inquire(), Queue.inquire())
     * MQSET (Queue.set())
     * MQSUB (Subscription.sub())
+    * MQCB/MQCTL (Queue.register_callback(), QueueManager.start_consuming(),
+      QueueManager.stop_consuming())
+    * MQSTAT (QueueManager.check_async_status())
     * And various MQAI PCF commands.
 
 The supported command levels (from 5.0 onwards) for the version of MQI
@@ -87,15 +93,28 @@ PCF commands and inquiries are executed by calling a MQCMD_* method on
 an instance of a PCFExecute object.
 
 Pymqi is thread safe. Pymqi objects have the same thread scope as
-their MQI counterparts.
+their MQI counterparts. An md, gmo or pmo passed to a put or get is
+updated in place by it, without the GIL held when pymqe provides the
+native structures, so it must not be used by another thread during the
+call.
 
 """
 
 # Stdlib
+import os
 import struct
 import exceptions
+import operator
+import keyword
+import re
 import types
 import threading
+import time
+import traceback
+import heapq
+import signal
+import multiprocessing
+import collections
 import ctypes
 # import xml parser.  lxml/etree only available since python 2.5
 use_minidom = False
@@ -153,7 +172,126 @@ else:
 #######################################################################
 
 
-class MQOpts:
+class _MQOptsCodec:
+    """Precompiled pack/unpack support for one MQOpts member layout.
+
+    Building the struct format string, compiling it and working out
+    which members are arrays is done once per distinct layout rather
+    than on every pack()/unpack() call. Codecs are shared by all
+    MQOpts instances with the same layout and are never modified after
+    construction. Module Private.
+
+    Members are stored by a function generated for the layout, which
+    assigns all of them in one tuple-unpacking statement. This works
+    the same for instances with a __dict__ and for the __slots__ based
+    md, gmo and pmo structures."""
+
+    def __init__(self, members):
+        self.members = tuple([tuple(i) for i in members])
+        self.names = tuple([i[0] for i in self.members])
+        self.defaults = tuple([(i[0], i[1]) for i in self.members])
+        self.values = tuple([i[1] for i in self.members])
+        self.format = ''.join([i[2] for i in self.members])
+        self.struct = struct.Struct(self.format)
+        self.size = self.struct.size
+        # Array members (such as MQCD.MsgCompList) have to be
+        # flattened before packing, everything else is fetched with a
+        # single attrgetter call.
+        self.has_arrays = False
+        for i in self.members:
+            if type(i[1]) is types.ListType:
+                self.has_arrays = True
+        if len(self.names) == 1:
+            getter = operator.attrgetter(self.names[0])
+            self.getter = lambda obj: (getter(obj),)
+        else:
+            self.getter = operator.attrgetter(*self.names)
+        self.setter = self.__makeSetter()
+
+    def __makeSetter(self):
+        # RFH2 folder names come from XML tags and need not be valid
+        # Python identifiers, use setattr for those.
+        for name in self.names:
+            if not _identifier.match(name) or keyword.iskeyword(name):
+                names = self.names
+                def setter(obj, values):
+                    for name, value in zip(names, values):
+                        setattr(obj, name, value)
+                return setter
+        source = 'def setter(obj, values):\n    (%s,) = values\n' % \
+                 ', '.join(['obj.' + name for name in self.names])
+        namespace = {}
+        exec source in namespace
+        return namespace['setter']
+
+    def init(self, obj):
+        "Set the members of 'obj' to their default values."
+        self.setter(obj, self.values)
+        if self.has_arrays:
+            # Array defaults must not be shared between instances.
+            for name, value in self.defaults:
+                if type(value) is types.ListType:
+                    setattr(obj, name, value[:])
+
+    def pack(self, obj):
+        "Pack the members of 'obj' into a 'C' structure string."
+        if not self.has_arrays:
+            return self.struct.pack(*self.getter(obj))
+        args = []
+        for v in self.getter(obj):
+            # Flatten attribs that are arrays
+            if type(v) is types.ListType:
+                args.extend(v)
+            else:
+                args.append(v)
+        return self.struct.pack(*args)
+
+    def unpack(self, obj, buff):
+        "Unpack the 'C' structure string 'buff' into 'obj'."
+        # Unpack returns a tuple of the unpacked data, in the same
+        # order as in the member list.
+        values = self.struct.unpack(buff)
+        if self.has_arrays:
+            values = values[:len(self.names)]
+        self.setter(obj, values)
+
+# Layouts which vary per message (such as RFH2 headers with their
+# folders) would otherwise grow the cache without bounds.
+_codecCacheMaxSize = 256
+_identifier = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+_codecCache = {}
+_codecCacheLock = threading.Lock()
+
+def _getCodec(members, cls=None):
+    """Return the shared _MQOptsCodec for a member list. Structures with
+    a fixed layout keep it in a class-level '_fields' tuple so their
+    codec can be found without looking at the members. Module Private."""
+    if cls is not None and members is getattr(cls, '_fields', None):
+        codec = cls.__dict__.get('_fieldsCodec')
+        if codec is None:
+            codec = _getCodec(members)
+            cls._fieldsCodec = codec
+        return codec
+    key = []
+    for i in members:
+        if type(i[1]) is types.ListType:
+            key.append((i[0], tuple(i[1]), i[2]))
+        else:
+            key.append((i[0], i[1], i[2]))
+    key = tuple(key)
+    codec = _codecCache.get(key)
+    if codec is None:
+        codec = _MQOptsCodec(members)
+        _codecCacheLock.acquire()
+        try:
+            if len(_codecCache) < _codecCacheMaxSize:
+                codec = _codecCache.setdefault(key, codec)
+        finally:
+            _codecCacheLock.release()
+    return codec
+
+
+class MQOpts(object):
     """Base class for packing/unpacking MQI Option structures. It is
     constructed with a list defining the member/attribute name,
     default value (from the CMQC module) and the member pack format
@@ -180,7 +318,13 @@ class MQOpts:
     buffer into an MQOpts instance.
 
     Applications are not expected to use MQOpts directly. Instead,
-    MQOpts is sub-classed as particular MQI structures."""
+    MQOpts is sub-classed as particular MQI structures.
+
+    Sub-classes with a fixed layout may list their members in
+    __slots__, in which case instances have no __dict__ and only the
+    structure members may be set on them."""
+
+    __slots__ = ('__codec',)
 
     def __init__(self, list, **kw):
         """MQOpts(memberList [,**kw])
@@ -190,15 +334,13 @@ class MQOpts:
     optional keyword dictionary that may be used to override default
     values set by MQOpts sub-classes."""
 
-        self.__list = list[:]
-        self.__format = ''
-        # Creat the structure members as instance attributes and build
-        # the struct.pack/unpack format string. The attribute name is
-        # identical to the 'C' structure member name.
-        for i in list:
-            setattr(self, i[0], i[1])
-            self.__format = self.__format + i[2]
-        apply(MQOpts.set, (self,), kw)
+        codec = _getCodec(list, self.__class__)
+        self.__codec = codec
+        # Creat the structure members as instance attributes. The
+        # attribute name is identical to the 'C' structure member name.
+        codec.init(self)
+        if kw:
+            apply(MQOpts.set, (self,), kw)
 
     def pack(self):
         """ pack()
@@ -207,32 +349,14 @@ class MQOpts:
         calls. The pack order is as defined to the MQOpts
         ctor. Returns the structure as a string buffer"""
 
-        # Build tuple for struct.pack() argument. Start with format
-        # string.
-        args = [self.__format]
-        # Now add the current attribute values to the tuple
-        for i in self.__list:
-            v = getattr(self, i[0])
-            # Flatten attribs that are arrays
-            if type(v) is types.ListType:
-                for x in v:
-                    args.append(x)
-            else:
-                args.append(v)
-        return apply(struct.pack, args)
+        return self.__codec.pack(self)
 
     def unpack(self, buff):
         """unpack(buff)
 
         Unpack a 'C' structure 'buff' into self."""
 
-        # Unpack returns a tuple of the unpacked data, in the same
-        # order (I hope!) as in the ctor's list arg.
-        r = struct.unpack(self.__format, buff)
-        x = 0
-        for i in self.__list:
-            setattr(self, i[0], r[x])
-            x = x + 1
+        self.__codec.unpack(self, buff)
 
     def set(self, **kw):
         """set(**kw)
@@ -265,10 +389,7 @@ class MQOpts:
         Return a dictionary of the current structure member
         values. The dictionary is keyed by a 'C' member name."""
 
-        d = {}
-        for i in self.__list:
-            d[i[0]] = getattr(self, i[0])
-        return d
+        return dict(zip(self.__codec.names, self.__codec.getter(self)))
 
     def __getitem__(self, key):
         """__getitem__(key)
@@ -283,8 +404,8 @@ class MQOpts:
         Pretty Print Structure."""
 
         rv = ''
-        for i in self.__list:
-            rv = rv + str(i[0]) + ': ' + str(getattr(self, i[0])) + '\n'
+        for i in self.__codec.names:
+            rv = rv + str(i) + ': ' + str(getattr(self, i)) + '\n'
         # Chop the trailing newline
         return rv[:-1]
 
@@ -294,6 +415,22 @@ class MQOpts:
         Return the packed buffer as a printable string."""
         return str(self.pack())
 
+    def __getstate__(self):
+        # The precompiled codec can't be pickled, its member list is
+        # stored instead.
+        state = {}
+        if hasattr(self, '__dict__'):
+            state.update(self.__dict__)
+            state.pop('_vs_buffers', None)
+        state.update(self.get())
+        return (self.__codec.members, state)
+
+    def __setstate__(self, state):
+        members, values = state
+        self.__codec = _getCodec(members, self.__class__)
+        for k, v in values.items():
+            setattr(self, k, v)
+
     def get_length(self):
         """get_length()
 
@@ -301,7 +438,7 @@ class MQOpts:
 
         """
 
-        return struct.calcsize(self.__format)
+        return self.__codec.size
 
     def set_vs(self, vs_name, vs_value=None, vs_offset=0, vs_buffer_size=0,
                vs_ccsid=0):
@@ -321,12 +458,10 @@ class MQOpts:
 
         """
 
-        vs_name_vsptr = ""
         #if the VSPtr name is passed - remove VSPtr to be left with name.
         if vs_name.endswith("VSPtr"):
-            vs_name_vsptr = vs_name
-        else:
-            vs_name_vsptr = vs_name + "VSPtr"
+            vs_name = vs_name[:-len("VSPtr")]
+        vs_name_vsptr = vs_name + "VSPtr"
 
         vs_name_vsoffset = vs_name + "VSOffset"
         vs_name_vsbuffsize = vs_name + "VSBufSize"
@@ -335,15 +470,21 @@ class MQOpts:
 
         c_vs_value = None
         c_vs_value_p = 0
+        vs_length = 0
 
         if vs_value is not None:
             c_vs_value = ctypes.create_string_buffer(vs_value)
             c_vs_value_p = ctypes.cast(c_vs_value, ctypes.c_void_p).value
+            vs_length = len(vs_value)
+
+        # The structure only holds the address of the string, keep the
+        # buffer alive for as long as the structure.
+        self.__dict__.setdefault('_vs_buffers', {})[vs_name] = c_vs_value
 
         self[vs_name_vsptr] = c_vs_value_p
         self[vs_name_vsoffset] = vs_offset
         self[vs_name_vsbuffsize] = vs_buffer_size
-        self[vs_name_vslength] = len(vs_value)
+        self[vs_name_vslength] = vs_length
         self[vs_name_vsccsid] = vs_ccsid
 
     def get_vs(self, vs_name):
@@ -379,28 +520,31 @@ class gmo(MQOpts):
     default values may be overridden by the optional keyword arguments
     'kw'."""
 
-    def __init__(self, **kw):
-        opts = [['StrucId', CMQC.MQGMO_STRUC_ID, '4s'],
-            ['Version', CMQC.MQGMO_VERSION_1, MQLONG_TYPE],
-            ['Options', CMQC.MQGMO_NO_WAIT, MQLONG_TYPE],
-            ['WaitInterval', 0, MQLONG_TYPE],
-            ['Signal1', 0, MQLONG_TYPE],
-            ['Signal2', 0, MQLONG_TYPE],
-            ['ResolvedQName', '', '48s'],
-            ['MatchOptions', CMQC.MQMO_MATCH_MSG_ID+CMQC.MQMO_MATCH_CORREL_ID, MQLONG_TYPE],
-            ['GroupStatus', CMQC.MQGS_NOT_IN_GROUP, 'b'],
-            ['SegmentStatus', CMQC.MQSS_NOT_A_SEGMENT, 'b'],
-            ['Segmentation', CMQC.MQSEG_INHIBITED, 'b'],
-            ['Reserved1', ' ', 'c'],
-            ['MsgToken', '', '16s'],
-            ['ReturnedLength', CMQC.MQRL_UNDEFINED, MQLONG_TYPE],]
-
-        if "7.0" in pymqe.__mqlevels__:
-            opts += [
-                ['Reserved2', 0L, MQLONG_TYPE],
-                ['MsgHandle', 0L, 'q']]
+    _fields = [['StrucId', CMQC.MQGMO_STRUC_ID, '4s'],
+        ['Version', CMQC.MQGMO_VERSION_1, MQLONG_TYPE],
+        ['Options', CMQC.MQGMO_NO_WAIT, MQLONG_TYPE],
+        ['WaitInterval', 0, MQLONG_TYPE],
+        ['Signal1', 0, MQLONG_TYPE],
+        ['Signal2', 0, MQLONG_TYPE],
+        ['ResolvedQName', '', '48s'],
+        ['MatchOptions', CMQC.MQMO_MATCH_MSG_ID+CMQC.MQMO_MATCH_CORREL_ID, MQLONG_TYPE],
+        ['GroupStatus', CMQC.MQGS_NOT_IN_GROUP, 'b'],
+        ['SegmentStatus', CMQC.MQSS_NOT_A_SEGMENT, 'b'],
+        ['Segmentation', CMQC.MQSEG_INHIBITED, 'b'],
+        ['Reserved1', ' ', 'c'],
+        ['MsgToken', '', '16s'],
+        ['ReturnedLength', CMQC.MQRL_UNDEFINED, MQLONG_TYPE],]
+
+    if "7.0" in pymqe.__mqlevels__:
+        _fields += [
+            ['Reserved2', 0L, MQLONG_TYPE],
+            ['MsgHandle', 0L, 'q']]
+
+    _fields = tuple(_fields)
+    __slots__ = tuple([i[0] for i in _fields])
 
-        apply(MQOpts.__init__, (self, tuple(opts)), kw)
+    def __init__(self, **kw):
+        apply(MQOpts.__init__, (self, self._fields), kw)
 
 # Backward compatibility
 GMO = gmo
@@ -413,33 +557,36 @@ class pmo(MQOpts):
     default values may be overridden by the optional keyword arguments
     'kw'."""
 
-    def __init__(self, **kw):
-        opts = [
-            ['StrucId', CMQC.MQPMO_STRUC_ID, '4s'],
-            ['Version', CMQC.MQPMO_VERSION_1, MQLONG_TYPE],
-            ['Options', CMQC.MQPMO_NONE, MQLONG_TYPE],
-            ['Timeout', -1, MQLONG_TYPE],
-            ['Context', 0, MQLONG_TYPE],
-            ['KnownDestCount', 0, MQLONG_TYPE],
-            ['UnknownDestCount', 0, MQLONG_TYPE],
-            ['InvalidDestCount', 0, MQLONG_TYPE],
-            ['ResolvedQName', '', '48s'],
-            ['ResolvedQMgrName', '', '48s'],
-            ['RecsPresent', 0, MQLONG_TYPE],
-            ['PutMsgRecFields',  0, MQLONG_TYPE],
-            ['PutMsgRecOffset', 0, MQLONG_TYPE],
-            ['ResponseRecOffset', 0, MQLONG_TYPE],
-            ['PutMsgRecPtr', 0, 'P'],
-            ['ResponseRecPtr', 0, 'P']]
-
-        if "7.0" in pymqe.__mqlevels__:
-            opts += [
-                ['OriginalMsgHandle', 0L, 'q'],
-                ['NewMsgHandle', 0L, 'q'],
-                ['Action', 0L, MQLONG_TYPE],
-                ['PubLevel', 0L, MQLONG_TYPE]]
+    _fields = [
+        ['StrucId', CMQC.MQPMO_STRUC_ID, '4s'],
+        ['Version', CMQC.MQPMO_VERSION_1, MQLONG_TYPE],
+        ['Options', CMQC.MQPMO_NONE, MQLONG_TYPE],
+        ['Timeout', -1, MQLONG_TYPE],
+        ['Context', 0, MQLONG_TYPE],
+        ['KnownDestCount', 0, MQLONG_TYPE],
+        ['UnknownDestCount', 0, MQLONG_TYPE],
+        ['InvalidDestCount', 0, MQLONG_TYPE],
+        ['ResolvedQName', '', '48s'],
+        ['ResolvedQMgrName', '', '48s'],
+        ['RecsPresent', 0, MQLONG_TYPE],
+        ['PutMsgRecFields',  0, MQLONG_TYPE],
+        ['PutMsgRecOffset', 0, MQLONG_TYPE],
+        ['ResponseRecOffset', 0, MQLONG_TYPE],
+        ['PutMsgRecPtr', 0, 'P'],
+        ['ResponseRecPtr', 0, 'P']]
+
+    if "7.0" in pymqe.__mqlevels__:
+        _fields += [
+            ['OriginalMsgHandle', 0L, 'q'],
+            ['NewMsgHandle', 0L, 'q'],
+            ['Action', 0L, MQLONG_TYPE],
+            ['PubLevel', 0L, MQLONG_TYPE]]
+
+    _fields = tuple(_fields)
+    __slots__ = tuple([i[0] for i in _fields])
 
-        apply(MQOpts.__init__, (self, tuple(opts)), kw)
+    def __init__(self, **kw):
+        apply(MQOpts.__init__, (self, self._fields), kw)
 
 # Backward compatibility
 PMO = pmo
@@ -451,58 +598,60 @@ class od(MQOpts):
     default values may be overridden by the optional keyword arguments
     'kw'."""
 
-    def __init__(self, **kw):
-        opts = [['StrucId', CMQC.MQOD_STRUC_ID, '4s'],
-            ['Version', CMQC.MQOD_VERSION_1, MQLONG_TYPE],
-            ['ObjectType', CMQC.MQOT_Q, MQLONG_TYPE],
-            ['ObjectName', '', '48s'],
-            ['ObjectQMgrName', '', '48s'],
-            ['DynamicQName', 'AMQ.*', '48s'],
-            ['AlternateUserId', '', '12s'],
-            ['RecsPresent', 0, MQLONG_TYPE],
-            ['KnownDestCount', 0, MQLONG_TYPE],
-            ['UnknownDestCount', 0, MQLONG_TYPE],
-            ['InvalidDestCount', 0, MQLONG_TYPE],
-            ['ObjectRecOffset', 0, MQLONG_TYPE],
-            ['ResponseRecOffset', 0, MQLONG_TYPE],
-            ['ObjectRecPtr', 0, 'P'],
-            ['ResponseRecPtr', 0, 'P'],
-            ['AlternateSecurityId', '', '40s'],
-            ['ResolvedQName', '', '48s'],
-            ['ResolvedQMgrName', '', '48s'],]
-
-        if "7.0" in pymqe.__mqlevels__:
-            opts += [
-
-                # ObjectString
-                ['ObjectStringVSPtr', 0, 'P'],
-                ['ObjectStringVSOffset', 0L, MQLONG_TYPE],
-                ['ObjectStringVSBufSize', 0L, MQLONG_TYPE],
-                ['ObjectStringVSLength', 0L, MQLONG_TYPE],
-                ['ObjectStringVSCCSID', 0L, MQLONG_TYPE],
-
-                # SelectionString
-                ['SelectionStringVSPtr', 0, 'P'],
-                ['SelectionStringVSOffset', 0L, MQLONG_TYPE],
-                ['SelectionStringVSBufSize', 0L, MQLONG_TYPE],
-                ['SelectionStringVSLength', 0L, MQLONG_TYPE],
-                ['SelectionStringVSCCSID', 0L, MQLONG_TYPE],
-
-                # ResObjectString
-                ['ResObjectStringVSPtr', 0, 'P'],
-                ['ResObjectStringVSOffset', 0L, MQLONG_TYPE],
-                ['ResObjectStringVSBufSize', 0L, MQLONG_TYPE],
-                ['ResObjectStringVSLength', 0L, MQLONG_TYPE],
-                ['ResObjectStringVSCCSID', 0L, MQLONG_TYPE],
-
-                ['ResolvedType', -3L, MQLONG_TYPE]]
-
-            # For 64bit platforms MQLONG is an int and this pad
-            # needs to be here for WMQ 7.0
-            if MQLONG_TYPE == 'i':
-                opts += [['pad','', '4s']]
+    _fields = [['StrucId', CMQC.MQOD_STRUC_ID, '4s'],
+        ['Version', CMQC.MQOD_VERSION_1, MQLONG_TYPE],
+        ['ObjectType', CMQC.MQOT_Q, MQLONG_TYPE],
+        ['ObjectName', '', '48s'],
+        ['ObjectQMgrName', '', '48s'],
+        ['DynamicQName', 'AMQ.*', '48s'],
+        ['AlternateUserId', '', '12s'],
+        ['RecsPresent', 0, MQLONG_TYPE],
+        ['KnownDestCount', 0, MQLONG_TYPE],
+        ['UnknownDestCount', 0, MQLONG_TYPE],
+        ['InvalidDestCount', 0, MQLONG_TYPE],
+        ['ObjectRecOffset', 0, MQLONG_TYPE],
+        ['ResponseRecOffset', 0, MQLONG_TYPE],
+        ['ObjectRecPtr', 0, 'P'],
+        ['ResponseRecPtr', 0, 'P'],
+        ['AlternateSecurityId', '', '40s'],
+        ['ResolvedQName', '', '48s'],
+        ['ResolvedQMgrName', '', '48s'],]
+
+    if "7.0" in pymqe.__mqlevels__:
+        _fields += [
+
+            # ObjectString
+            ['ObjectStringVSPtr', 0, 'P'],
+            ['ObjectStringVSOffset', 0L, MQLONG_TYPE],
+            ['ObjectStringVSBufSize', 0L, MQLONG_TYPE],
+            ['ObjectStringVSLength', 0L, MQLONG_TYPE],
+            ['ObjectStringVSCCSID', 0L, MQLONG_TYPE],
+
+            # SelectionString
+            ['SelectionStringVSPtr', 0, 'P'],
+            ['SelectionStringVSOffset', 0L, MQLONG_TYPE],
+            ['SelectionStringVSBufSize', 0L, MQLONG_TYPE],
+            ['SelectionStringVSLength', 0L, MQLONG_TYPE],
+            ['SelectionStringVSCCSID', 0L, MQLONG_TYPE],
+
+            # ResObjectString
+            ['ResObjectStringVSPtr', 0, 'P'],
+            ['ResObjectStringVSOffset', 0L, MQLONG_TYPE],
+            ['ResObjectStringVSBufSize', 0L, MQLONG_TYPE],
+            ['ResObjectStringVSLength', 0L, MQLONG_TYPE],
+            ['ResObjectStringVSCCSID', 0L, MQLONG_TYPE],
+
+            ['ResolvedType', -3L, MQLONG_TYPE]]
+
+        # For 64bit platforms MQLONG is an int and this pad
+        # needs to be here for WMQ 7.0
+        if MQLONG_TYPE == 'i':
+            _fields += [['pad','', '4s']]
+
+    _fields = tuple(_fields)
 
-        apply(MQOpts.__init__, (self, tuple(opts)), kw)
+    def __init__(self, **kw):
+        apply(MQOpts.__init__, (self, self._fields), kw)
 
 # Backward compatibility
 OD = od
@@ -514,41 +663,168 @@ class md(MQOpts):
     default values may be overridden by the optional keyword arguments
     'kw'."""
 
+    _fields = (
+        ['StrucId', CMQC.MQMD_STRUC_ID, '4s'],
+        ['Version', CMQC.MQMD_VERSION_1, MQLONG_TYPE],
+        ['Report', CMQC.MQRO_NONE, MQLONG_TYPE],
+        ['MsgType', CMQC.MQMT_DATAGRAM, MQLONG_TYPE],
+        ['Expiry', CMQC.MQEI_UNLIMITED, MQLONG_TYPE],
+        ['Feedback', CMQC.MQFB_NONE, MQLONG_TYPE],
+        ['Encoding', CMQC.MQENC_NATIVE, MQLONG_TYPE],
+        ['CodedCharSetId', CMQC.MQCCSI_Q_MGR, MQLONG_TYPE],
+        ['Format', '', '8s'],
+        ['Priority', CMQC.MQPRI_PRIORITY_AS_Q_DEF, MQLONG_TYPE],
+        ['Persistence', CMQC.MQPER_PERSISTENCE_AS_Q_DEF, MQLONG_TYPE],
+        ['MsgId', '', '24s'],
+        ['CorrelId', '', '24s'],
+        ['BackoutCount', 0, MQLONG_TYPE],
+        ['ReplyToQ', '', '48s'],
+        ['ReplyToQMgr', '', '48s'],
+        ['UserIdentifier', '', '12s'],
+        ['AccountingToken', '', '32s'],
+        ['ApplIdentityData', '', '32s'],
+        ['PutApplType', CMQC.MQAT_NO_CONTEXT, MQLONG_TYPE],
+        ['PutApplName', '', '28s'],
+        ['PutDate', '', '8s'],
+        ['PutTime', '', '8s'],
+        ['ApplOriginData', '', '4s'],
+        ['GroupId', '', '24s'],
+        ['MsgSeqNumber', 1, MQLONG_TYPE],
+        ['Offset', 0, MQLONG_TYPE],
+        ['MsgFlags', CMQC.MQMF_NONE, MQLONG_TYPE],
+        ['OriginalLength', CMQC.MQOL_UNDEFINED, MQLONG_TYPE])
+    __slots__ = tuple([i[0] for i in _fields])
+
     def __init__(self, **kw):
-        apply(MQOpts.__init__, (self, (
-            ['StrucId', CMQC.MQMD_STRUC_ID, '4s'],
-            ['Version', CMQC.MQMD_VERSION_1, MQLONG_TYPE],
-            ['Report', CMQC.MQRO_NONE, MQLONG_TYPE],
-            ['MsgType', CMQC.MQMT_DATAGRAM, MQLONG_TYPE],
-            ['Expiry', CMQC.MQEI_UNLIMITED, MQLONG_TYPE],
-            ['Feedback', CMQC.MQFB_NONE, MQLONG_TYPE],
-            ['Encoding', CMQC.MQENC_NATIVE, MQLONG_TYPE],
-            ['CodedCharSetId', CMQC.MQCCSI_Q_MGR, MQLONG_TYPE],
-            ['Format', '', '8s'],
-            ['Priority', CMQC.MQPRI_PRIORITY_AS_Q_DEF, MQLONG_TYPE],
-            ['Persistence', CMQC.MQPER_PERSISTENCE_AS_Q_DEF, MQLONG_TYPE],
-            ['MsgId', '', '24s'],
-            ['CorrelId', '', '24s'],
-            ['BackoutCount', 0, MQLONG_TYPE],
-            ['ReplyToQ', '', '48s'],
-            ['ReplyToQMgr', '', '48s'],
-            ['UserIdentifier', '', '12s'],
-            ['AccountingToken', '', '32s'],
-            ['ApplIdentityData', '', '32s'],
-            ['PutApplType', CMQC.MQAT_NO_CONTEXT, MQLONG_TYPE],
-            ['PutApplName', '', '28s'],
-            ['PutDate', '', '8s'],
-            ['PutTime', '', '8s'],
-            ['ApplOriginData', '', '4s'],
-            ['GroupId', '', '24s'],
-            ['MsgSeqNumber', 1, MQLONG_TYPE],
-            ['Offset', 0, MQLONG_TYPE],
-            ['MsgFlags', CMQC.MQMF_NONE, MQLONG_TYPE],
-            ['OriginalLength', CMQC.MQOL_UNDEFINED, MQLONG_TYPE])), kw)
+        apply(MQOpts.__init__, (self, self._fields), kw)
 
 # Backward compatibility
 MD = md
 
+if hasattr(pymqe, 'MQMD'):
+
+    class _NativeOpts(object):
+        """Mixin giving the pymqe.MQMD, pymqe.MQGMO & pymqe.MQPMO native
+        structures the MQOpts interface. The native structures hold the
+        'C' structure themselves, and are passed by reference to and
+        updated in place by MQPUT, MQPUT1, MQGET & MQGET_INTO, instead
+        of being packed and unpacked around the calls. Sub-classes
+        define _fields as for MQOpts and _default, the packed
+        structure with the default values.
+
+        The calls update the structure with the GIL released: one
+        which another thread reads, writes or passes to another call
+        meanwhile is a data race. Give each thread its own structures,
+        or pass a copy made with unpack(), e.g.
+
+            copy = md()
+            copy.unpack(mDesc.pack())"""
+
+        __slots__ = ()
+
+        def __init__(self, **kw):
+            self.unpack(self._default)
+            if kw:
+                apply(_NativeOpts.set, (self,), kw)
+
+        def set(self, **kw):
+            """set(**kw)
+
+            Set a structure member using the keyword dictionary 'kw'. An
+            AttributeError exception is raised for invalid member
+            names."""
+
+            for i in kw.keys():
+                getattr(self, str(i))
+                setattr(self, str(i), kw[i])
+
+        def __setitem__(self, key, value):
+            getattr(self, key)
+            setattr(self, key, value)
+
+        def get(self):
+            """get()
+
+            Return a dictionary of the current structure member
+            values. The dictionary is keyed by a 'C' member name."""
+
+            rv = {}
+            for i in self._fields:
+                rv[i[0]] = getattr(self, i[0])
+            return rv
+
+        def __getitem__(self, key):
+            return getattr(self, key)
+
+        def __str__(self):
+            rv = ''
+            for i in self._fields:
+                rv = rv + i[0] + ': ' + str(getattr(self, i[0])) + '\n'
+            # Chop the trailing newline
+            return rv[:-1]
+
+        def __repr__(self):
+            return str(self.pack())
+
+        def __reduce__(self):
+            return (self.__class__, (), self.pack())
+
+        def __setstate__(self, state):
+            if isinstance(state, tuple):
+                # (members, values) of the MQOpts based classes.
+                self.unpack(self._default)
+                values = state[1]
+                for i in self._fields:
+                    if values.has_key(i[0]):
+                        setattr(self, i[0], values[i[0]])
+            else:
+                self.unpack(state)
+
+        def get_length(self):
+            """get_length()
+
+            Returns the length of the packed buffer.
+
+            """
+
+            return len(self._default)
+
+    class gmo(_NativeOpts, pymqe.MQGMO):
+        __doc__ = gmo.__doc__
+        __slots__ = ()
+        _fields = gmo._fields
+        _default = gmo().pack()
+
+    class pmo(_NativeOpts, pymqe.MQPMO):
+        __doc__ = pmo.__doc__
+        __slots__ = ()
+        _fields = pmo._fields
+        _default = pmo().pack()
+
+    class md(_NativeOpts, pymqe.MQMD):
+        __doc__ = md.__doc__
+        __slots__ = ()
+        _fields = md._fields
+        _default = md().pack()
+
+    GMO = gmo
+    PMO = pmo
+    MD = md
+
+    _nativeOpts = (pymqe.MQMD, pymqe.MQGMO, pymqe.MQPMO)
+
+else:
+    _nativeOpts = ()
+
+def _structArg(opts):
+    """Return the MQMD, MQGMO or MQPMO 'opts' as passed to the pymqe
+    MQPUT, MQPUT1, MQGET & MQGET_INTO calls: native structures are
+    passed as they are, the others are packed. Module Private."""
+
+    if isinstance(opts, _nativeOpts):
+        return opts
+    return opts.pack()
+
 # RFH2 Header parsing/creation Support - Hannes Wagener - 2010.
 class RFH2(MQOpts):
     """RFH2(**kw)
@@ -786,6 +1062,31 @@ class TMC2(MQOpts):
             ['UserData', '', '128s'],
             ['QMgrName', '', '48s'])), kw)
 
+
+class DLH(MQOpts):
+    """DLH(**kw)
+
+    Construct a MQDLH Structure, the header of a message on a
+    dead-letter queue, with default values as per MQI. The default
+    values may be overridden by the optional keyword arguments 'kw'.
+
+    """
+
+    def __init__(self, **kw):
+        apply(MQOpts.__init__, (self, (
+            ['StrucId', CMQC.MQDLH_STRUC_ID, '4s'],
+            ['Version', CMQC.MQDLH_VERSION_1, MQLONG_TYPE],
+            ['Reason', CMQC.MQRC_NONE, MQLONG_TYPE],
+            ['DestQName', '', '48s'],
+            ['DestQMgrName', '', '48s'],
+            ['Encoding', 0, MQLONG_TYPE],
+            ['CodedCharSetId', 0, MQLONG_TYPE],
+            ['Format', '', '8s'],
+            ['PutApplType', 0, MQLONG_TYPE],
+            ['PutApplName', '', '28s'],
+            ['PutDate', '', '8s'],
+            ['PutTime', '', '8s'])), kw)
+
 # MQCONNX code courtesy of John OSullivan (mailto:jos@onebox.com)
 # SSL additions courtesy of Brian Vicente (mailto:sailbv@netscape.net)
 
@@ -1113,6 +1414,67 @@ class IMPO(MQOpts):
 
         apply(MQOpts.__init__, (self, tuple(opts)), kw)
 
+class STS(MQOpts):
+    """STS(**kw)
+
+    Construct an MQSTS Structure with default values as per MQI. The
+    default values may be overridden by the optional keyword arguments
+    'kw'."""
+    def __init__(self, **kw):
+        opts = [['StrucId', CMQC.MQSTS_STRUC_ID, '4s'],
+                ['Version', CMQC.MQSTS_VERSION_1, MQLONG_TYPE],
+                ['CompCode', CMQC.MQCC_OK, MQLONG_TYPE],
+                ['Reason', CMQC.MQRC_NONE, MQLONG_TYPE],
+                ['PutSuccessCount', 0L, MQLONG_TYPE],
+                ['PutWarningCount', 0L, MQLONG_TYPE],
+                ['PutFailureCount', 0L, MQLONG_TYPE],
+                ['ObjectType', CMQC.MQOT_Q, MQLONG_TYPE],
+                ['ObjectName', '', '48s'],
+                ['ObjectQMgrName', '', '48s'],
+                ['ResolvedObjectName', '', '48s'],
+                ['ResolvedQMgrName', '', '48s']]
+
+        apply(MQOpts.__init__, (self, tuple(opts)), kw)
+
+class DMHO(MQOpts):
+    """DMHO(**kw)
+
+    Construct an MQDMHO Structure with default values as per MQI. The
+    default values may be overridden by the optional keyword arguments
+    'kw'."""
+    def __init__(self, **kw):
+        opts = [['StrucId', CMQC.MQDMHO_STRUC_ID, '4s'],
+                ['Version', CMQC.MQDMHO_VERSION_1, MQLONG_TYPE],
+                ['Options', CMQC.MQDMHO_NONE, MQLONG_TYPE]]
+
+        apply(MQOpts.__init__, (self, tuple(opts)), kw)
+
+class BMHO(MQOpts):
+    """BMHO(**kw)
+
+    Construct an MQBMHO Structure with default values as per MQI. The
+    default values may be overridden by the optional keyword arguments
+    'kw'."""
+    def __init__(self, **kw):
+        opts = [['StrucId', CMQC.MQBMHO_STRUC_ID, '4s'],
+                ['Version', CMQC.MQBMHO_VERSION_1, MQLONG_TYPE],
+                ['Options', CMQC.MQBMHO_DELETE_PROPERTIES, MQLONG_TYPE]]
+
+        apply(MQOpts.__init__, (self, tuple(opts)), kw)
+
+class MHBO(MQOpts):
+    """MHBO(**kw)
+
+    Construct an MQMHBO Structure with default values as per MQI. The
+    default values may be overridden by the optional keyword arguments
+    'kw'."""
+    def __init__(self, **kw):
+        opts = [['StrucId', CMQC.MQMHBO_STRUC_ID, '4s'],
+                ['Version', CMQC.MQMHBO_VERSION_1, MQLONG_TYPE],
+                ['Options', CMQC.MQMHBO_PROPERTIES_IN_MQRFH2, MQLONG_TYPE]]
+
+        apply(MQOpts.__init__, (self, tuple(opts)), kw)
+
 #
 # A utility to convert a MQ constant to its string mnemonic by groping
 # a module dictonary
@@ -1220,8 +1582,24 @@ class QueueManager:
     """QueueManager encapsulates the connection to the Queue Manager. By
     default, the Queue Manager is implicitly connected. If required,
     the connection may be deferred until a call to connect().
+
+    put_to() keeps the object handles it opens, up to handle_cache_size
+    of them, closing the least recently used one when the cache is
+    full. See handle_cache_stats().
+
+    Queue.open_selected() keeps its handles apart, counting the Queues
+    using each one: a handle in use is never closed by the cache, and
+    up to handle_cache_size unused ones are kept for the next
+    open_selected().
+
+    Both caches and their counters are guarded by one lock, so that
+    threads sharing the connection (MQCNO_HANDLE_SHARE_BLOCK) may use
+    them at the same time.
     """
 
+    # Number of object handles kept open by put_to().
+    handle_cache_size = 64
+
     def __init__(self, name = ''):
         """QueueManager(name = '')
 
@@ -1231,7 +1609,17 @@ class QueueManager:
 
         self.__handle = None
         self.__name = name
+        self.__connectArgs = None
         self.__qmobj = None
+        self.__handles = collections.OrderedDict()
+        self.__handleStats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        # Selector handles: key -> [handle, number of Queues using it],
+        # and the unused ones, least recently released first.
+        self.__selected = {}
+        self.__idleSelected = collections.OrderedDict()
+        # Guards the handles of put_to() and open_selected(), and
+        # __handleStats.
+        self.__handleLock = threading.Lock()
         if name != None:
             self.connect(name)
 
@@ -1262,6 +1650,7 @@ class QueueManager:
             raise MQMIError(rv[1], rv[2])
         self.__handle = rv[0]
         self.__name = name
+        self.__connectArgs = (name, None)
 
 
 # MQCONNX code courtesy of John OSullivan (mailto:jos@onebox.com)
@@ -1311,6 +1700,7 @@ class QueueManager:
             raise MQMIError(rv[1], rv[2])
         self.__handle = rv[0]
         self.__name = name
+        self.__connectArgs = (name, kw)
 
     # Backward compatibility
     connect_with_options = connectWithOptions
@@ -1332,13 +1722,40 @@ class QueueManager:
     # Backward compatibility
     connect_tcp_client = connectTCPClient
 
+    def _newConnection(self):
+        """_newConnection()
+
+        Return a new QueueManager, connected the same way as this one,
+        for a thread which can't use this connection."""
+
+        if self.__connectArgs == None:
+            raise PYIFError('not connected')
+        name, kw = self.__connectArgs
+        qMgr = QueueManager(None)
+        if kw == None:
+            qMgr.connect(name)
+        else:
+            apply(qMgr.connectWithOptions, (name,), kw)
+        return qMgr
+
     def disconnect(self):
         """disconnect()
 
         Disconnect from queue manager, if connected."""
 
         if self.__handle:
+            self.clear_handle_cache()
+            # MQDISC closes the selector handles still in use.
+            self.__handleLock.acquire()
+            try:
+                self.__selected.clear()
+                self.__idleSelected.clear()
+            finally:
+                self.__handleLock.release()
             rv = pymqe.MQDISC(self.__handle)
+            # Don't disconnect again from __del__, MQ may have given the
+            # handle to another connection by then.
+            self.__handle = None
         else:
             raise PYIFError('not connected')
 
@@ -1385,11 +1802,82 @@ class QueueManager:
         if rv[0]:
             raise MQMIError(rv[0], rv[1])
 
+    def check_async_status(self):
+        """check_async_status()
+
+        Return the outcome of the puts made with MQPMO_ASYNC_RESPONSE
+        (see Queue.put()) since the previous call, using MQSTAT. The
+        queue manager only reports counts and the first error, in a
+        dictionary with the keys:
+
+            'succeeded', 'warnings', 'failed' - the number of puts
+            that succeeded, completed with a warning or failed.
+
+            'error' - an MQMIError for the first put that did not
+            succeed, None if all did.
+
+            'object_name', 'queue_manager_name' - the queue and queue
+            manager names of that put, as resolved by the queue
+            manager.
+
+        Calling it every few thousand puts, and before committing, lets
+        a producer notice failures without waiting for each put."""
+
+        rv = pymqe.MQSTAT(self.__handle, CMQC.MQSTAT_TYPE_ASYNC_ERROR,
+                          STS().pack())
+        if rv[1]:
+            raise MQMIError(rv[1], rv[2])
+        sts = STS()
+        sts.unpack(rv[0])
+        error = None
+        if sts.CompCode != CMQC.MQCC_OK:
+            error = MQMIError(sts.CompCode, sts.Reason)
+        objectName = sts.ResolvedObjectName.strip('\0 ') or \
+                     sts.ObjectName.strip('\0 ')
+        qMgrName = sts.ResolvedQMgrName.strip('\0 ') or \
+                   sts.ObjectQMgrName.strip('\0 ')
+        return {'succeeded': sts.PutSuccessCount,
+                'warnings': sts.PutWarningCount,
+                'failed': sts.PutFailureCount,
+                'error': error,
+                'object_name': objectName,
+                'queue_manager_name': qMgrName}
+
+    def start_consuming(self, wait=False):
+        """start_consuming([wait])
+
+        Start delivering messages to the callbacks registered with
+        Queue.register_callback(), using MQCTL. While started, the
+        connection may only be used from the callbacks, except to
+        stop it. If wait is true, start_consuming() returns only once
+        stop_consuming() has been called, typically by a callback."""
+
+        if wait:
+            operation = CMQC.MQOP_START_WAIT
+        else:
+            operation = CMQC.MQOP_START
+        rv = pymqe.MQCTL(self.__handle, operation,
+                         CMQC.MQCTLO_FAIL_IF_QUIESCING)
+        if rv[0]:
+            raise MQMIError(rv[0], rv[1])
+
+    def stop_consuming(self):
+        """stop_consuming()
+
+        Stop delivering messages to the callbacks. Returns once the
+        running callback, if any, has returned."""
+
+        rv = pymqe.MQCTL(self.__handle, CMQC.MQOP_STOP, CMQC.MQCTLO_NONE)
+        if rv[0]:
+            raise MQMIError(rv[0], rv[1])
+
     def put1(self, qDesc, msg, *opts):
         """put1(qDesc, msg [, mDesc, putOpts])
 
-        Put the single message in string buffer 'msg' on the queue
-        using the MQI PUT1 call. This encapsulates calls to MQOPEN,
+        Put the single message in buffer 'msg' on the queue using the
+        MQI PUT1 call. 'msg' may be a string or any other object
+        exporting the buffer interface (bytearray, memoryview, mmap),
+        which is passed to MQI without being copied. This encapsulates calls to MQOPEN,
         MQPUT and MQCLOSE. put1 is the optimal way to put a single
         message on a queue.
 
@@ -1413,12 +1901,164 @@ class QueueManager:
 
         # Now send the message
         rv = pymqe.MQPUT1(self.__handle, makeQDesc(qDesc).pack(),
-                          mDesc.pack(), putOpts.pack(), msg)
+                          _structArg(mDesc), _structArg(putOpts), msg)
+        if rv[-2]:
+            raise MQMIError(rv[-2], rv[-1])
+        mDesc.unpack(rv[0])
+        putOpts.unpack(rv[1])
+
+
+    def put_to(self, qDesc, msg, *opts):
+        """put_to(qDesc, msg[, mDesc, putOpts])
+
+        Put the buffer 'msg' on the queue 'qDesc', a queue name or a
+        pymqi.od() as for put1(). The queue is opened with the option
+        'MQOO_OUTPUT' the first time and its handle is kept in the
+        handle cache for the next calls, which then cost a single MQPUT.
+
+        mDesc and putOpts are as for put1(), and may be updated by the
+        put operation.
+
+        The handle is used under the handle cache lock, so that another
+        thread sharing the connection can't close it meanwhile; MQ
+        serializes the calls of a shared connection anyway."""
+
+        mDesc, putOpts = apply(commonQArgs, opts)
+        if putOpts == None:
+            putOpts = pmo()
+
+        self.__handleLock.acquire()
+        try:
+            key, hObj = self._openCached(qDesc, CMQC.MQOO_OUTPUT)
+            rv = pymqe.MQPUT(self.__handle, hObj, _structArg(mDesc),
+                             _structArg(putOpts), msg)
+            if rv[-2] and rv[-1] in _staleHandleReasons:
+                self.__closeCached(key)
+        finally:
+            self.__handleLock.release()
         if rv[-2]:
             raise MQMIError(rv[-2], rv[-1])
         mDesc.unpack(rv[0])
         putOpts.unpack(rv[1])
 
+    def _openCached(self, qDesc, openOpts):
+        """Return (key, handle) for the object 'qDesc' opened with
+        'openOpts', opening it only if it isn't in the handle cache.
+        The handle cache lock must be held. Module Private."""
+
+        key = _handleCacheKey(qDesc, openOpts)
+        handles = self.__handles
+        hObj = handles.pop(key, None)
+        if hObj is not None:
+            self.__handleStats['hits'] += 1
+            handles[key] = hObj
+            return key, hObj
+
+        self.__handleStats['misses'] += 1
+        rv = pymqe.MQOPEN(self.getHandle(), makeQDesc(qDesc).pack(), openOpts)
+        if rv[-2]:
+            raise MQMIError(rv[-2], rv[-1])
+        handles[key] = rv[0]
+        while len(handles) > self.handle_cache_size:
+            self.__handleStats['evictions'] += 1
+            self.__closeCached(handles.keys()[0])
+        return key, rv[0]
+
+    def __closeCached(self, key):
+        """Remove a handle from the handle cache and close it, with the
+        handle cache lock held."""
+        hObj = self.__handles.pop(key)
+        try:
+            pymqe.MQCLOSE(self.__handle, hObj, CMQC.MQCO_NONE)
+        except:
+            pass
+
+    def _openSelected(self, qDesc, openOpts):
+        """Return (key, handle) for the object 'qDesc' opened with
+        'openOpts' for Queue.open_selected(), sharing the handle of
+        another Queue which opened it the same way. The handle stays
+        open until every Queue has given it back with
+        _releaseSelected(). Module Private."""
+
+        key = _handleCacheKey(qDesc, openOpts)
+        self.__handleLock.acquire()
+        try:
+            entry = self.__selected.get(key)
+            if entry is not None:
+                self.__handleStats['hits'] += 1
+                self.__idleSelected.pop(key, None)
+                entry[1] += 1
+                return key, entry[0]
+            self.__handleStats['misses'] += 1
+            rv = pymqe.MQOPEN(self.getHandle(), makeQDesc(qDesc).pack(),
+                              openOpts)
+            if rv[-2]:
+                raise MQMIError(rv[-2], rv[-1])
+            self.__selected[key] = [rv[0], 1]
+            return key, rv[0]
+        finally:
+            self.__handleLock.release()
+
+    def _releaseSelected(self, key):
+        """Give back a handle of _openSelected(). Once no Queue uses it,
+        it is kept for the next one, the least recently used unused
+        handle being closed beyond handle_cache_size of them. Module
+        Private."""
+
+        self.__handleLock.acquire()
+        try:
+            entry = self.__selected.get(key)
+            if entry is None:
+                # Dropped by disconnect().
+                return
+            entry[1] -= 1
+            if entry[1]:
+                return
+            self.__idleSelected[key] = None
+            while len(self.__idleSelected) > self.handle_cache_size:
+                self.__handleStats['evictions'] += 1
+                self.__closeSelected(self.__idleSelected.keys()[0])
+        finally:
+            self.__handleLock.release()
+
+    def __closeSelected(self, key):
+        "Close an unused selector handle."
+        del self.__idleSelected[key]
+        hObj = self.__selected.pop(key)[0]
+        try:
+            pymqe.MQCLOSE(self.__handle, hObj, CMQC.MQCO_NONE)
+        except:
+            pass
+
+    def clear_handle_cache(self):
+        """clear_handle_cache()
+
+        Close all the object handles kept by put_to(), and those of
+        open_selected() which no Queue is using."""
+
+        self.__handleLock.acquire()
+        try:
+            for key in self.__handles.keys():
+                self.__closeCached(key)
+            for key in self.__idleSelected.keys():
+                self.__closeSelected(key)
+        finally:
+            self.__handleLock.release()
+
+    def handle_cache_stats(self):
+        """handle_cache_stats()
+
+        Return the handle cache counters (hits, misses, evictions),
+        which count the handles of both put_to() and open_selected(),
+        and the current size of the put_to() cache as a dictionary."""
+
+        self.__handleLock.acquire()
+        try:
+            rv = self.__handleStats.copy()
+            rv['size'] = len(self.__handles)
+        finally:
+            self.__handleLock.release()
+        return rv
 
     def inquire(self, attribute):
         """inquire(attribute)
@@ -1457,6 +2097,185 @@ class QueueManager:
 
 
 # Some support functions for Queue ops.
+# MQRR response record of a distribution list.
+_responseRec = struct.Struct(MQLONG_TYPE * 2)
+
+# Reasons for which a cached object handle can't be used any more.
+_staleHandleReasons = (CMQC.MQRC_HOBJ_ERROR, CMQC.MQRC_OBJECT_CHANGED,
+                       CMQC.MQRC_OBJECT_DAMAGED, CMQC.MQRC_Q_DELETED)
+
+
+def _handleCacheKey(qDesc, openOpts):
+    """Return the key of the object 'qDesc' opened with 'openOpts' in
+    the QueueManager's handle caches. It is made of every input field
+    of the MQOD, so objects opened with different alternate user ids,
+    security ids, object strings or selection strings have different
+    handles. Module Private."""
+
+    if type(qDesc) is types.StringType:
+        return (qDesc, openOpts)
+    objectString = selector = None
+    if qDesc.Version >= CMQC.MQOD_VERSION_4:
+        objectString = qDesc.get_vs('ObjectString')
+        selector = qDesc.get_vs('SelectionString')
+    return (qDesc.Version, qDesc.ObjectType, qDesc.ObjectName,
+            qDesc.ObjectQMgrName, qDesc.DynamicQName,
+            qDesc.AlternateUserId, qDesc.AlternateSecurityId,
+            qDesc.RecsPresent, qDesc.ObjectRecOffset,
+            qDesc.ObjectRecPtr, objectString, selector, openOpts)
+
+# Tokens of message selectors: strings, hexadecimal numbers and byte
+# strings (0x1F, 0x414D51...), numbers, identifiers and keywords,
+# operators.
+_selectorToken = re.compile(r"""\s*(?:
+    (?P<string>'(?:[^']|'')*') |
+    (?P<hex>0[xX][0-9A-Fa-f]+(?![\w$.])) |
+    (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?[lLfFdD]?) |
+    (?P<name>[A-Za-z_$][\w$.]*) |
+    (?P<op><>|<=|>=|[=<>+\-*/(),]))""", re.VERBOSE)
+
+_selectorKeywords = ('AND', 'OR', 'NOT', 'IS', 'NULL', 'LIKE', 'ESCAPE',
+                     'BETWEEN', 'IN', 'TRUE', 'FALSE')
+
+# Selectors already found valid, cleared when it holds
+# _selectorCacheSize of them.
+_validSelectors = {}
+_selectorCacheSize = 1024
+
+
+class _SelectorParser(object):
+    """Recursive descent parser checking the syntax of a message
+    selector, the SQL92 subset of JMS. Module Private."""
+
+    def __init__(self, selector):
+        self.tokens = []
+        pos = 0
+        selector = selector.rstrip()
+        while pos < len(selector):
+            m = _selectorToken.match(selector, pos)
+            if not m or m.end() == pos:
+                raise exceptions.ValueError(pos)
+            kind = m.lastgroup
+            value = m.group(kind)
+            if kind == 'name' and value.upper() in _selectorKeywords:
+                kind = value = value.upper()
+            self.tokens.append((kind, value))
+            pos = m.end()
+        self.pos = 0
+
+    def peek(self, *values):
+        if self.pos < len(self.tokens) and \
+           self.tokens[self.pos][1] in values:
+            return self.tokens[self.pos][1]
+        return None
+
+    def accept(self, *values):
+        value = self.peek(*values)
+        if value is not None:
+            self.pos += 1
+        return value
+
+    def expect(self, *values):
+        if self.accept(*values) is None:
+            raise exceptions.ValueError(self.pos)
+
+    def parse(self):
+        self.orExpr()
+        if self.pos != len(self.tokens):
+            raise exceptions.ValueError(self.pos)
+
+    def orExpr(self):
+        self.andExpr()
+        while self.accept('OR'):
+            self.andExpr()
+
+    def andExpr(self):
+        self.notExpr()
+        while self.accept('AND'):
+            self.notExpr()
+
+    def notExpr(self):
+        if self.accept('NOT'):
+            self.notExpr()
+        else:
+            self.comparison()
+
+    def comparison(self):
+        self.arith()
+        if self.accept('=', '<>', '<', '>', '<=', '>='):
+            self.arith()
+        elif self.accept('IS'):
+            self.accept('NOT')
+            self.expect('NULL')
+        else:
+            negated = self.accept('NOT')
+            if self.accept('LIKE'):
+                self.string()
+                if self.accept('ESCAPE'):
+                    self.string()
+            elif self.accept('BETWEEN'):
+                self.arith()
+                self.expect('AND')
+                self.arith()
+            elif self.accept('IN'):
+                self.expect('(')
+                self.literal()
+                while self.accept(','):
+                    self.literal()
+                self.expect(')')
+            elif negated:
+                raise exceptions.ValueError(self.pos)
+
+    def arith(self):
+        self.term()
+        while self.accept('+', '-'):
+            self.term()
+
+    def term(self):
+        self.unary()
+        while self.accept('*', '/'):
+            self.unary()
+
+    def unary(self):
+        if self.accept('+', '-'):
+            self.unary()
+        elif self.accept('('):
+            self.orExpr()
+            self.expect(')')
+        elif self.accept('TRUE', 'FALSE'):
+            pass
+        else:
+            self.operand('string', 'hex', 'number', 'name')
+
+    def string(self):
+        self.operand('string')
+
+    def literal(self):
+        self.operand('string', 'hex', 'number')
+
+    def operand(self, *kinds):
+        if self.pos >= len(self.tokens) or \
+           self.tokens[self.pos][0] not in kinds:
+            raise exceptions.ValueError(self.pos)
+        self.pos += 1
+
+
+def _checkSelector(selector):
+    """Raise MQMIError(MQCC_FAILED, MQRC_SELECTOR_SYNTAX_ERROR), as the
+    queue manager would, if the message selector is not valid. Valid
+    selectors are cached. Module Private."""
+
+    if selector in _validSelectors:
+        return
+    try:
+        _SelectorParser(selector).parse()
+    except exceptions.ValueError:
+        raise MQMIError(CMQC.MQCC_FAILED, CMQC.MQRC_SELECTOR_SYNTAX_ERROR)
+    if len(_validSelectors) >= _selectorCacheSize:
+        _validSelectors.clear()
+    _validSelectors[selector] = True
+
+
 def makeQDesc(qDescOrString):
     "Maybe make MQOD from string. Module Private"
     if type(qDescOrString) is types.StringType:
@@ -1483,6 +2302,314 @@ def commonQArgs(*opts):
 
 common_q_args = commonQArgs
 
+class _GetBufferSizer(object):
+    """Chooses the buffer length of the first MQGET issued by
+    Queue.get() when the caller doesn't give a maximum length. A
+    message that doesn't fit costs a second MQGET, so the length
+    follows a high percentile of recently received message lengths,
+    between 'initial' and 'maximum'. Module Private."""
+
+    # Number of recent message lengths the percentile is taken from,
+    # and how often it's recalculated.
+    window = 256
+    recalculate_every = 32
+    percentile = 0.95
+
+    def __init__(self, initial, maximum):
+        self.initial = initial
+        self.maximum = maximum
+        self.length = initial
+        self.__lengths = []
+        self.__next = 0
+        self.__pending = 0
+        self.gets = 0
+        self.retries = 0
+        self.retries_avoided = 0
+
+    def observe(self, length, retried):
+        """observe(length, retried)
+
+        Record the length of a message received by Queue.get() and
+        whether a second MQGET was needed to receive it."""
+
+        self.gets += 1
+        if retried:
+            self.retries += 1
+        elif length > self.initial:
+            self.retries_avoided += 1
+
+        if len(self.__lengths) < self.window:
+            self.__lengths.append(length)
+        else:
+            self.__lengths[self.__next] = length
+            self.__next = (self.__next + 1) % self.window
+
+        self.__pending += 1
+        if retried or self.__pending >= self.recalculate_every:
+            self.__pending = 0
+            lengths = sorted(self.__lengths)
+            wanted = lengths[int(self.percentile * (len(lengths) - 1))]
+            # Round up to a whole number of 4KB pages.
+            wanted = (wanted + 4095) & ~4095
+            self.length = max(self.initial, min(self.maximum, wanted))
+
+    def stats(self):
+        """stats()
+
+        Return the sizing counters as a dictionary."""
+
+        return {'gets': self.gets,
+                'retries': self.retries,
+                'retries_avoided': self.retries_avoided,
+                'buffer_length': self.length}
+
+
+class _MessagePrefetcher(object):
+    """Background thread getting messages for Queue.iter_messages() into
+    a deque of at most 'prefetch' messages. The messages are got from
+    'queue' or, if 'opener' is a (factory, qDesc, openOpts) tuple, from
+    a queue the thread opens on its own connection. On its own
+    connection the thread gets under syncpoint, commits once every
+    message it got has been returned by next() and backs out the
+    others when stopped. Module Private."""
+
+    # Marks the end of the messages in the deque.
+    end = object()
+
+    def __init__(self, queue, prefetch, wait_interval, stop_on_empty,
+                 mDesc, getOpts, opener=None):
+        if prefetch < 1:
+            raise exceptions.ValueError('prefetch must be at least 1')
+        self.queue = queue
+        self.opener = opener
+        self.prefetch = prefetch
+        self.stop_on_empty = stop_on_empty
+        self.__mDesc = mDesc.pack()
+        # Work on a copy, the caller's getOpts is left alone.
+        opts = gmo()
+        opts.unpack(getOpts.pack())
+        opts.Options = opts.Options | CMQC.MQGMO_WAIT
+        opts.WaitInterval = wait_interval
+        if opener is not None:
+            # The thread owns the unit of work, see __getLoop().
+            opts.Options = opts.Options & ~(CMQC.MQGMO_NO_SYNCPOINT |
+                CMQC.MQGMO_SYNCPOINT_IF_PERSISTENT) | CMQC.MQGMO_SYNCPOINT
+        self.__getOpts = opts.pack()
+        self.__messages = collections.deque()
+        self.__cond = threading.Condition()
+        self.__stopped = False
+        self.__ended = False
+        # Messages in the deque, and returned by next() but not
+        # committed yet.
+        self.__pending = 0
+        self.__returned = 0
+        # Number of messages put back on the queue by the last MQBACK.
+        self.backed_out = 0
+        self.__thread = threading.Thread(target=self.run,
+                                         name='pymqi-prefetch')
+        self.__thread.setDaemon(True)
+
+    def start(self):
+        self.__thread.start()
+
+    def run(self):
+        "Thread body: get messages until stopped."
+        if self.opener == None:
+            self.__getLoop(self.queue)
+            return
+        factory, qDesc, openOpts = self.opener
+        try:
+            qMgr = factory()
+        except Exception, e:
+            self.__append(e)
+            return
+        try:
+            try:
+                queue = Queue(qMgr, qDesc, openOpts)
+            except Exception, e:
+                self.__append(e)
+                return
+            try:
+                try:
+                    self.__getLoop(queue, qMgr)
+                finally:
+                    self.__endUnitOfWork(qMgr)
+            finally:
+                try:
+                    queue.close()
+                except:
+                    pass
+        finally:
+            try:
+                qMgr.disconnect()
+            except:
+                pass
+
+    def __append(self, item):
+        cond = self.__cond
+        cond.acquire()
+        try:
+            self.__messages.append(item)
+            if isinstance(item, tuple):
+                self.__pending = self.__pending + 1
+            else:
+                self.__ended = True
+            cond.notifyAll()
+        finally:
+            cond.release()
+
+    def __waitForWork(self, syncpoint):
+        """Wait until the thread is stopped, must commit or may get
+        another message. Return 'stop', 'commit' or 'get'."""
+
+        cond = self.__cond
+        cond.acquire()
+        try:
+            while 1:
+                if self.__stopped:
+                    return 'stop'
+                if syncpoint and self.__returned:
+                    # Don't get more until the unit of work holds only
+                    # returned messages, which are then committed.
+                    if not self.__pending:
+                        self.__returned = 0
+                        return 'commit'
+                elif not self.__ended and self.__pending < self.prefetch:
+                    return 'get'
+                # Backpressure, wait for the consumer to make room.
+                cond.wait()
+        finally:
+            cond.release()
+
+    def __getLoop(self, queue, qMgr=None):
+        while 1:
+            step = self.__waitForWork(qMgr is not None)
+            if step == 'stop':
+                return
+            if step == 'commit':
+                try:
+                    qMgr.commit()
+                except Exception, e:
+                    self.__append(e)
+                continue
+
+            mDesc, getOpts = md(), gmo()
+            mDesc.unpack(self.__mDesc)
+            getOpts.unpack(self.__getOpts)
+            try:
+                item = (queue.get(None, mDesc, getOpts), mDesc)
+            except MQMIError, e:
+                if e.reason != CMQC.MQRC_NO_MSG_AVAILABLE:
+                    item = e
+                elif self.stop_on_empty:
+                    item = self.end
+                else:
+                    continue
+            except Exception, e:
+                item = e
+            self.__append(item)
+
+    def __endUnitOfWork(self, qMgr):
+        """Once stopped, commit the messages returned by next() or, if
+        some were never returned, back out the whole unit of work;
+        MQDISC would commit it."""
+
+        cond = self.__cond
+        cond.acquire()
+        try:
+            pending, returned = self.__pending, self.__returned
+        finally:
+            cond.release()
+        try:
+            if pending:
+                qMgr.backout()
+                self.backed_out = pending + returned
+            elif returned:
+                qMgr.commit()
+        except Exception:
+            pass
+
+    def next(self):
+        """next()
+
+        Return the next (message, md) tuple, end if there are no more
+        messages, or raise the error met by the thread."""
+
+        cond = self.__cond
+        cond.acquire()
+        try:
+            while not self.__messages:
+                cond.wait()
+            item = self.__messages.popleft()
+            if isinstance(item, tuple):
+                self.__pending = self.__pending - 1
+                self.__returned = self.__returned + 1
+            cond.notifyAll()
+        finally:
+            cond.release()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def stop(self, timeout=None):
+        """stop([timeout])
+
+        Ask the thread to stop and wait up to 'timeout' seconds for it
+        to finish its current MQGET and end its unit of work. Return
+        the number of messages which were prefetched but never
+        returned by next()."""
+
+        cond = self.__cond
+        cond.acquire()
+        try:
+            self.__stopped = True
+            cond.notifyAll()
+        finally:
+            cond.release()
+        self.__thread.join(timeout)
+        cond.acquire()
+        try:
+            return self.__pending
+        finally:
+            cond.release()
+
+
+def _readSegment(fileobj, buffer):
+    """Fill the bytearray 'buffer' from 'fileobj', return the number of
+    bytes read, less than len(buffer) at the end of file only. Module
+    Private."""
+    readinto = getattr(fileobj, 'readinto', None)
+    length = 0
+    while length < len(buffer):
+        if readinto is not None:
+            count = readinto(memoryview(buffer)[length:])
+        else:
+            data = fileobj.read(len(buffer) - length)
+            count = len(data)
+            buffer[length:length + count] = data
+        if not count:
+            break
+        length = length + count
+    return length
+
+
+# Items accepted in the overrides dict of Queue.put_many().
+_putManyOverrides = ('MsgId', 'CorrelId', 'Priority')
+
+
+def _asyncPutArg(name, kw):
+    "Return the async_put keyword argument of 'name', the only one."
+    asyncPut = kw.pop('async_put', False)
+    if kw:
+        raise exceptions.TypeError('%s() got an unexpected keyword '
+                                   'argument %r' % (name, kw.keys()[0]))
+    return asyncPut
+
+
+def _asyncPutOptions(options):
+    "Return the put 'options' switched to asynchronous response."
+    return (options & ~CMQC.MQPMO_SYNC_RESPONSE) | CMQC.MQPMO_ASYNC_RESPONSE
+
 
 class Queue:
 
@@ -1492,7 +2619,20 @@ class Queue:
     the open may be deferred until a call to open(), put() or
     get(). The Queue to open is identified either by a queue name
     string (in which case a default MQOD structure is created using
-    that name), or by passing a ready constructed MQOD class."""
+    that name), or by passing a ready constructed MQOD class.
+
+    When get() is called without a maximum length, the buffer for the
+    first MQGET starts at get_buffer_initial bytes and then follows the
+    lengths of the messages received, up to get_buffer_max bytes, so
+    that most messages are read with a single MQGET. See
+    get_buffer_stats()."""
+
+    # Buffer length limits used by get() when maxLength is None.
+    get_buffer_initial = 4096
+    get_buffer_max = 4 * 1024 * 1024
+
+    # Number of messages put_many() passes to pymqe at a time.
+    put_many_batch = 1000
 
 
     def __realOpen(self):
@@ -1532,6 +2672,10 @@ class Queue:
 
         self.__qMgr = qMgr
         self.__qHandle = self.__qDesc = self.__openOpts = None
+        self.__sizer = None
+        self.__cacheKey = None
+        self.__prefetchStats = {'returned': 0, 'unconsumed': 0,
+                                'backed_out': 0}
         l = len(opts)
         if l > 2:
             raise exceptions.TypeError, 'Too many args'
@@ -1572,12 +2716,51 @@ class Queue:
             self.__openOpts = opts[0]
             self.__realOpen()
 
+    def open_selected(self, qDesc, selector,
+                      openOpts=CMQC.MQOO_INPUT_AS_Q_DEF):
+        """open_selected(qDesc, selector[, openOpts])
+
+        Open the queue 'qDesc', a name or a pymqi.od(), so that get()
+        only returns the messages matching the message selector
+        'selector', e.g. "Color = 'red' AND Weight > 2500". The queue
+        manager does the selection, sparing the transfer of the other
+        messages.
+
+        The selector syntax is checked locally, once per selector, and
+        MQMIError(MQCC_FAILED, MQRC_SELECTOR_SYNTAX_ERROR) is raised if
+        it's not valid. Consumers opening the same queue with the same
+        selector and openOpts share one handle, kept by the
+        QueueManager while any of them uses it, and for a while after
+        the last one closes it. A queue opened for browsing gets a
+        handle of its own, since the browse cursor belongs to the
+        handle. The selection string buffer is kept with the queue's
+        MQOD."""
 
-    def put(self, msg, *opts):
-        """put(msg[, mDesc ,putOpts])
-
-        Put the string buffer 'msg' on the queue. If the queue is not
-        already open, it is opened now with the option 'MQOO_OUTPUT'.
+        if self.__qHandle:
+            raise PYIFError('The Queue is already open')
+        _checkSelector(selector)
+        qd = od()
+        qd.unpack(makeQDesc(qDesc).pack())
+        qd.Version = max(qd.Version, CMQC.MQOD_VERSION_4)
+        qd.set_vs('SelectionString', selector)
+        self.__qDesc = qd
+        self.__openOpts = openOpts
+        if openOpts & CMQC.MQOO_BROWSE:
+            self.__realOpen()
+        else:
+            self.__cacheKey, self.__qHandle = \
+                self.__qMgr._openSelected(qd, openOpts)
+
+
+    def put(self, msg, *opts, **kw):
+        """put(msg[, mDesc ,putOpts][, async_put=False])
+
+        Put the buffer 'msg' on the queue. If the queue is not
+        already open, it is opened now with the option 'MQOO_OUTPUT'.
+
+        'msg' may be a string or any other object exporting the buffer
+        interface (bytearray, memoryview, mmap), which is passed to MQI
+        without being copied.
 
         mDesc is the pymqi.md() MQMD Message Descriptor for the
         message. If it is not passed, or is None, then a default md()
@@ -1587,29 +2770,235 @@ class Queue:
         for the put call. If it is not passed, or is None, then a
         default pmo() object is used.
 
+        If async_put is true, MQPMO_ASYNC_RESPONSE is added to putOpts:
+        a client does not wait for the queue manager to confirm the
+        put, whose failure is only reported by
+        QueueManager.check_async_status().
+
         If mDesc and/or putOpts arguments were supplied, they may be
         updated by the put operation."""
 
+        asyncPut = _asyncPutArg('put', kw)
         mDesc, putOpts = apply(commonQArgs, opts)
         if putOpts == None:
             putOpts = pmo()
+        if asyncPut:
+            putOpts.Options = _asyncPutOptions(putOpts.Options)
         # If queue open was deferred, open it for put now
         if not self.__qHandle:
             self.__openOpts = CMQC.MQOO_OUTPUT
             self.__realOpen()
         # Now send the message
-        rv = pymqe.MQPUT(self.__qMgr.getHandle(), self.__qHandle, mDesc.pack(),
-                         putOpts.pack(), msg)
+        rv = pymqe.MQPUT(self.__qMgr.getHandle(), self.__qHandle,
+                         _structArg(mDesc), _structArg(putOpts), msg)
         if rv[-2]:
             raise MQMIError(rv[-2], rv[-1])
         mDesc.unpack(rv[0])
         putOpts.unpack(rv[1])
 
+    def put_many(self, iterable, md_template=None, put_opts=None,
+                 commit_every=None, async_put=False):
+        """put_many(iterable[, md_template, put_opts, commit_every,
+                    async_put])
+
+        Put every message of 'iterable' on the queue. The messages are
+        handed to the pymqe extension put_many_batch at a time, which
+        calls MQPUT for each of them without holding the GIL. If the
+        queue is not already open, it is opened now with the option
+        'MQOO_OUTPUT'.
+
+        Each item of 'iterable' is either a message, as accepted by
+        put(), or a tuple (message, overrides) where overrides is a
+        dict which may set 'MsgId', 'CorrelId' and 'Priority' for that
+        message only.
+
+        md_template is the pymqi.md() every message is based on, a
+        default md() is used if it is not passed or is None. It is not
+        updated by the puts. put_opts is the pymqi.pmo() used for every
+        put, a default pmo() is used if it is not passed or is None; it
+        is copied and never updated.
+
+        If commit_every is given, the messages are put under syncpoint
+        (MQPMO_SYNCPOINT replaces MQPMO_NO_SYNCPOINT in the copy of
+        put_opts) and the unit of work is committed after every
+        commit_every puts and after the last one.
+
+        If async_put is true, MQPMO_ASYNC_RESPONSE is added to the copy
+        of put_opts, as put() does. Failures the queue manager reports
+        later are only known to QueueManager.check_async_status().
+
+        A 'Priority' override out of the range of an MQLONG raises
+        OverflowError before any message of its batch is put.
+
+        Returns the tuple (msg_ids, failures). msg_ids holds the MsgId
+        of each message, or None for a message which was not put.
+        failures is a list of (index, MQMIError) tuples for those
+        messages; a message whose unit of work failed to commit is
+        reported with the reason of the MQCMIT."""
+
+        if md_template == None:
+            md_template = md()
+        # Work on a copy, the caller's put_opts is left alone.
+        opts = pmo()
+        if put_opts != None:
+            opts.unpack(put_opts.pack())
+        put_opts = opts
+        if async_put:
+            put_opts.Options = _asyncPutOptions(put_opts.Options)
+        batch = self.put_many_batch
+        if commit_every:
+            put_opts.Options = (put_opts.Options & ~CMQC.MQPMO_NO_SYNCPOINT) \
+                               | CMQC.MQPMO_SYNCPOINT
+            batch = commit_every * max(1, batch / commit_every)
+        else:
+            commit_every = 0
+        # If queue open was deferred, open it for put now
+        if not self.__qHandle:
+            self.__openOpts = CMQC.MQOO_OUTPUT
+            self.__realOpen()
+
+        mDesc = md_template.pack()
+        putOpts = put_opts.pack()
+        msg_ids = []
+        failures = []
+        messages = []
+        for item in iterable:
+            if isinstance(item, tuple):
+                msg, overrides = item
+                for key in overrides:
+                    if key not in _putManyOverrides:
+                        raise exceptions.ValueError(
+                            'Cannot override %s in put_many()' % key)
+                messages.append((msg, overrides.get('MsgId'),
+                                 overrides.get('CorrelId'),
+                                 overrides.get('Priority')))
+            else:
+                messages.append((item, None, None, None))
+            if len(messages) == batch:
+                self.__putBatch(mDesc, putOpts, messages, commit_every,
+                                msg_ids, failures)
+                messages = []
+        if messages:
+            self.__putBatch(mDesc, putOpts, messages, commit_every,
+                            msg_ids, failures)
+        return msg_ids, failures
+
+    def put_stream(self, fileobj, segment_size=1024 * 1024, *opts):
+        """put_stream(fileobj[, segment_size[, mDesc, putOpts]])
+
+        Put the contents of the file-like object 'fileobj' on the queue
+        as one logical message made of segments of at most
+        'segment_size' bytes, reading it as it goes so that no more
+        than two segments are held in memory. Returns the number of
+        bytes put. If the queue is not already open, it is opened now
+        with the option 'MQOO_OUTPUT'.
+
+        The segments are put in logical order (MQPMO_LOGICAL_ORDER is
+        added to a copy of putOpts, which is left unchanged), the queue
+        manager assigns their GroupId and Offset. mDesc, a pymqi.md()
+        used for every segment, is switched to MQMD_VERSION_2. Putting
+        the segments under syncpoint lets them be committed, or backed
+        out, as a whole.
+
+        The message may be read with get_stream(), or with
+        MQGMO_COMPLETE_MSG to have the queue manager reassemble it."""
+
+        mDesc, putOpts = apply(commonQArgs, opts)
+        if segment_size < 1:
+            raise exceptions.ValueError('segment_size must be positive')
+        # Work on a copy, the caller's putOpts is left alone.
+        opts = pmo()
+        if putOpts != None:
+            opts.unpack(putOpts.pack())
+        putOpts = opts
+        mDesc.Version = max(mDesc.Version, CMQC.MQMD_VERSION_2)
+        putOpts.Options = putOpts.Options | CMQC.MQPMO_LOGICAL_ORDER
+        flags = mDesc.MsgFlags & ~CMQC.MQMF_LAST_SEGMENT
+
+        # Two buffers: the next segment is read before the current one
+        # is put, to know whether the current one is the last.
+        buffers = [bytearray(segment_size), bytearray(segment_size)]
+        current = 0
+        length = _readSegment(fileobj, buffers[current])
+        total = 0
+        while 1:
+            nextLength = _readSegment(fileobj, buffers[1 - current])
+            if nextLength:
+                mDesc.MsgFlags = flags | CMQC.MQMF_SEGMENT
+            else:
+                mDesc.MsgFlags = flags | CMQC.MQMF_SEGMENT | \
+                                 CMQC.MQMF_LAST_SEGMENT
+            self.put(memoryview(buffers[current])[:length], mDesc, putOpts)
+            total = total + length
+            if not nextLength:
+                return total
+            current = 1 - current
+            length = nextLength
+
+    def put_group(self, iterable, *opts):
+        """put_group(iterable[, mDesc, putOpts])
+
+        Put the messages of 'iterable' on the queue as one message
+        group and return its GroupId. If the queue is not already open,
+        it is opened now with the option 'MQOO_OUTPUT'.
+
+        The messages are put in logical order (MQPMO_LOGICAL_ORDER) so
+        the queue manager assigns the GroupId and the MsgSeqNumbers;
+        every message is flagged MQMF_MSG_IN_GROUP and the last one
+        MQMF_LAST_MSG_IN_GROUP. mDesc, a pymqi.md() used for every
+        message, is switched to MQMD_VERSION_2. Every message gets a
+        new MsgId (MQPMO_NEW_MSG_ID), mDesc is left with the last one.
+        MQPMO_LOGICAL_ORDER and MQPMO_NEW_MSG_ID are added to a copy of
+        putOpts, which is left unchanged. Putting the group under
+        syncpoint makes it visible to consumers as a whole.
+
+        See GroupConsumer to consume groups."""
+
+        mDesc, putOpts = apply(commonQArgs, opts)
+        # Work on a copy, the caller's putOpts is left alone.
+        opts = pmo()
+        if putOpts != None:
+            opts.unpack(putOpts.pack())
+        putOpts = opts
+        mDesc.Version = max(mDesc.Version, CMQC.MQMD_VERSION_2)
+        # mDesc is reused, and would otherwise carry the MsgId the
+        # first put was given to every other message.
+        putOpts.Options = putOpts.Options | CMQC.MQPMO_LOGICAL_ORDER | \
+                          CMQC.MQPMO_NEW_MSG_ID
+        flags = mDesc.MsgFlags & ~CMQC.MQMF_LAST_MSG_IN_GROUP
+
+        # Keep one message back to know which one is the last.
+        messages = iter(iterable)
+        try:
+            msg = messages.next()
+        except StopIteration:
+            raise exceptions.ValueError('A message group needs at least '
+                                        'one message')
+        for following in messages:
+            mDesc.MsgFlags = flags | CMQC.MQMF_MSG_IN_GROUP
+            self.put(msg, mDesc, putOpts)
+            msg = following
+        mDesc.MsgFlags = flags | CMQC.MQMF_MSG_IN_GROUP | \
+                         CMQC.MQMF_LAST_MSG_IN_GROUP
+        self.put(msg, mDesc, putOpts)
+        return mDesc.GroupId
+
+    def __putBatch(self, mDesc, putOpts, messages, commit_every, msg_ids,
+                   failures):
+        "Put a batch of put_many() messages, collecting the results."
+        rv = pymqe.MQPUT_MANY(self.__qMgr.getHandle(), self.__qHandle,
+                              mDesc, putOpts, messages, commit_every)
+        for index, comp, reason in rv[1]:
+            failures.append((len(msg_ids) + index, MQMIError(comp, reason)))
+        msg_ids.extend(rv[0])
+
     def put_rfh2(self, msg, *opts):
         """put_rfh2(msg[, mDesc ,putOpts, [rfh2_header, ]])
 
         Put a RFH2 message. opts[2] is a list of RFH2 headers.
-        MQMD and RFH2's must be correct.
+        MQMD and RFH2's must be correct. As with put(), 'msg' may be any
+        object exporting the buffer interface; it is copied once, after
+        the headers.
 
         """
 
@@ -1629,7 +3018,14 @@ class Queue:
                         rfh2_buff = rfh2_buff + rfh2_header.pack(encoding)
                         encoding = rfh2_header["Encoding"]
 
-                msg = rfh2_buff + msg
+                if isinstance(msg, basestring):
+                    msg = rfh2_buff + msg
+                else:
+                    # Headers and message body are built in one
+                    # bytearray, msg itself is never turned into a str.
+                    buff = bytearray(rfh2_buff)
+                    buff[len(buff):] = msg
+                    msg = buff
             self.put(msg, *opts[0:2])
         else:
             self.put(msg, *opts)
@@ -1646,7 +3042,9 @@ class Queue:
 
         If maxLength is not specified, or is None, then the entire
         message is returned regardless of its size. This may require
-        multiple calls to the underlying MQGET API.
+        multiple calls to the underlying MQGET API; the buffer length
+        of the first call adapts to the sizes of previously received
+        messages to make that rare.
 
         mDesc is the pymqi.md() MQMD Message Descriptor for receiving
         the message. If it is not passed, or is None, then a default
@@ -1669,17 +3067,22 @@ class Queue:
 
         # Truncated message fix thanks to Maas-Maarten Zeeman
         if maxLength == None:
-            length = 4096
+            if self.__sizer is None:
+                self.__sizer = _GetBufferSizer(self.get_buffer_initial,
+                                               self.get_buffer_max)
+            length = self.__sizer.length
         else:
             length = maxLength
 
         rv = pymqe.MQGET(self.__qMgr.getHandle(), self.__qHandle,
-                        mDesc.pack(), getOpts.pack(), length)
+                        _structArg(mDesc), _structArg(getOpts), length)
 
         if not rv[-2]:
             # Everything A OK
             mDesc.unpack(rv[1])
             getOpts.unpack(rv[2])
+            if maxLength == None:
+                self.__sizer.observe(rv[-3], False)
             return rv[0]
 
         # Some error. If caller supplied buffer, maybe it wasn't big
@@ -1698,14 +3101,329 @@ class Queue:
         mDesc.unpack(rv[1])  # save the message id
         length = rv[-3]
         rv = pymqe.MQGET(self.__qMgr.getHandle(), self.__qHandle,
-                         mDesc.pack(), getOpts.pack(), length)
+                         _structArg(mDesc), _structArg(getOpts), length)
         if rv[-2]:
             raise MQMIError(rv[-2], rv[-1])
         mDesc.unpack(rv[1])
         getOpts.unpack(rv[2])
+        self.__sizer.observe(length, True)
 
         return rv[0]
 
+    def get_buffer_stats(self):
+        """get_buffer_stats()
+
+        Return a dictionary describing the adaptive buffer sizing done
+        by get() when called without a maximum length: 'gets' is the
+        number of such gets, 'retries' how many of them needed a second
+        MQGET because the message was truncated, 'retries_avoided' how
+        many messages longer than get_buffer_initial were received with
+        a single MQGET and 'buffer_length' the current length of the
+        first MQGET's buffer."""
+
+        if self.__sizer is None:
+            return {'gets': 0, 'retries': 0, 'retries_avoided': 0,
+                    'buffer_length': self.get_buffer_initial}
+        return self.__sizer.stats()
+
+    def get_into(self, buffer, *opts):
+        """get_into(buffer[, mDesc, getOpts])
+
+        Get a message from the queue directly into 'buffer' and return
+        the length of the message. If the queue is not already open, it
+        is opened now with the option 'MQOO_INPUT_AS_Q_DEF'.
+
+        buffer may be any writable object exporting the buffer
+        interface, such as a bytearray, a memoryview slice or an
+        mmap. Its length is the maximum length for the message. No
+        intermediate copies of the message are made, so the same buffer
+        can be reused for any number of gets. If the message is longer
+        than the buffer, the behavior is as defined by MQI and the
+        getOpts argument and MQMIError is raised.
+
+        mDesc and getOpts are as for get() and may be updated by the
+        get operation."""
+
+        mDesc, getOpts = apply(commonQArgs, opts)
+        if getOpts == None:
+            getOpts = gmo()
+        # If queue open was deferred, open it for get now
+        if not self.__qHandle:
+            self.__openOpts = CMQC.MQOO_INPUT_AS_Q_DEF
+            self.__realOpen()
+
+        rv = pymqe.MQGET_INTO(self.__qMgr.getHandle(), self.__qHandle,
+                              _structArg(mDesc), _structArg(getOpts),
+                              buffer)
+        if rv[-2]:
+            raise MQMIError(rv[-2], rv[-1])
+        mDesc.unpack(rv[0])
+        getOpts.unpack(rv[1])
+        return rv[2]
+
+    def get_many(self, max_messages, max_bytes=None, wait_interval=None,
+                 *opts):
+        """get_many(max_messages[, max_bytes, wait_interval[, mDesc, getOpts]])
+
+        Get up to 'max_messages' messages from the queue in a single
+        call to the pymqe extension, which loops over MQGET without
+        holding the GIL. If the queue is not already open, it is opened
+        now with the option 'MQOO_INPUT_AS_Q_DEF'.
+
+        Returns a list of (message, md) tuples, where each md is a
+        pymqi.md() describing its message. The list is empty if the
+        queue has no messages (MQRC_NO_MSG_AVAILABLE isn't raised).
+
+        max_bytes is the total size of all the messages received by
+        the call, get_buffer_max by default. The batch ends early when
+        the next message doesn't fit; if the very first one doesn't,
+        MQMIError with MQRC_TRUNCATED_MSG_FAILED is raised.
+
+        If wait_interval is given, the call waits up to wait_interval
+        milliseconds for the first message; the rest of the batch is
+        made of the messages available right after it.
+
+        mDesc is the pymqi.md() used as the template for every MQGET,
+        a default one matching any message is used if it is not passed
+        or is None. getOpts is the pymqi.gmo() for the MQGETs; it is
+        copied and never updated.
+
+        If an MQGET fails after some messages have been received, those
+        messages are returned and the failure is left to the next call,
+        whose first MQGET meets it again. If the last message was
+        received with a warning, such as MQRC_TRUNCATED_MSG_ACCEPTED,
+        MQMIError is raised with the warning, and the messages of the
+        batch, that one included, are in its 'messages' attribute."""
+
+        mDesc, getOpts = apply(commonQArgs, opts)
+        opts = gmo()
+        if getOpts != None:
+            opts.unpack(getOpts.pack())
+        getOpts = opts
+        if wait_interval is not None:
+            getOpts.Options = getOpts.Options | CMQC.MQGMO_WAIT
+            getOpts.WaitInterval = wait_interval
+        if max_bytes == None:
+            max_bytes = self.get_buffer_max
+        # If queue open was deferred, open it for get now
+        if not self.__qHandle:
+            self.__openOpts = CMQC.MQOO_INPUT_AS_Q_DEF
+            self.__realOpen()
+
+        rv = pymqe.MQGET_MANY(self.__qMgr.getHandle(), self.__qHandle,
+                              mDesc.pack(), getOpts.pack(), max_messages,
+                              max_bytes)
+
+        messages = []
+        for msg, msgDesc in rv[0]:
+            d = md()
+            d.unpack(msgDesc)
+            messages.append((msg, d))
+
+        if rv[-1] == CMQC.MQRC_TRUNCATED_MSG_FAILED:
+            # A warning, but the message is left on the queue for the
+            # next call.
+            if messages:
+                return messages
+            raise MQMIError(rv[-2], rv[-1])
+        if rv[-2] == CMQC.MQCC_WARNING:
+            error = MQMIError(rv[-2], rv[-1])
+            error.messages = messages
+            raise error
+        if rv[-2] and not messages and rv[-1] != CMQC.MQRC_NO_MSG_AVAILABLE:
+            raise MQMIError(rv[-2], rv[-1])
+        return messages
+
+    def iter_messages(self, prefetch=16, wait_interval=1000,
+                      stop_on_empty=True, *opts, **kw):
+        """iter_messages([prefetch, wait_interval, stop_on_empty[, mDesc, getOpts]]
+                         [, factory=callable])
+
+        Return a generator of (message, md) tuples, where md is the
+        pymqi.md() of the message. The messages are got by a background
+        thread calling get() ahead of the consumer, so that processing
+        a message overlaps with getting the next ones. The thread keeps
+        at most 'prefetch' messages waiting and blocks until the
+        consumer takes one.
+
+        Each get waits up to wait_interval milliseconds. If no message
+        arrives in that time the generator ends if stop_on_empty is
+        true, otherwise the thread keeps waiting. Any other MQMIError
+        is raised by the generator after the messages got before it.
+
+        mDesc and getOpts are used as templates for every get; they
+        are copied, never updated. MQGMO_WAIT is always added to the
+        get options.
+
+        Closing the generator, or letting it be garbage collected,
+        stops the thread; this takes up to wait_interval milliseconds.
+        See iter_messages_stats() for the messages prefetched but not
+        yet returned at that point.
+
+        MQ only lets a connection made without MQCNO_HANDLE_SHARE_BLOCK
+        (or MQCNO_HANDLE_SHARE_NO_BLOCK) be used by the thread which
+        made it, so the thread makes its own connection by calling
+        'factory', which must return a connected QueueManager. By
+        default it connects the same way as this Queue's queue manager.
+        It opens the queue again on that connection, with this Queue's
+        open options if it is open and 'MQOO_INPUT_AS_Q_DEF' otherwise,
+        and disconnects when it stops. The thread gets under syncpoint
+        whatever the syncpoint options of getOpts. It stops getting
+        once a message has been returned, until all the messages it
+        got have been returned, and then commits them: a message is
+        only removed from the queue after the generator has returned
+        it. When the generator is closed with messages not yet
+        returned, the thread backs out its unit of work, which puts
+        them back on the queue together with the messages returned
+        since the last commit; these will be got again.
+
+        A Queue whose handle was given with set_handle() can't be
+        opened again, its handle is used by the thread and its
+        connection must be shared; the messages are then got with the
+        syncpoint options of getOpts, the unit of work being that of
+        the caller's connection."""
+
+        for k in kw.keys():
+            if k != 'factory':
+                raise exceptions.TypeError('Invalid option: %s' % k)
+        mDesc, getOpts = apply(commonQArgs, opts)
+        if getOpts == None:
+            getOpts = gmo()
+
+        if self.__qDesc == None:
+            if not self.__qHandle:
+                raise PYIFError('not open')
+            prefetcher = _MessagePrefetcher(self, prefetch, wait_interval,
+                                            stop_on_empty, mDesc, getOpts)
+        else:
+            factory = kw.get('factory') or self.__qMgr._newConnection
+            openOpts = CMQC.MQOO_INPUT_AS_Q_DEF
+            if self.__qHandle:
+                openOpts = self.__openOpts
+            # The thread's open updates its own copy of the descriptor.
+            qDesc = od()
+            qDesc.unpack(self.__qDesc.pack())
+            prefetcher = _MessagePrefetcher(None, prefetch, wait_interval,
+                                            stop_on_empty, mDesc, getOpts,
+                                            (factory, qDesc, openOpts))
+        return self.__iterPrefetched(prefetcher)
+
+    def __iterPrefetched(self, prefetcher):
+        "Generator body of iter_messages()."
+        stats = self.__prefetchStats
+        prefetcher.start()
+        try:
+            while 1:
+                item = prefetcher.next()
+                if item is prefetcher.end:
+                    return
+                stats['returned'] += 1
+                yield item
+        finally:
+            stats['unconsumed'] += prefetcher.stop()
+            stats['backed_out'] += prefetcher.backed_out
+
+    def iter_messages_stats(self):
+        """iter_messages_stats()
+
+        Return a dictionary counting, over all the generators returned
+        by iter_messages(), the messages 'returned' to the consumer,
+        those prefetched but never returned, 'unconsumed', and those
+        put back on the queue when the generator was closed,
+        'backed_out'. The latter include the unconsumed messages got
+        on the thread's own connection and the messages returned since
+        its last commit. Unconsumed messages got with a handle given
+        by set_handle() are in the unit of work of the caller's
+        connection if got under syncpoint, otherwise they are lost."""
+
+        return self.__prefetchStats.copy()
+
+    def get_stream(self, writer, segment_size=1024 * 1024, *opts):
+        """get_stream(writer[, segment_size[, mDesc, getOpts]])
+
+        Get the next logical message from the queue segment by segment,
+        writing each one to 'writer', any object with a write() method
+        accepting a buffer such as a file or an mmap. Only one segment
+        is held in memory at a time. Returns the length of the logical
+        message. A message which is not segmented is written whole. If
+        the queue is not already open, it is opened now with the option
+        'MQOO_INPUT_AS_Q_DEF'.
+
+        segment_size is the largest segment expected, a longer one
+        raises MQMIError with MQRC_TRUNCATED_MSG_FAILED.
+
+        mDesc and getOpts select the message as for get(). mDesc is
+        left describing its last segment, getOpts is left unchanged.
+        The segments are got in logical order, once they are all
+        available (MQGMO_LOGICAL_ORDER and MQGMO_ALL_SEGMENTS_AVAILABLE
+        are added to a copy of getOpts). Getting them under syncpoint
+        allows a partly read message to be backed out."""
+
+        mDesc, getOpts = apply(commonQArgs, opts)
+        # Work on a copy, the caller's getOpts is left alone.
+        opts = gmo()
+        if getOpts != None:
+            opts.unpack(getOpts.pack())
+        getOpts = opts
+        mDesc.Version = max(mDesc.Version, CMQC.MQMD_VERSION_2)
+        getOpts.Version = max(getOpts.Version, CMQC.MQGMO_VERSION_2)
+        getOpts.Options = (getOpts.Options | CMQC.MQGMO_LOGICAL_ORDER |
+                           CMQC.MQGMO_ALL_SEGMENTS_AVAILABLE) & \
+                          ~CMQC.MQGMO_COMPLETE_MSG
+
+        segment = bytearray(segment_size)
+        total = 0
+        while 1:
+            length = self.get_into(segment, mDesc, getOpts)
+            # A buffer object, which every writer accepts (mmap.write()
+            # doesn't take a memoryview).
+            writer.write(buffer(segment, 0, length))
+            total = total + length
+            if getOpts.SegmentStatus != CMQC.MQSS_SEGMENT:
+                return total
+            # The queue manager returns the following segments of the
+            # message in order, whatever their MsgId and CorrelId.
+            getOpts.MatchOptions = CMQC.MQMO_NONE
+
+    def get_with_properties(self, pool=None, maxLength=None, *opts):
+        """get_with_properties([pool, maxLength[, mDesc, getOpts]])
+
+        Return the tuple (msg, properties) of a message from the queue
+        and the dictionary of all its properties, as read by
+        MessageHandle.properties.get_all(). maxLength, mDesc and
+        getOpts are as for get(), except that getOpts is left
+        unchanged: the message is got with a copy switched to
+        MQGMO_VERSION_4 and MQGMO_PROPERTIES_IN_HANDLE, so no handle
+        outlives the call in it.
+
+        The message handle is taken from the MessageHandlePool 'pool'
+        and given back afterwards. Without a pool a handle is created
+        and deleted for the call, which costs two more MQI calls."""
+
+        mDesc, getOpts = apply(commonQArgs, opts)
+        # Work on a copy, the caller's getOpts is left alone.
+        opts = gmo()
+        if getOpts != None:
+            opts.unpack(getOpts.pack())
+        getOpts = opts
+        if pool is None:
+            handle = MessageHandle(self.__qMgr)
+        else:
+            handle = pool.get()
+        try:
+            getOpts.Version = max(getOpts.Version, CMQC.MQGMO_VERSION_4)
+            getOpts.Options = getOpts.Options | \
+                              CMQC.MQGMO_PROPERTIES_IN_HANDLE
+            getOpts.MsgHandle = handle.msg_handle
+            msg = self.get(maxLength, mDesc, getOpts)
+            properties = handle.properties.get_all()
+        finally:
+            if pool is None:
+                handle.delete()
+            else:
+                pool.put(handle)
+        return msg, properties
+
     def get_rfh2(self, max_length=None, *opts):
         """get_rfh2([maxLength [, mDesc, getOpts, [rfh2_header_1, ]]])
 
@@ -1742,14 +3460,93 @@ class Queue:
     def close(self, options = CMQC.MQCO_NONE):
         """close([options])
 
-        Close a queue, using options."""
+        Close a queue, using options. The handle of a queue opened with
+        open_selected() is given back to the QueueManager, which closes
+        it once no other Queue uses it."""
 
         if not self.__qHandle:
             raise PYIFError('not open')
-        rv = pymqe.MQCLOSE(self.__qMgr.getHandle(), self.__qHandle, options)
-        if rv[0]:
-            raise MQMIError(rv[-2], rv[-1])
+        if self.__cacheKey is None:
+            rv = pymqe.MQCLOSE(self.__qMgr.getHandle(), self.__qHandle,
+                               options)
+            if rv[0]:
+                raise MQMIError(rv[-2], rv[-1])
+        else:
+            self.__qMgr._releaseSelected(self.__cacheKey)
         self.__qHandle = self.__qDesc = self.__openOpts = None
+        self.__cacheKey = None
+
+    def register_callback(self, fn, mDesc=None, getOpts=None, max_length=None,
+                          on_error=None):
+        """register_callback(fn[, mDesc, getOpts, max_length, on_error])
+
+        Register fn as the consumer of the messages of the queue,
+        using MQCB. If the queue is not already open, it is opened
+        now with the option 'MQOO_INPUT_AS_Q_DEF'. Once the
+        QueueManager is started with start_consuming(), MQ gets the
+        messages and calls fn(queue, msg, md) on its dispatcher
+        thread, acquiring the GIL only for the call. All the
+        callbacks of a connection share that thread.
+
+        mDesc and getOpts select the messages as for get(); getOpts
+        defaults to waiting without limit, outside syncpoint. With
+        MQGMO_BROWSE_* options fn is called with the browsed messages,
+        which stay on the queue. max_length limits the length of the
+        messages, all of a message is delivered by default. Errors
+        reported by MQ, with a message or on their own
+        (MQCBCT_EVENT_CALL), such as the connection being broken or the
+        queue manager quiescing, are passed to on_error(queue,
+        MQMIError) if given, otherwise ignored.
+        Exceptions raised by fn or on_error are printed and ignored."""
+
+        if mDesc == None:
+            mDesc = md()
+        if getOpts == None:
+            getOpts = gmo(Options=CMQC.MQGMO_WAIT | CMQC.MQGMO_NO_SYNCPOINT |
+                          CMQC.MQGMO_FAIL_IF_QUIESCING,
+                          WaitInterval=CMQC.MQWI_UNLIMITED)
+        if max_length == None:
+            max_length = CMQC.MQCBD_FULL_MSG_LENGTH
+        if not self.__qHandle:
+            self.__openOpts = CMQC.MQOO_INPUT_AS_Q_DEF
+            self.__realOpen()
+
+        def dispatch(hObj, callType, msg, rawMDesc, rawGetOpts, comp, reason):
+            if callType == CMQC.MQCBCT_EVENT_CALL:
+                if reason != CMQC.MQRC_NONE and on_error is not None:
+                    on_error(self, MQMIError(comp, reason))
+                return
+            if callType not in (CMQC.MQCBCT_MSG_REMOVED,
+                                CMQC.MQCBCT_MSG_NOT_REMOVED):
+                return
+            if comp != CMQC.MQCC_OK and on_error is not None:
+                on_error(self, MQMIError(comp, reason))
+            # A browsed message is delivered too, but not one left on
+            # the queue for being too long.
+            if rawMDesc and comp != CMQC.MQCC_FAILED and \
+               reason != CMQC.MQRC_TRUNCATED_MSG_FAILED:
+                msgDesc = md()
+                msgDesc.unpack(rawMDesc)
+                fn(self, msg, msgDesc)
+
+        rv = pymqe.MQCB(self.__qMgr.getHandle(), CMQC.MQOP_REGISTER, dispatch,
+                        self.__qHandle, mDesc.pack(), getOpts.pack(),
+                        max_length)
+        if rv[0]:
+            raise MQMIError(rv[0], rv[1])
+
+    def deregister_callback(self):
+        """deregister_callback()
+
+        Deregister the consumer registered with register_callback().
+        Closing the queue deregisters it too."""
+
+        if not self.__qHandle:
+            raise PYIFError('not open')
+        rv = pymqe.MQCB(self.__qMgr.getHandle(), CMQC.MQOP_DEREGISTER, None,
+                        self.__qHandle, '', '', 0)
+        if rv[0]:
+            raise MQMIError(rv[0], rv[1])
 
     def inquire(self, attribute):
         """inquire(attribute)
@@ -1796,6 +3593,1406 @@ class Queue:
 
         return self.__qHandle
 
+
+class DistributionList(object):
+    """DistributionList puts a message to several queues with a single
+    MQPUT. The queues are opened together by a single MQOPEN of an
+    MQOD version 2 listing them in MQOR object records; each put
+    passes MQPMR put message records, for the per-destination MsgId
+    and CorrelId, and gets back MQRR response records holding the
+    outcome for each destination.
+
+    The QueueManager object must be already connected. Distribution
+    lists are only supported for local, remote and alias queues."""
+
+    def __init__(self, qMgr, destinations, openOpts=CMQC.MQOO_OUTPUT):
+        """DistributionList(qMgr, destinations[, openOpts])
+
+        Open the queues 'destinations', a list of queue names or of
+        (queue name, queue manager name) tuples, with a single MQOPEN.
+
+        The outcome of the open for each destination is kept in
+        open_results, a list of (comp, reason) tuples in the order of
+        'destinations'. MQMIError is raised only if no queue could be
+        opened."""
+
+        self.__qMgr = qMgr
+        self.__hObj = None
+        self.destinations = []
+        for dest in destinations:
+            if type(dest) is types.StringType:
+                dest = (dest, '')
+            self.destinations.append(dest)
+        count = len(self.destinations)
+        if not count:
+            raise exceptions.ValueError('A distribution list needs at least '
+                                        'one destination')
+
+        objectRecs = ''.join([struct.pack('48s48s', name, qmgrName)
+                              for name, qmgrName in self.destinations])
+        # The records must live as long as MQ may read or write them.
+        self.__objectRecs = ctypes.create_string_buffer(objectRecs,
+                                                        len(objectRecs))
+        self.__responseRecs = ctypes.create_string_buffer(
+            count * _responseRec.size)
+
+        qDesc = od(Version=CMQC.MQOD_VERSION_2, RecsPresent=count,
+                   ObjectRecPtr=ctypes.addressof(self.__objectRecs),
+                   ResponseRecPtr=ctypes.addressof(self.__responseRecs))
+        rv = pymqe.MQOPEN(qMgr.getHandle(), qDesc.pack(), openOpts)
+        qDesc.unpack(rv[1])
+        self.open_results = self.__results(rv[-2], rv[-1])
+        self.known_dest_count = qDesc.KnownDestCount
+        self.unknown_dest_count = qDesc.UnknownDestCount
+        self.invalid_dest_count = qDesc.InvalidDestCount
+        if rv[-2] == CMQC.MQCC_FAILED:
+            raise MQMIError(rv[-2], rv[-1])
+        self.__hObj = rv[0]
+
+    def __del__(self):
+        """__del__()
+
+        Close the distribution list, if it is open."""
+
+        if self.__hObj:
+            try:
+                self.close()
+            except:
+                pass
+
+    def __results(self, comp, reason):
+        "Per-destination (comp, reason) list of the last MQI call."
+        count = len(self.destinations)
+        if reason != CMQC.MQRC_MULTIPLE_REASONS:
+            return [(comp, reason)] * count
+        raw = self.__responseRecs.raw
+        return [_responseRec.unpack_from(raw, i * _responseRec.size)
+                for i in range(count)]
+
+    def put(self, msg, mDesc=None, putOpts=None, msg_ids=None,
+            correl_ids=None):
+        """put(msg[, mDesc, putOpts, msg_ids, correl_ids])
+
+        Put the buffer 'msg' on every queue of the distribution list
+        with a single MQPUT.
+
+        mDesc and putOpts are the pymqi.md() and pymqi.pmo() of the put,
+        default ones are used if they are None. putOpts is switched to
+        MQPMO_VERSION_2 for the put message and response records.
+
+        msg_ids and correl_ids are optional lists, in the order of the
+        destinations, of the MsgId and CorrelId to give each copy of
+        the message; a None or MQMI_NONE MsgId lets the queue manager
+        generate one.
+
+        Returns a list of (msg_id, comp, reason) tuples, one per
+        destination. MQMIError is raised only if the put failed for
+        every destination with the same reason."""
+
+        if not self.__hObj:
+            raise PYIFError('not open')
+        if mDesc == None:
+            mDesc = md()
+        if putOpts == None:
+            putOpts = pmo()
+        count = len(self.destinations)
+        if msg_ids is None:
+            msg_ids = [None] * count
+        fields = CMQC.MQPMRF_MSG_ID
+        recFormat = '24s'
+        if correl_ids is not None:
+            fields = fields | CMQC.MQPMRF_CORREL_ID
+            recFormat = '24s24s'
+        if len(msg_ids) != count or \
+           (correl_ids is not None and len(correl_ids) != count):
+            raise exceptions.ValueError('One MsgId and CorrelId per '
+                                        'destination expected')
+
+        recs = []
+        for i in range(count):
+            if correl_ids is None:
+                recs.append(struct.pack(recFormat, msg_ids[i] or ''))
+            else:
+                recs.append(struct.pack(recFormat, msg_ids[i] or '',
+                                        correl_ids[i] or ''))
+        recs = ''.join(recs)
+        putMsgRecs = ctypes.create_string_buffer(recs, len(recs))
+
+        putOpts.Version = max(putOpts.Version, CMQC.MQPMO_VERSION_2)
+        putOpts.RecsPresent = count
+        putOpts.PutMsgRecFields = fields
+        putOpts.PutMsgRecPtr = ctypes.addressof(putMsgRecs)
+        putOpts.ResponseRecPtr = ctypes.addressof(self.__responseRecs)
+        try:
+            rv = pymqe.MQPUT(self.__qMgr.getHandle(), self.__hObj,
+                             mDesc.pack(), putOpts.pack(), msg)
+            mDesc.unpack(rv[0])
+            putOpts.unpack(rv[1])
+        finally:
+            # Don't leave pointers to the records in the caller's pmo.
+            putOpts.PutMsgRecPtr = putOpts.ResponseRecPtr = 0
+        if rv[-2] == CMQC.MQCC_FAILED and \
+           rv[-1] != CMQC.MQRC_MULTIPLE_REASONS:
+            raise MQMIError(rv[-2], rv[-1])
+
+        size = struct.calcsize(recFormat)
+        raw = putMsgRecs.raw
+        return [(raw[i * size:i * size + 24], comp, reason)
+                for i, (comp, reason) in enumerate(self.__results(rv[-2],
+                                                                  rv[-1]))]
+
+    def close(self, options=CMQC.MQCO_NONE):
+        """close([options])
+
+        Close the distribution list, using options."""
+
+        if not self.__hObj:
+            raise PYIFError('not open')
+        rv = pymqe.MQCLOSE(self.__qMgr.getHandle(), self.__hObj, options)
+        if rv[0]:
+            raise MQMIError(rv[-2], rv[-1])
+        self.__hObj = None
+
+
+class MessageGroup(object):
+    """MessageGroup is a message group being consumed by a GroupConsumer.
+    Iterating over it yields the messages of the group in order,
+    getting each one from the queue only when it's asked for.
+
+    group_id is the GroupId of the group and md the pymqi.md() of the
+    message last returned."""
+
+    def __init__(self, consumer, msg, mDesc, last):
+        self.__consumer = consumer
+        self.__next = msg
+        self.__last = last
+        self.group_id = mDesc.GroupId
+        self.md = mDesc
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        """next()
+
+        Return the next message of the group."""
+
+        if self.__next is None:
+            if self.__last:
+                raise StopIteration
+            msg, self.md, self.__last = self.__consumer._get(True)
+        else:
+            msg, self.__next = self.__next, None
+        self.count += 1
+        return msg
+
+    def done(self):
+        """done()
+
+        Return whether all the messages of the group have been got."""
+
+        return self.__last and self.__next is None
+
+    def drain(self):
+        """drain()
+
+        Get and discard the rest of the group."""
+
+        for msg in self:
+            pass
+
+
+class GroupConsumer(object):
+    """GroupConsumer consumes the message groups of a queue, such as those
+    put by Queue.put_group(), one whole group at a time. Iterating over
+    it yields MessageGroup objects; a message which doesn't belong to
+    a group is returned as a group of its own.
+
+    The messages are got in logical order (MQGMO_LOGICAL_ORDER) and a
+    group is only started once all its messages are on the queue
+    (MQGMO_ALL_MSGS_AVAILABLE). The queue manager then keeps the
+    messages of the group in sequence for the object handle, while
+    other handles only start groups not yet begun. Groups can thus be
+    consumed concurrently by several GroupConsumers, each with its own
+    Queue and connection, without breaking the order within a group.
+    Getting under syncpoint (MQGMO_SYNCPOINT in getOpts) and
+    committing after each group puts a partly consumed group back if
+    the consumer fails."""
+
+    def __init__(self, queue, wait_interval=0, *opts):
+        """GroupConsumer(queue[, wait_interval[, mDesc, getOpts]])
+
+        Consume the groups of the pymqi.Queue 'queue'. The iteration
+        ends when no group becomes available within 'wait_interval'
+        milliseconds. mDesc and getOpts are the templates of every get,
+        as for Queue.get()."""
+
+        mDesc, getOpts = apply(commonQArgs, opts)
+        if getOpts == None:
+            getOpts = gmo()
+        mDesc = md(**mDesc.get())
+        mDesc.Version = max(mDesc.Version, CMQC.MQMD_VERSION_2)
+        getOpts = gmo(**getOpts.get())
+        getOpts.Version = max(getOpts.Version, CMQC.MQGMO_VERSION_2)
+        getOpts.Options = getOpts.Options | CMQC.MQGMO_LOGICAL_ORDER | \
+                          CMQC.MQGMO_ALL_MSGS_AVAILABLE
+        if wait_interval:
+            getOpts.Options = getOpts.Options | CMQC.MQGMO_WAIT
+            getOpts.WaitInterval = wait_interval
+        self.queue = queue
+        self.__mDesc = mDesc.pack()
+        self.__getOpts = getOpts.pack()
+        self.__group = None
+
+    def _get(self, inGroup):
+        """Get the next message, return (msg, md, last) where last tells
+        whether it ends its group. Module Private."""
+        mDesc, getOpts = md(), gmo()
+        mDesc.unpack(self.__mDesc)
+        getOpts.unpack(self.__getOpts)
+        if inGroup:
+            # Within a group the queue manager picks the next message,
+            # there's nothing to wait for or to match.
+            getOpts.Options = getOpts.Options & ~CMQC.MQGMO_WAIT
+            getOpts.MatchOptions = CMQC.MQMO_NONE
+        msg = self.queue.get(None, mDesc, getOpts)
+        last = getOpts.GroupStatus != CMQC.MQGS_MSG_IN_GROUP
+        return msg, mDesc, last
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        """next()
+
+        Return the next MessageGroup. The rest of the previous group,
+        if it wasn't consumed, is got and discarded first."""
+
+        if self.__group is not None and not self.__group.done():
+            self.__group.drain()
+        try:
+            msg, mDesc, last = self._get(False)
+        except MQMIError, e:
+            if e.reason == CMQC.MQRC_NO_MSG_AVAILABLE:
+                raise StopIteration
+            raise
+        self.__group = MessageGroup(self, msg, mDesc, last)
+        return self.__group
+
+
+class _Partition(object):
+    """Worker thread of a PartitionedConsumer, handling the messages of
+    its partition in order from a bounded deque. Module Private."""
+
+    def __init__(self, handler, size, name):
+        self.handler = handler
+        self.size = size
+        self.error = None
+        self.__items = collections.deque()
+        self.__busy = 0
+        self.__cond = threading.Condition()
+        self.__stopped = False
+        self.__thread = threading.Thread(target=self.run, name=name)
+        self.__thread.setDaemon(True)
+        self.__thread.start()
+
+    def put(self, msg, mDesc):
+        "Queue a message, waiting while the partition is full."
+        cond = self.__cond
+        cond.acquire()
+        try:
+            while len(self.__items) >= self.size:
+                cond.wait()
+            self.__items.append((msg, mDesc))
+            cond.notifyAll()
+        finally:
+            cond.release()
+
+    def run(self):
+        "Thread body."
+        cond = self.__cond
+        while 1:
+            cond.acquire()
+            try:
+                while not self.__items and not self.__stopped:
+                    cond.wait()
+                if not self.__items:
+                    return
+                msg, mDesc = self.__items.popleft()
+                self.__busy = 1
+                cond.notifyAll()
+            finally:
+                cond.release()
+            # After a failure the rest of the batch is skipped, it will
+            # be backed out.
+            if self.error is None:
+                try:
+                    self.handler(msg, mDesc)
+                except Exception, e:
+                    self.error = e
+            cond.acquire()
+            try:
+                self.__busy = 0
+                cond.notifyAll()
+            finally:
+                cond.release()
+
+    def wait_idle(self):
+        "Wait until all the queued messages have been handled."
+        cond = self.__cond
+        cond.acquire()
+        try:
+            while self.__items or self.__busy:
+                cond.wait()
+        finally:
+            cond.release()
+
+    def stop(self):
+        cond = self.__cond
+        cond.acquire()
+        try:
+            self.__stopped = True
+            cond.notifyAll()
+        finally:
+            cond.release()
+        self.__thread.join()
+
+
+class PartitionedConsumer(object):
+    """PartitionedConsumer gets the messages of a queue on one connection
+    and hands them to 'workers' threads, each calling handler(message,
+    md) in turn. The partition, and so the thread, of a message is
+    chosen by hashing its key, the CorrelId by default: the messages
+    with the same key are handled one at a time, in queue order, while
+    the others are handled in parallel. handler runs on the worker
+    threads; the MQI calls are all made by the thread calling run().
+
+    The messages are got under syncpoint in batches of batch_size. Once
+    a batch is dispatched, run() waits for every partition to finish
+    its share of it and commits; if a handler raised, the batch is
+    backed out instead and the error re-raised, so every message of it
+    is delivered again (at least once delivery). Each partition holds
+    at most partition_size waiting messages, get blocks while the
+    partition of the next message is full.
+
+    Threads make the handlers parallel as far as they release the GIL,
+    which is the case while they wait on I/O."""
+
+    def __init__(self, qMgr, queue, handler, workers=4, key='CorrelId',
+                 batch_size=100, partition_size=100, wait_interval=1000):
+        """PartitionedConsumer(qMgr, queue, handler[, workers, key,
+                               batch_size, partition_size,
+                               wait_interval])
+
+        Consume the pymqi.Queue 'queue' of the QueueManager 'qMgr'.
+        'key' is the name of the md field the messages are partitioned
+        by, such as 'CorrelId' or 'GroupId', or a callable returning
+        the key of an md. A batch ends early when no message arrives
+        within wait_interval milliseconds."""
+
+        if workers < 1:
+            raise exceptions.ValueError('At least one worker is required')
+        if isinstance(key, basestring):
+            key = operator.attrgetter(key)
+        self.qMgr = qMgr
+        self.queue = queue
+        self.key = key
+        self.batch_size = batch_size
+        self.wait_interval = wait_interval
+        self.stats = {'messages': 0, 'batches': 0, 'commits': 0,
+                      'backouts': 0}
+        self.__partitions = [_Partition(handler, partition_size,
+                                        'pymqi-partition-%d' % i)
+                             for i in range(workers)]
+        self.__stopped = False
+
+    def run_batch(self):
+        """run_batch()
+
+        Get, dispatch, handle and commit one batch. Return the number
+        of messages in the batch, 0 if the queue stayed empty for
+        wait_interval milliseconds."""
+
+        partitions = self.__partitions
+        count = 0
+        while count < self.batch_size:
+            mDesc = md()
+            getOpts = gmo(Options=CMQC.MQGMO_SYNCPOINT |
+                          CMQC.MQGMO_FAIL_IF_QUIESCING)
+            if not count:
+                getOpts.Options = getOpts.Options | CMQC.MQGMO_WAIT
+                getOpts.WaitInterval = self.wait_interval
+            try:
+                msg = self.queue.get(None, mDesc, getOpts)
+            except MQMIError, e:
+                if e.reason != CMQC.MQRC_NO_MSG_AVAILABLE:
+                    self.__abort()
+                    raise
+                break
+            partitions[hash(self.key(mDesc)) % len(partitions)].put(msg,
+                                                                   mDesc)
+            count += 1
+        if not count:
+            return 0
+
+        for partition in partitions:
+            partition.wait_idle()
+        errors = [p.error for p in partitions if p.error is not None]
+        if errors:
+            self.__abort()
+            raise errors[0]
+        self.qMgr.commit()
+        self.stats['messages'] += count
+        self.stats['batches'] += 1
+        self.stats['commits'] += 1
+        return count
+
+    def __abort(self):
+        "Back out the current batch, once the partitions are idle."
+        for partition in self.__partitions:
+            partition.wait_idle()
+            partition.error = None
+        self.qMgr.backout()
+        self.stats['backouts'] += 1
+
+    def run(self, stop_on_empty=True):
+        """run([stop_on_empty])
+
+        Consume batches until stop() is called or, if stop_on_empty is
+        true, until the queue is empty. Return the number of messages
+        handled."""
+
+        total = 0
+        self.__stopped = False
+        while not self.__stopped:
+            count = self.run_batch()
+            total += count
+            if not count and stop_on_empty:
+                break
+        return total
+
+    def stop(self):
+        """stop()
+
+        Make run() return after the current batch. May be called from
+        a handler or another thread."""
+
+        self.__stopped = True
+
+    def close(self):
+        """close()
+
+        Stop the worker threads."""
+
+        for partition in self.__partitions:
+            partition.stop()
+
+
+# Counters of each ConsumerPool worker, in its slot of the shared array.
+_consumerCounters = ('messages', 'errors', 'commits', 'backouts',
+                     'poisoned', 'latency_total', 'latency_max')
+
+# Exit code of a ConsumerPool worker which couldn't connect, open its
+# queue or move a poison message aside, the supervisor then waits
+# longer and longer to restart it.
+_consumerFailed = 3
+
+
+def _deadLetter(msg, mDesc, queue_name):
+    """_deadLetter(msg, mDesc, queue_name)
+
+    Module Private. Prefix 'msg', got from 'queue_name' with 'mDesc',
+    with a DLH and update mDesc for it to be put to a dead-letter
+    queue."""
+
+    header = DLH(Reason=CMQC.MQRC_BACKOUT_THRESHOLD_REACHED,
+                 DestQName=queue_name, Encoding=mDesc.Encoding,
+                 CodedCharSetId=mDesc.CodedCharSetId, Format=mDesc.Format,
+                 PutApplType=mDesc.PutApplType,
+                 PutApplName=mDesc.PutApplName, PutDate=mDesc.PutDate,
+                 PutTime=mDesc.PutTime)
+    mDesc.Encoding = CMQC.MQENC_NATIVE
+    mDesc.CodedCharSetId = CMQC.MQCCSI_Q_MGR
+    mDesc.Format = CMQC.MQFMT_DEAD_LETTER_HEADER
+    return header.pack() + msg
+
+
+def _consumerProcess(slot, counters, stop, connect, queue_name, handler,
+                     batch_size, wait_interval, max_backouts, backout_queue):
+    """Body of a ConsumerPool worker process: get, handle and commit
+    messages on a connection of its own until 'stop', the worker's
+    own event, is set. Module Private."""
+
+    # The supervisor decides when workers stop.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    base = slot * len(_consumerCounters)
+    messages, errors, commits, backouts, poisoned, latencyTotal, \
+        latencyMax = range(base, base + len(_consumerCounters))
+
+    qmgr = queue = None
+    try:
+        qmgr = connect()
+        # The context is saved so that a poison message keeps it on the
+        # backout queue.
+        queue = Queue(qmgr, queue_name, CMQC.MQOO_INPUT_SHARED |
+                      CMQC.MQOO_SAVE_ALL_CONTEXT | CMQC.MQOO_INQUIRE |
+                      CMQC.MQOO_FAIL_IF_QUIESCING)
+        if max_backouts is None:
+            max_backouts = queue.inquire(CMQC.MQIA_BACKOUT_THRESHOLD)
+        if backout_queue is None:
+            backout_queue = queue.inquire(CMQC.MQCA_BACKOUT_REQ_Q_NAME)
+        backout_queue = backout_queue.strip('\0 ')
+        # Without a backout queue poison messages go to the dead-letter
+        # queue of the queue manager.
+        deadLetterQ = ''
+        if max_backouts and not backout_queue:
+            deadLetterQ = qmgr.inquire(
+                CMQC.MQCA_DEAD_LETTER_Q_NAME).strip('\0 ')
+    except Exception:
+        traceback.print_exc()
+        try:
+            if queue is not None:
+                queue.close()
+            if qmgr is not None:
+                qmgr.disconnect()
+        except Error:
+            pass
+        raise SystemExit(_consumerFailed)
+
+    getOpts = gmo(Options=CMQC.MQGMO_SYNCPOINT | CMQC.MQGMO_WAIT |
+                  CMQC.MQGMO_FAIL_IF_QUIESCING, WaitInterval=wait_interval)
+    template = getOpts.pack()
+    backoutQ = None
+    pending = 0
+    try:
+        while not stop.is_set():
+            mDesc = md()
+            getOpts.unpack(template)
+            try:
+                msg = queue.get(None, mDesc, getOpts)
+            except MQMIError, e:
+                if e.reason != CMQC.MQRC_NO_MSG_AVAILABLE:
+                    raise
+                if pending:
+                    qmgr.commit()
+                    counters[commits] += 1
+                    pending = 0
+                continue
+
+            # A message backed out max_backouts times (none if 0) is
+            # moved to the backout queue, or the dead-letter queue, and
+            # committed with the rest of the unit of work. If it can't
+            # be moved it's backed out, and left on the queue, by the
+            # finally clause below and the worker restarted later.
+            if max_backouts and mDesc.BackoutCount >= max_backouts:
+                counters[poisoned] += 1
+                pending += 1
+                try:
+                    if backout_queue:
+                        putName = backout_queue
+                    elif deadLetterQ:
+                        putName = deadLetterQ
+                        msg = _deadLetter(msg, mDesc, queue_name)
+                    else:
+                        raise PYIFError('No backout queue nor dead-letter '
+                                        'queue for a poison message')
+                    if backoutQ is None:
+                        backoutQ = Queue(qmgr, putName,
+                                         CMQC.MQOO_OUTPUT |
+                                         CMQC.MQOO_PASS_ALL_CONTEXT |
+                                         CMQC.MQOO_FAIL_IF_QUIESCING)
+                    backoutQ.put(msg, mDesc, pmo(
+                        Options=CMQC.MQPMO_SYNCPOINT |
+                        CMQC.MQPMO_PASS_ALL_CONTEXT |
+                        CMQC.MQPMO_FAIL_IF_QUIESCING,
+                        Context=queue.get_handle()))
+                except Error:
+                    traceback.print_exc()
+                    raise SystemExit(_consumerFailed)
+                if pending >= batch_size:
+                    qmgr.commit()
+                    counters[commits] += 1
+                    pending = 0
+                continue
+
+            start = time.time()
+            try:
+                handler(msg, mDesc)
+            except Exception:
+                # Back out the whole unit of work, the message will be
+                # delivered again with a higher BackoutCount.
+                qmgr.backout()
+                counters[errors] += 1
+                counters[backouts] += 1
+                pending = 0
+                continue
+            latency = time.time() - start
+            counters[messages] += 1
+            counters[latencyTotal] += latency
+            if latency > counters[latencyMax]:
+                counters[latencyMax] = latency
+
+            pending += 1
+            if pending >= batch_size:
+                qmgr.commit()
+                counters[commits] += 1
+                pending = 0
+    finally:
+        # Whatever wasn't committed goes back to the queue.
+        try:
+            if pending:
+                qmgr.backout()
+                counters[backouts] += 1
+            if backoutQ is not None:
+                backoutQ.close()
+            queue.close()
+            qmgr.disconnect()
+        except Error:
+            pass
+
+
+class ConsumerPool(object):
+    """ConsumerPool runs 'processes' worker processes consuming the same
+    queue, each with a QueueManager and Queue of its own (MQ handles
+    can't be shared across processes, nor used after a fork). Every
+    worker gets messages under syncpoint, calls handler(message, md)
+    and commits after batch_size messages, or when the queue is
+    empty. A message whose handler raises is backed out with the rest
+    of its unit of work.
+
+    A message already backed out 'max_backouts' times, by default the
+    backout threshold (BOTHRESH) of the queue, is not handled again:
+    it is moved, with its context, to 'backout_queue', by default the
+    backout requeue queue (BOQNAME) of the queue, or with a DLH to the
+    dead-letter queue of the queue manager if there is none. A
+    max_backouts of 0 turns this off. A poison message which can't be
+    moved is backed out and left on the queue, and the worker
+    restarted as below.
+
+    run() supervises the workers, restarting those which die. A worker
+    which fails to connect, to open the queue or to move a poison
+    message is restarted after 'restart_delay' seconds, doubled after
+    every further failure up to 'max_restart_delay'. Each worker updates its counters (messages,
+    errors, commits, backouts, poisoned messages, handler latency) in
+    shared memory, see stats().
+
+    stop() lets the workers finish the message in hand and back out
+    their uncommitted work before they disconnect. Each worker has a
+    stop event of its own, also set by a SIGTERM sent to it; the
+    worker then stops the same way, and is restarted unless the pool
+    is stopping.
+
+    'connect' is called in each worker to connect it and must return
+    a connected QueueManager, e.g. functools.partial(pymqi.connect,
+    'QM01', 'SVRCONN.1', 'host(1414)'). The parent process makes no
+    connection."""
+
+    def __init__(self, connect, queue_name, handler, processes=None,
+                 batch_size=1, wait_interval=1000, max_backouts=None,
+                 backout_queue=None, restart_delay=1.0,
+                 max_restart_delay=60.0):
+        """ConsumerPool(connect, queue_name, handler[, processes,
+                        batch_size, wait_interval, max_backouts,
+                        backout_queue, restart_delay,
+                        max_restart_delay])
+
+        Prepare a pool of 'processes' workers, one per CPU by default,
+        consuming the queue 'queue_name'. The workers wait up to
+        'wait_interval' milliseconds per MQGET, which bounds how long
+        stop() takes."""
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.connect = connect
+        self.queue_name = queue_name
+        self.handler = handler
+        self.processes = processes
+        self.batch_size = batch_size
+        self.wait_interval = wait_interval
+        self.max_backouts = max_backouts
+        self.backout_queue = backout_queue
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.restarts = [0] * processes
+        self.__counters = multiprocessing.Array(
+            'd', processes * len(_consumerCounters), lock=False)
+        self.__stop = threading.Event()
+        self.__workers = [None] * processes
+        self.__stops = [None] * processes
+        # Consecutive failures and restart time of each slot.
+        self.__failures = [0] * processes
+        self.__restartAt = [None] * processes
+        self.__started = None
+
+    def __spawn(self, slot):
+        stop = multiprocessing.Event()
+        worker = multiprocessing.Process(
+            target=_consumerProcess, name='pymqi-consumer-%d' % slot,
+            args=(slot, self.__counters, stop, self.connect,
+                  self.queue_name, self.handler, self.batch_size,
+                  self.wait_interval, self.max_backouts,
+                  self.backout_queue))
+        worker.daemon = True
+        worker.start()
+        self.__workers[slot] = worker
+        self.__stops[slot] = stop
+
+    def start(self):
+        """start()
+
+        Start the workers."""
+
+        self.__stop.clear()
+        self.__started = time.time()
+        for slot in range(self.processes):
+            self.__spawn(slot)
+
+    def check(self):
+        """check()
+
+        Restart the workers which died, unless the pool is stopping,
+        once their restart delay has passed. Return the number
+        restarted."""
+
+        restarted = 0
+        now = time.time()
+        for slot, worker in enumerate(self.__workers):
+            if worker is None or worker.is_alive() or self.__stop.is_set():
+                continue
+            if self.__restartAt[slot] is None:
+                worker.join()
+                if worker.exitcode == _consumerFailed:
+                    self.__failures[slot] += 1
+                    delay = min(self.restart_delay *
+                                2 ** (self.__failures[slot] - 1),
+                                self.max_restart_delay)
+                else:
+                    self.__failures[slot] = 0
+                    delay = 0
+                self.__restartAt[slot] = now + delay
+            if now >= self.__restartAt[slot]:
+                self.__restartAt[slot] = None
+                self.restarts[slot] += 1
+                self.__spawn(slot)
+                restarted += 1
+        return restarted
+
+    def run(self, interval=1.0):
+        """run([interval])
+
+        Start the workers if needed and supervise them every 'interval'
+        seconds until stop() is called, from a signal handler or
+        another thread. A KeyboardInterrupt stops the pool."""
+
+        if self.__started is None:
+            self.start()
+        try:
+            while not self.__stop.is_set():
+                self.check()
+                self.__stop.wait(interval)
+        except KeyboardInterrupt:
+            pass
+        self.stop()
+
+    def stop(self, timeout=None):
+        """stop([timeout])
+
+        Ask the workers to stop and wait for them. Workers still
+        running after 'timeout' seconds are terminated; the queue
+        manager then backs out their uncommitted work when it notices
+        their connection is gone."""
+
+        self.__stop.set()
+        for stop in self.__stops:
+            if stop is not None:
+                stop.set()
+        for worker in self.__workers:
+            if worker is not None:
+                worker.join(timeout)
+                if worker.is_alive():
+                    worker.terminate()
+                    worker.join()
+
+    def stats(self):
+        """stats()
+
+        Return the counters of each worker, and their totals, as a
+        dictionary. The totals include the throughput in messages per
+        second since start() and the mean handler latency in
+        seconds."""
+
+        counters = self.__counters[:]
+        size = len(_consumerCounters)
+        workers = []
+        for slot in range(self.processes):
+            values = dict(zip(_consumerCounters,
+                              counters[slot * size:(slot + 1) * size]))
+            values['restarts'] = self.restarts[slot]
+            workers.append(values)
+
+        total = {}
+        for name in _consumerCounters + ('restarts',):
+            total[name] = sum([values[name] for values in workers])
+        total['latency_max'] = max([0] + [values['latency_max']
+                                          for values in workers])
+        if total['messages']:
+            total['latency_mean'] = total['latency_total'] / total['messages']
+        else:
+            total['latency_mean'] = 0.0
+        elapsed = self.__started and time.time() - self.__started
+        if elapsed:
+            total['throughput'] = total['messages'] / elapsed
+        else:
+            total['throughput'] = 0.0
+        return {'workers': workers, 'total': total}
+
+
+class _Histogram(object):
+    """Counts of values per bucket, bucket i holding the values up to
+    bounds[i] and the last one those above all bounds. Module
+    Private."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+
+    def add(self, value):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def snapshot(self):
+        "Return a list of (upper bound, count), None bounding the last."
+        return zip(list(self.bounds) + [None], self.counts)
+
+
+class UnitOfWork(object):
+    """UnitOfWork groups the gets and puts made through it into units of
+    work, committed once max_messages messages or max_bytes bytes have
+    been got or put, or max_latency milliseconds after the first of
+    them, whichever comes first. Committing less often spreads the
+    cost of the log force at MQCMIT over more persistent messages,
+    the limits bound how much work a failure redelivers.
+
+    Typical use, with 'handler' putting its output through uow.put():
+
+        uow = pymqi.UnitOfWork(qmgr, max_messages=50)
+        uow.run(queue, handler)
+
+    The counters and the histograms of commit latencies and of
+    messages per commit are returned by stats()."""
+
+    # Buckets of the histograms.
+    latency_bounds = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+    batch_bounds = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+    def __init__(self, qMgr, max_messages=100, max_bytes=1024 * 1024,
+                 max_latency=500):
+        """UnitOfWork(qMgr[, max_messages, max_bytes, max_latency])
+
+        Manage the units of work of the connected QueueManager
+        'qMgr'. max_latency is in milliseconds."""
+
+        self.qMgr = qMgr
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+        self.__messages = 0
+        self.__bytes = 0
+        self.__started = None
+        self.__counters = dict.fromkeys(
+            ('messages', 'bytes', 'commits', 'backouts', 'by_messages',
+             'by_bytes', 'by_latency', 'on_idle'), 0)
+        self.__latencies = _Histogram(self.latency_bounds)
+        self.__batches = _Histogram(self.batch_bounds)
+
+    def __record(self, length):
+        if self.__started is None:
+            self.__started = time.time()
+        self.__messages += 1
+        self.__bytes += length
+
+    def pending(self):
+        """pending()
+
+        Return the number of messages got or put since the last commit
+        or backout."""
+
+        return self.__messages
+
+    def remaining_time(self):
+        """remaining_time()
+
+        Return the number of milliseconds before max_latency is
+        reached, None if there's no pending work."""
+
+        if self.__started is None:
+            return None
+        elapsed = (time.time() - self.__started) * 1000
+        return max(0, int(self.max_latency - elapsed))
+
+    def get(self, queue, maxLength=None, *opts):
+        """get(queue[, maxLength[, mDesc, getOpts]])
+
+        Queue.get() under syncpoint: MQGMO_SYNCPOINT is added to a
+        copy of getOpts. If getOpts waits and there is pending work,
+        the wait is shortened to end when max_latency is reached.
+        getOpts is updated with the output fields of the MQGET, its
+        Options and WaitInterval are left unchanged."""
+
+        mDesc, getOpts = apply(commonQArgs, opts)
+        # Work on a copy, the caller's Options and WaitInterval are
+        # left alone.
+        opts = gmo()
+        if getOpts != None:
+            opts.unpack(getOpts.pack())
+        opts.Options = (opts.Options & ~CMQC.MQGMO_NO_SYNCPOINT) | \
+                       CMQC.MQGMO_SYNCPOINT
+        remaining = self.remaining_time()
+        if opts.Options & CMQC.MQGMO_WAIT and remaining is not None and \
+           (opts.WaitInterval == CMQC.MQWI_UNLIMITED or
+            remaining < opts.WaitInterval):
+            opts.WaitInterval = remaining
+        msg = queue.get(maxLength, mDesc, opts)
+        if getOpts != None:
+            options, waitInterval = getOpts.Options, getOpts.WaitInterval
+            getOpts.unpack(opts.pack())
+            getOpts.Options, getOpts.WaitInterval = options, waitInterval
+        self.__record(len(msg))
+        return msg
+
+    def put(self, queue, msg, *opts):
+        """put(queue, msg[, mDesc, putOpts])
+
+        Queue.put() under syncpoint: MQPMO_SYNCPOINT is added to a
+        copy of putOpts. putOpts is updated with the output fields of
+        the MQPUT, its Options are left unchanged."""
+
+        mDesc, putOpts = apply(commonQArgs, opts)
+        # Work on a copy, the caller's Options are left alone.
+        opts = pmo()
+        if putOpts != None:
+            opts.unpack(putOpts.pack())
+        opts.Options = (opts.Options & ~CMQC.MQPMO_NO_SYNCPOINT) | \
+                       CMQC.MQPMO_SYNCPOINT
+        queue.put(msg, mDesc, opts)
+        if putOpts != None:
+            options = putOpts.Options
+            putOpts.unpack(opts.pack())
+            putOpts.Options = options
+        self.__record(len(msg))
+
+    def checkpoint(self):
+        """checkpoint()
+
+        Commit if any of the limits has been reached. Return whether a
+        commit was made."""
+
+        if self.__messages >= self.max_messages:
+            trigger = 'by_messages'
+        elif self.__bytes >= self.max_bytes:
+            trigger = 'by_bytes'
+        elif self.__started is not None and not self.remaining_time():
+            trigger = 'by_latency'
+        else:
+            return False
+        self.__counters[trigger] += 1
+        self.commit()
+        return True
+
+    def commit(self):
+        """commit()
+
+        Commit the pending work now."""
+
+        start = time.time()
+        self.qMgr.commit()
+        self.__latencies.add((time.time() - start) * 1000)
+        self.__batches.add(self.__messages)
+        self.__counters['commits'] += 1
+        self.__counters['messages'] += self.__messages
+        self.__counters['bytes'] += self.__bytes
+        self.__reset()
+
+    def backout(self):
+        """backout()
+
+        Back out the pending work."""
+
+        self.qMgr.backout()
+        self.__counters['backouts'] += 1
+        self.__reset()
+
+    def __reset(self):
+        self.__messages = self.__bytes = 0
+        self.__started = None
+
+    def run(self, queue, handler, wait_interval=1000, stop_on_empty=True):
+        """run(queue, handler[, wait_interval, stop_on_empty])
+
+        Get the messages of 'queue' through get() and call
+        handler(message, md, uow) for each of them, calling
+        checkpoint() once the handler has returned. Since get() cuts
+        its wait short when max_latency is reached, pending work is
+        also committed while the queue is idle: as soon as no message
+        arrives within wait_interval milliseconds, or by max_latency,
+        whichever comes first. A handler which is slow to return
+        delays the commit. If stop_on_empty is true, run() returns
+        when no message arrives and nothing is pending.
+
+        If handler raises, the unit of work is backed out and the
+        exception raised. Returns the number of messages handled."""
+
+        count = 0
+        while 1:
+            mDesc = md()
+            getOpts = gmo(Options=CMQC.MQGMO_WAIT |
+                          CMQC.MQGMO_FAIL_IF_QUIESCING,
+                          WaitInterval=wait_interval)
+            try:
+                msg = self.get(queue, None, mDesc, getOpts)
+            except MQMIError, e:
+                if e.reason != CMQC.MQRC_NO_MSG_AVAILABLE:
+                    raise
+                if self.__messages:
+                    if self.remaining_time():
+                        self.__counters['on_idle'] += 1
+                    else:
+                        self.__counters['by_latency'] += 1
+                    self.commit()
+                    continue
+                if stop_on_empty:
+                    return count
+                continue
+            try:
+                handler(msg, mDesc, self)
+            except:
+                self.backout()
+                raise
+            count += 1
+            self.checkpoint()
+
+    def stats(self):
+        """stats()
+
+        Return the counters as a dictionary: messages and bytes
+        committed, commits and backouts, commits per trigger
+        (by_messages, by_bytes, by_latency, on_idle), and the
+        'commit_latency_ms' and 'batch_size' histograms as lists of
+        (upper bound, count)."""
+
+        rv = self.__counters.copy()
+        rv['commit_latency_ms'] = self.__latencies.snapshot()
+        rv['batch_size'] = self.__batches.snapshot()
+        return rv
+
+
+class ReplyTimeout(PYIFError):
+    """Raised by ReplyFuture.result() when no reply arrived in time."""
+
+
+class ReplyFuture(object):
+    """ReplyFuture is the pending reply to a request sent by
+    RequestReplyClient.request()."""
+
+    def __init__(self, client):
+        self.__client = client
+        self.__event = threading.Event()
+        self.__result = None
+        self.__exception = None
+        self.msg_id = None
+
+    def _resolve(self, result=None, exception=None):
+        """Set the outcome, unless it was already set. Return whether it
+        was. Module Private."""
+        if self.__event.isSet():
+            return False
+        self.__result = result
+        self.__exception = exception
+        self.__event.set()
+        return True
+
+    def done(self):
+        """done()
+
+        Return whether the reply arrived, or the request failed."""
+
+        return self.__event.isSet()
+
+    def result(self, timeout=None):
+        """result([timeout])
+
+        Wait up to 'timeout' seconds (forever if None) and return the
+        reply as a (message, md) tuple. Raise ReplyTimeout if the
+        request timed out, or if no reply arrived within 'timeout'
+        seconds; in the latter case the request remains pending."""
+
+        if not self.__event.wait(timeout):
+            raise ReplyTimeout('No reply yet')
+        if self.__exception is not None:
+            raise self.__exception
+        return self.__result
+
+    def cancel(self):
+        """cancel()
+
+        Stop waiting for the reply, which will be treated as a late
+        one. Return False if the future was already done."""
+
+        return self.__client._forget(self, PYIFError('Request cancelled'))
+
+
+class RequestReplyClient(object):
+    """RequestReplyClient sends requests and matches the replies to
+    them, with any number of requests in flight and a single reader.
+
+    Requests are put on the request queue with MsgType MQMT_REQUEST
+    and ReplyToQ set to the reply queue. A reader thread gets every
+    message of the reply queue, without any match options, and hands
+    it to the ReplyFuture of the request whose MsgId is the CorrelId
+    of the reply, as set by a replying application following the
+    MQRO_COPY_MSG_ID_TO_CORREL_ID default.
+
+    A reply arriving after its request timed out or was cancelled, or
+    which matches no request, is counted in late_replies and passed to
+    the 'on_late_reply' callable, if any, as on_late_reply(message,
+    md), from the reader thread.
+
+    The reader thread waits for replies on a connection of its own,
+    so that its MQGET doesn't hold up the requests. Requests are put
+    on qMgr, which must be made with MQCNO_HANDLE_SHARE_BLOCK if
+    threads other than the one which made it call request()."""
+
+    def __init__(self, qMgr, request_queue, reply_queue, max_in_flight=100,
+                 timeout=30, wait_interval=500, on_late_reply=None,
+                 factory=None):
+        """RequestReplyClient(qMgr, request_queue, reply_queue[,
+                              max_in_flight, timeout, wait_interval,
+                              on_late_reply, factory])
+
+        Open the queue 'request_queue' for output and start the reader
+        thread, which opens 'reply_queue' for exclusive input on the
+        connection returned by 'factory', a connected QueueManager. By
+        default it connects the same way as qMgr. An error making the
+        connection or opening the reply queue is raised here.
+
+        At most 'max_in_flight' requests may wait for their replies,
+        request() blocks until one of them completes. A request times
+        out after 'timeout' seconds, unless another timeout is passed
+        to request(). The reader waits up to 'wait_interval'
+        milliseconds per MQGET, which bounds how late timeouts are
+        noticed and how long close() takes."""
+
+        self.__qMgr = qMgr
+        self.__replyQName = reply_queue
+        self.__factory = factory or qMgr._newConnection
+        self.__requestQ = Queue(qMgr, request_queue, CMQC.MQOO_OUTPUT)
+        self.timeout = timeout
+        self.wait_interval = wait_interval
+        self.on_late_reply = on_late_reply
+        self.late_replies = 0
+
+        self.__slots = threading.BoundedSemaphore(max_in_flight)
+        self.__lock = threading.Lock()
+        self.__pending = {}
+        self.__deadlines = []
+        self.__closed = False
+        self.__ready = threading.Event()
+        self.__readerError = None
+        self.__reader = threading.Thread(target=self.__read,
+                                         name='pymqi-replies')
+        self.__reader.setDaemon(True)
+        self.__reader.start()
+        self.__ready.wait()
+        if self.__readerError is not None:
+            try:
+                self.__requestQ.close()
+            except Error:
+                pass
+            raise self.__readerError
+
+    def request(self, msg, mDesc=None, putOpts=None, timeout=None):
+        """request(msg[, mDesc, putOpts, timeout])
+
+        Put the request 'msg' and return the ReplyFuture of its reply.
+        mDesc and putOpts are as for Queue.put(); MsgType, ReplyToQ and
+        a new, random MsgId are set in mDesc. The request is put outside of
+        syncpoint unless putOpts says otherwise.
+
+        'timeout' is the number of seconds the reply is waited for,
+        the client's timeout by default."""
+
+        if mDesc == None:
+            mDesc = md()
+        if putOpts == None:
+            putOpts = pmo(Options=CMQC.MQPMO_NO_SYNCPOINT |
+                          CMQC.MQPMO_FAIL_IF_QUIESCING)
+        if timeout is None:
+            timeout = self.timeout
+        mDesc.MsgType = CMQC.MQMT_REQUEST
+        mDesc.ReplyToQ = self.__replyQName
+        putOpts.Options = putOpts.Options & ~CMQC.MQPMO_NEW_MSG_ID
+
+        self.__slots.acquire()
+        future = ReplyFuture(self)
+        # The MsgId is made here, so that the future is registered
+        # before the put and the reader can't see the reply before it.
+        future.msg_id = mDesc.MsgId = os.urandom(CMQC.MQ_MSG_ID_LENGTH)
+        self.__lock.acquire()
+        try:
+            if self.__closed:
+                self.__slots.release()
+                raise PYIFError('The client is closed')
+            self.__pending[future.msg_id] = future
+            heapq.heappush(self.__deadlines,
+                           (time.time() + timeout, future.msg_id))
+        finally:
+            self.__lock.release()
+        try:
+            self.__requestQ.put(msg, mDesc, putOpts)
+        except Exception, e:
+            self._forget(future, e)
+            raise
+        return future
+
+    def in_flight(self):
+        """in_flight()
+
+        Return the number of requests waiting for their replies."""
+
+        return len(self.__pending)
+
+    def _forget(self, future, exception):
+        """Fail 'future' with 'exception' if it is still pending and
+        free its slot. Module Private."""
+        self.__lock.acquire()
+        try:
+            if self.__pending.get(future.msg_id) is not future:
+                return False
+            del self.__pending[future.msg_id]
+        finally:
+            self.__lock.release()
+        future._resolve(exception=exception)
+        self.__slots.release()
+        return True
+
+    def __expire(self, now):
+        "Fail the requests whose deadline has passed."
+        expired = []
+        self.__lock.acquire()
+        try:
+            deadlines = self.__deadlines
+            while deadlines and deadlines[0][0] <= now:
+                msgId = heapq.heappop(deadlines)[1]
+                future = self.__pending.get(msgId)
+                if future is not None:
+                    expired.append(future)
+        finally:
+            self.__lock.release()
+        for future in expired:
+            self._forget(future, ReplyTimeout('No reply received'))
+
+    def __read(self):
+        "Reader thread body."
+        try:
+            qMgr = self.__factory()
+            try:
+                replyQ = Queue(qMgr, self.__replyQName,
+                               CMQC.MQOO_INPUT_EXCLUSIVE |
+                               CMQC.MQOO_FAIL_IF_QUIESCING)
+            except:
+                try:
+                    qMgr.disconnect()
+                except Error:
+                    pass
+                raise
+        except Exception, e:
+            self.__readerError = e
+            self.__ready.set()
+            return
+        self.__ready.set()
+        try:
+            try:
+                self.__readReplies(replyQ)
+            finally:
+                try:
+                    replyQ.close()
+                except Error:
+                    pass
+        finally:
+            try:
+                qMgr.disconnect()
+            except Error:
+                pass
+
+    def __readReplies(self, replyQ):
+        "Get the replies from 'replyQ' until closed."
+        getOpts = gmo(Options=CMQC.MQGMO_WAIT | CMQC.MQGMO_NO_SYNCPOINT |
+                      CMQC.MQGMO_FAIL_IF_QUIESCING,
+                      WaitInterval=self.wait_interval)
+        template = getOpts.pack()
+        while not self.__closed:
+            mDesc = md()
+            getOpts.unpack(template)
+            try:
+                msg = replyQ.get(None, mDesc, getOpts)
+            except MQMIError, e:
+                if e.reason != CMQC.MQRC_NO_MSG_AVAILABLE:
+                    self.__fail(e)
+                    return
+                msg = None
+            except Error, e:
+                self.__fail(e)
+                return
+            if msg is not None:
+                self.__lock.acquire()
+                try:
+                    future = self.__pending.pop(mDesc.CorrelId, None)
+                finally:
+                    self.__lock.release()
+                if future is not None:
+                    future._resolve((msg, mDesc))
+                    self.__slots.release()
+                else:
+                    self.late_replies += 1
+                    if self.on_late_reply is not None:
+                        try:
+                            self.on_late_reply(msg, mDesc)
+                        except Exception:
+                            pass
+            self.__expire(time.time())
+
+    def __fail(self, exception):
+        "Fail all the pending requests with 'exception'."
+        self.__lock.acquire()
+        try:
+            self.__closed = True
+            pending = self.__pending.values()
+        finally:
+            self.__lock.release()
+        for future in pending:
+            self._forget(future, exception)
+
+    def close(self):
+        """close()
+
+        Stop the reader thread, which closes the reply queue and its
+        connection, fail the pending requests with PYIFError and close
+        the request queue."""
+
+        self.__fail(PYIFError('The client is closed'))
+        if self.__reader is not threading.currentThread():
+            self.__reader.join()
+        try:
+            self.__requestQ.close()
+        except Error:
+            pass
+
 #Publish Subscribe support - Hannes Wagener 2011
 class Topic:
     """Topic(queue_manager, topic_name, topic_string, topic_desc, open_opts)
@@ -1937,8 +5134,10 @@ class Topic:
     def pub(self, msg, *opts):
         """pub(msg[, msg_desc ,put_opts])
 
-        Publish the string buffer 'msg' to the Topic. If the Topic is not
+        Publish the buffer 'msg' to the Topic. If the Topic is not
         already open, it is opened now. with the option 'MQOO_OUTPUT'.
+        As with Queue.put(), 'msg' may be any object exporting the
+        buffer interface.
 
         msg_desc is the pymqi.md() MQMD Message Descriptor for the
         message. If it is not passed, or is None, then a default md()
@@ -2015,13 +5214,18 @@ class Topic:
 
 class Subscription:
     """Subscription(queue_manager, sub_descm sub_name, sub_queue, topic_name,
-                    topic_string)
+                    topic_string, selector)
 
-    Subscription encapsulates a subscription to a topic.
+    Subscription encapsulates a subscription to a topic. If selector is
+    given, only the publications matching that message selector are
+    delivered; its syntax is checked locally before the MQSUB. It is
+    set in the sub_desc passed, if any, unless that has a selection
+    string of its own.
 
     """
     def __init__(self, queue_manager, sub_desc=None, sub_name=None,
-                 sub_queue=None, sub_opts=None, topic_name=None, topic_string=None):
+                 sub_queue=None, sub_opts=None, topic_name=None, topic_string=None,
+                 selector=None):
         self.__queue_manager = queue_manager
         self.sub_queue = sub_queue
         self.__sub_desc = sub_desc
@@ -2029,6 +5233,7 @@ class Subscription:
         self.sub_opts = sub_opts
         self.topic_name = topic_name
         self.topic_string = topic_string
+        self.selector = selector
 
         if self.__sub_desc:
             self.sub(sub_desc=self.__sub_desc)
@@ -2052,7 +5257,7 @@ class Subscription:
         return self.sub_queue.get(max_length, *opts)
 
     def sub(self, sub_desc=None, sub_queue=None, sub_name=None, sub_opts=None,
-            topic_name=None, topic_string=None):
+            topic_name=None, topic_string=None, selector=None):
         """sub(sub_desc, sub_queue)
 
         Subscribe to a topic, alter or resume a subscription.
@@ -2068,6 +5273,8 @@ class Subscription:
             self.topic_string = topic_string
         if sub_name:
             self.sub_name = sub_name
+        if selector:
+            self.selector = selector
 
         if sub_desc:
             if not isinstance(sub_desc, SD):
@@ -2087,6 +5294,13 @@ class Subscription:
                 sub_desc["ObjectName"] = self.topic_name
             if self.topic_string:
                 sub_desc.set_vs("ObjectString", self.topic_string)
+        if self.selector:
+            _checkSelector(self.selector)
+            current = sub_desc.get_vs("SelectionString")
+            if current and current != self.selector:
+                raise PYIFError("sub_desc has a selection string other " \
+                                "than the selector.")
+            sub_desc.set_vs("SelectionString", self.selector)
         self.__sub_desc = sub_desc
 
         sub_queue_handle = CMQC.MQHO_NONE
@@ -2134,6 +5348,28 @@ class Subscription:
         except:
             pass
             
+def _propertyType(value):
+    "Return the MQTYPE of the message property 'value'."
+    if value is None:
+        return CMQC.MQTYPE_NULL
+    # bool first, it is a subclass of int.
+    if isinstance(value, bool):
+        return CMQC.MQTYPE_BOOLEAN
+    if isinstance(value, (int, long)):
+        if -0x80000000 <= value <= 0x7fffffff:
+            return CMQC.MQTYPE_INT32
+        return CMQC.MQTYPE_INT64
+    if isinstance(value, float):
+        return CMQC.MQTYPE_FLOAT64
+    if isinstance(value, (str, unicode)):
+        return CMQC.MQTYPE_STRING
+    if isinstance(value, (bytearray, buffer)):
+        return CMQC.MQTYPE_BYTE_STRING
+    raise exceptions.TypeError('No MQTYPE for a property of type %s, '
+                               'pass a (value, property_type) tuple' %
+                               type(value).__name__)
+
+
 class MessageHandle(object):
     """ A higher-level wrapper around the MQI's native MQCMHO structure.
     """
@@ -2148,6 +5384,10 @@ class MessageHandle(object):
     class _Properties(object):
         """ Encapsulates access to message properties.
         """
+        # Default MQSMPO and MQPD, packed once for all the properties set.
+        _default_smpo = SMPO().pack()
+        _default_pd = PD().pack()
+
         def __init__(self, conn_handle, msg_handle):
             self.conn_handle = conn_handle
             self.msg_handle = msg_handle
@@ -2183,7 +5423,7 @@ class MessageHandle(object):
                 max_value_length = MessageHandle.default_value_length
 
             comp_code, comp_reason, value = pymqe.MQINQMP(self.conn_handle,
-                    self.msg_handle, impo_options, name, impo_options,
+                    self.msg_handle, impo_options, name, pd,
                     property_type, max_value_length)
 
             if comp_code != CMQC.MQCC_OK:
@@ -2191,6 +5431,29 @@ class MessageHandle(object):
 
             return value
 
+        def get_all(self, pattern='%', impo_options=CMQC.MQIMPO_NONE,
+                    max_value_length=None):
+            """ Returns a dict of all the properties whose name matches
+            'pattern', all of them by default, read in a single pymqe call.
+            Values come typed: bools, ints and longs, floats, None for
+            MQTYPE_NULL and strings for both strings and byte strings.
+            'max_value_length' is the initial size of the value buffer
+            (defaults to MessageHandle.default_value_length), which grows
+            for longer values. 'impo_options' are added to the MQIMPO
+            options, e.g. MQIMPO_CONVERT_VALUE.
+            """
+            if not max_value_length:
+                max_value_length = MessageHandle.default_value_length
+
+            properties, comp_code, comp_reason = pymqe.MQINQMP_ALL(
+                self.conn_handle, self.msg_handle, pattern, impo_options,
+                max_value_length)
+
+            if comp_code != CMQC.MQCC_OK:
+                raise MQMIError(comp_code, comp_reason)
+
+            return properties
+
 
         def set(self, name, value, property_type=CMQC.MQTYPE_STRING,
                 value_length=CMQC.MQVL_NULL_TERMINATED, pd=None, smpo=None):
@@ -2201,16 +5464,54 @@ class MessageHandle(object):
             customization, you can also use 'pd' and 'smpo' parameters for
             passing in MQPD and MQSMPO structures.
             """
-            pd = pd if pd else PD()
-            smpo = smpo if smpo else SMPO()
+            pd = pd.pack() if pd else self._default_pd
+            smpo = smpo.pack() if smpo else self._default_smpo
 
             comp_code, comp_reason = pymqe.MQSETMP(self.conn_handle,
-                    self.msg_handle, smpo.pack(), name, pd.pack(),
+                    self.msg_handle, smpo, name, pd,
                     property_type, value, value_length)
 
             if comp_code != CMQC.MQCC_OK:
                 raise MQMIError(comp_code, comp_reason)
 
+        def update(self, properties, pd=None, smpo=None):
+            """ Sets all the properties of 'properties', a dict or a
+            sequence of (name, value) pairs, in a single pymqe call. The
+            MQTYPE of a value is that of its Python type: MQTYPE_BOOLEAN
+            for bools, MQTYPE_INT32 or MQTYPE_INT64 for ints and longs,
+            MQTYPE_FLOAT64 for floats, MQTYPE_STRING for strings (unicode
+            ones in the default encoding), MQTYPE_BYTE_STRING for
+            bytearrays and buffers and MQTYPE_NULL for None. A value may
+            also be given as a (value, property_type) tuple, e.g. (1.5,
+            CMQC.MQTYPE_FLOAT32); an integer out of the range of its type
+            raises OverflowError. 'pd' and 'smpo' are used for every
+            property, as with set(). The properties are set in order up
+            to the first failing one, whose position in the sequence and
+            name are the 'index' and 'property_name' attributes of the
+            MQMIError raised.
+            """
+            if hasattr(properties, 'items'):
+                properties = properties.items()
+            items = []
+            for name, value in properties:
+                if isinstance(value, tuple):
+                    value, property_type = value
+                else:
+                    property_type = _propertyType(value)
+                items.append((name, property_type, value))
+
+            pd = pd.pack() if pd else self._default_pd
+            smpo = smpo.pack() if smpo else self._default_smpo
+
+            comp_code, comp_reason, index = pymqe.MQSETMP_MANY(
+                self.conn_handle, self.msg_handle, smpo, pd, items)
+
+            if comp_code != CMQC.MQCC_OK:
+                error = MQMIError(comp_code, comp_reason)
+                error.index = index
+                error.property_name = index >= 0 and items[index][0] or None
+                raise error
+
     def __init__(self, qmgr=None, cmho=None):
         self.conn_handle = qmgr.get_handle() if qmgr else CMQC.MQHO_NONE
         cmho = cmho if cmho else CMHO()
@@ -2222,7 +5523,156 @@ class MessageHandle(object):
             raise MQMIError(comp_code, comp_reason)
 
         self.properties = self._Properties(self.conn_handle, self.msg_handle)
-        
+
+    def get_options(self, **kw):
+        """ Returns a gmo() whose MsgHandle is this handle, so that MQGET
+        returns the properties of the message in it, replacing those it
+        held. 'kw' sets other fields of the gmo.
+        """
+        getOpts = gmo(**kw)
+        getOpts.Version = max(getOpts.Version, CMQC.MQGMO_VERSION_4)
+        getOpts.Options = getOpts.Options | CMQC.MQGMO_PROPERTIES_IN_HANDLE
+        getOpts.MsgHandle = self.msg_handle
+        return getOpts
+
+    def put_options(self, **kw):
+        """ Returns a pmo() whose OriginalMsgHandle is this handle, so that
+        MQPUT sends its properties with the message. 'kw' sets other fields
+        of the pmo.
+        """
+        putOpts = pmo(**kw)
+        putOpts.Version = max(putOpts.Version, CMQC.MQPMO_VERSION_3)
+        putOpts.OriginalMsgHandle = self.msg_handle
+        return putOpts
+
+    def to_buffer(self, mDesc=None, name='%', mhbo=None, max_length=4096):
+        """ Returns the properties whose name matches 'name' as a
+        string, in MQRFH2 format by default, using MQMHBUF. 'mDesc' is the
+        message descriptor of the message they're to precede, updated by
+        the call. 'max_length' is the initial size of the buffer, which
+        grows as needed.
+        """
+        mDesc = mDesc if mDesc else md()
+        mhbo = mhbo.pack() if mhbo else MHBO().pack()
+
+        while 1:
+            buff, raw_md, length, comp_code, comp_reason = pymqe.MQMHBUF(
+                self.conn_handle, self.msg_handle, mhbo, name, mDesc.pack(),
+                max_length)
+            if length <= max_length or comp_code == CMQC.MQCC_OK:
+                break
+            max_length = length
+
+        if comp_code != CMQC.MQCC_OK:
+            raise MQMIError(comp_code, comp_reason)
+
+        mDesc.unpack(raw_md)
+        return buff
+
+    def from_buffer(self, msg, mDesc=None, bmho=None):
+        """ Moves the MQRFH2 properties at the start of 'msg' to this
+        handle, using MQBUFMH, and returns the message without them.
+        'mDesc' is the message descriptor of 'msg', updated by the call.
+        """
+        mDesc = mDesc if mDesc else md()
+        bmho = bmho.pack() if bmho else BMHO().pack()
+
+        msg, raw_md, comp_code, comp_reason = pymqe.MQBUFMH(self.conn_handle,
+                self.msg_handle, bmho, mDesc.pack(), msg)
+
+        if comp_code != CMQC.MQCC_OK:
+            raise MQMIError(comp_code, comp_reason)
+
+        mDesc.unpack(raw_md)
+        return msg
+
+    def delete(self, dmho=None):
+        """ Deletes the handle and its properties, using MQDLTMH. The
+        handle can't be used afterwards.
+        """
+        dmho = dmho if dmho else DMHO()
+
+        comp_code, comp_reason = pymqe.MQDLTMH(self.conn_handle,
+                self.msg_handle, dmho.pack())
+
+        if comp_code != CMQC.MQCC_OK:
+            raise MQMIError(comp_code, comp_reason)
+
+        self.msg_handle = self.properties.msg_handle = \
+            CMQC.MQHM_UNUSABLE_HMSG
+
+
+class MessageHandlePool(object):
+    """ Keeps message handles for reuse, so that a consumer reading the
+    properties of every message creates a handle once rather than once
+    per message, and releases them with MQDLTMH.
+
+    A handle taken with get() is wired into an MQGET with its
+    get_options(), which replace the properties it held, and may be
+    passed on to MQPUT with its put_options() to forward them. It is
+    given back with put(). At most 'size' idle handles are kept, the
+    others are deleted. Queue.get_with_properties() does all of this.
+    """
+
+    def __init__(self, qmgr, size=16, cmho=None):
+        self.qmgr = qmgr
+        self.size = size
+        self.cmho = cmho
+        self._lock = threading.Lock()
+        self._idle = []
+        self._metrics = dict.fromkeys(('creates', 'reuses', 'deletes'), 0)
+
+    def get(self):
+        """ Returns an idle handle, or a new one if there's none.
+        """
+        self._lock.acquire()
+        try:
+            if self._idle:
+                self._metrics['reuses'] += 1
+                return self._idle.pop()
+            self._metrics['creates'] += 1
+        finally:
+            self._lock.release()
+        return MessageHandle(self.qmgr, self.cmho)
+
+    def put(self, handle, discard=False):
+        """ Gives 'handle' back to the pool. It is deleted if 'discard'
+        is true or the pool already holds 'size' idle handles.
+        """
+        self._lock.acquire()
+        try:
+            if not discard and len(self._idle) < self.size:
+                self._idle.append(handle)
+                return
+            self._metrics['deletes'] += 1
+        finally:
+            self._lock.release()
+        handle.delete()
+
+    def metrics(self):
+        """ Returns a dict of the counts of handles created, reused and
+        deleted, and of the idle ones.
+        """
+        self._lock.acquire()
+        try:
+            rv = self._metrics.copy()
+            rv['idle'] = len(self._idle)
+        finally:
+            self._lock.release()
+        return rv
+
+    def close(self):
+        """ Deletes the idle handles.
+        """
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, []
+            self._metrics['deletes'] += len(idle)
+        finally:
+            self._lock.release()
+        for handle in idle:
+            handle.delete()
+
 class _Filter(object):
     """ The base class for MQAI filters. The initializer expectes user to provide
     the selector, value and the operator to use. For instance, the can be respectively
@@ -2434,3 +5884,828 @@ def connect(queue_manager, channel=None, conn_info=None):
     elif queue_manager:
         qmgr = QueueManager(queue_manager)
         return qmgr
+
+
+# Reasons meaning that a connection is no longer usable.
+_connectionLostReasons = (CMQC.MQRC_CONNECTION_BROKEN,
+                          CMQC.MQRC_HCONN_ERROR,
+                          CMQC.MQRC_Q_MGR_NOT_AVAILABLE,
+                          CMQC.MQRC_Q_MGR_QUIESCING,
+                          CMQC.MQRC_Q_MGR_STOPPING,
+                          CMQC.MQRC_CONNECTION_QUIESCING,
+                          CMQC.MQRC_CONNECTION_STOPPING)
+
+
+class _PooledConnection(object):
+    "A QueueManager of a QueueManagerPool. Module Private."
+
+    __slots__ = ('qmgr', 'created', 'last_used', 'last_validated', 'thread')
+
+    def __init__(self, qmgr, now):
+        self.qmgr = qmgr
+        self.created = self.last_used = self.last_validated = now
+        self.thread = threading.currentThread()
+
+
+class _PoolCheckout(object):
+    "Context manager returned by QueueManagerPool.connection(). Module Private."
+
+    def __init__(self, pool, timeout):
+        self.pool = pool
+        self.timeout = timeout
+        self.qmgr = None
+
+    def __enter__(self):
+        self.qmgr = self.pool.get(self.timeout)
+        return self.qmgr
+
+    def __exit__(self, excType, excValue, traceback):
+        discard = isinstance(excValue, MQMIError) and \
+                  excValue.reason in _connectionLostReasons
+        self.pool.put(self.qmgr, discard)
+        return False
+
+
+class QueueManagerPool(object):
+    """QueueManagerPool keeps connected QueueManager objects for reuse,
+    so that short lived users avoid the cost of a connection (MQCONNX,
+    and the TLS handshake on client channels) each time.
+
+    Connections are made by calling 'factory', which must return a
+    connected QueueManager, e.g. functools.partial(pymqi.connect,
+    'QM01', 'SVRCONN.1', 'host(1414)'). The pool holds at most
+    max_size connections, idle or in use, and keeps at least min_size
+    of them. Idle connections are disconnected after idle_timeout
+    seconds and any connection after max_lifetime seconds (None means
+    never).
+
+    A connection idle for more than validate_after seconds is checked
+    with validate() before it is handed out; the default check is a
+    single MQINQ of the queue manager's command level, much cheaper
+    than the PCF ping of QueueManager._is_connected().
+
+    get() prefers the connection last used by the calling thread. MQ
+    connection handles can only be used by the thread which created
+    them unless the connection was made with MQCNO_HANDLE_SHARE_BLOCK
+    or MQCNO_HANDLE_SHARE_NO_BLOCK; if the factory doesn't share
+    handles, pass thread_bound=True so that threads only reuse their
+    own connections. A thread-bound connection is then only
+    disconnected by its own thread: when one made by another thread
+    is evicted, it stops counting towards max_size and is disconnected
+    by the get() or put() its thread makes next, or by any thread once
+    its own has ended."""
+
+    def __init__(self, factory, min_size=0, max_size=8, idle_timeout=300,
+                 max_lifetime=None, validate_after=30, thread_bound=False):
+        """QueueManagerPool(factory[, min_size, max_size, idle_timeout,
+                            max_lifetime, validate_after, thread_bound])
+
+        Create the pool and make its first min_size connections, unless
+        thread_bound is true (they would only be usable by this
+        thread)."""
+
+        if max_size < 1 or min_size > max_size:
+            raise exceptions.ValueError('Invalid pool size')
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.validate_after = validate_after
+        self.thread_bound = thread_bound
+
+        self.__cond = threading.Condition()
+        self.__idle = []
+        self.__inUse = {}
+        self.__orphans = []
+        self.__pending = 0
+        self.__closed = False
+        self.__metrics = dict.fromkeys(
+            ('creates', 'checkouts', 'reuses', 'waits', 'wait_time',
+             'validations', 'evictions_idle', 'evictions_lifetime',
+             'evictions_invalid', 'discards'), 0)
+
+        if self.min_size and not self.thread_bound:
+            for i in range(self.min_size):
+                conn = self.__create()
+                self.__cond.acquire()
+                try:
+                    self.__metrics['creates'] += 1
+                    self.__idle.append(conn)
+                finally:
+                    self.__cond.release()
+
+    def __create(self):
+        "Make a new connection, the caller has reserved a slot for it."
+        qmgr = self.factory()
+        return _PooledConnection(qmgr, time.time())
+
+    def __disconnect(self, conn):
+        try:
+            conn.qmgr.disconnect()
+        except Error:
+            pass
+
+    def __expired(self, conn, now):
+        return self.max_lifetime is not None and \
+               now - conn.created >= self.max_lifetime
+
+    def __size(self):
+        return len(self.__idle) + len(self.__inUse) + self.__pending
+
+    def __closable(self, conns):
+        """Return the connections of 'conns', and the orphans, which the
+        calling thread may disconnect. Thread-bound connections of other
+        live threads are kept in the orphans. The lock is held by the
+        caller."""
+        thread = threading.currentThread()
+        rv = []
+        orphans = []
+        for conn in conns + self.__orphans:
+            if not self.thread_bound or conn.thread is thread or \
+               not conn.thread.isAlive():
+                rv.append(conn)
+            else:
+                orphans.append(conn)
+        self.__orphans = orphans
+        return rv
+
+    def __nextEviction(self, now):
+        """Return the number of seconds until an idle connection reaches
+        its idle timeout or lifetime, or None. The lock is held by the
+        caller."""
+        due = []
+        surplus = self.__size() > self.min_size
+        for conn in self.__idle:
+            if surplus:
+                due.append(conn.last_used + self.idle_timeout)
+            if self.max_lifetime is not None:
+                due.append(conn.created + self.max_lifetime)
+        if not due:
+            return None
+        # Not less than 10ms, in case the connection is kept anyway.
+        return max(min(due) - now, 0.01)
+
+    def __takeIdle(self, now):
+        """Remove and return the best idle connection for the calling
+        thread, or None. The lock is held by the caller."""
+        thread = threading.currentThread()
+        best = None
+        # Most recently used connections are at the end of the list.
+        for i in range(len(self.__idle) - 1, -1, -1):
+            if self.__idle[i].thread == thread:
+                best = i
+                break
+        if best is None and self.__idle and not self.thread_bound:
+            best = len(self.__idle) - 1
+        if best is None:
+            return None
+        return self.__idle.pop(best)
+
+    def __prune(self, now):
+        """Remove the idle connections past their idle timeout or
+        lifetime and return them. The lock is held by the caller."""
+        stale = []
+        keep = []
+        # Oldest idle connections are at the start of the list.
+        surplus = self.__size() - self.min_size
+        for conn in self.__idle:
+            if self.__expired(conn, now):
+                self.__metrics['evictions_lifetime'] += 1
+                stale.append(conn)
+                surplus -= 1
+            elif surplus > 0 and now - conn.last_used >= self.idle_timeout:
+                self.__metrics['evictions_idle'] += 1
+                stale.append(conn)
+                surplus -= 1
+            else:
+                keep.append(conn)
+        self.__idle = keep
+        return stale
+
+    def validate(self, qmgr):
+        """validate(qmgr)
+
+        Return whether the idle QueueManager 'qmgr' is still usable.
+        Override to use another check."""
+
+        try:
+            qmgr.inquire(CMQC.MQIA_COMMAND_LEVEL)
+        except Error:
+            return False
+        return True
+
+    def get(self, timeout=None):
+        """get([timeout])
+
+        Return a connected QueueManager from the pool, connecting a new
+        one if none is idle and the pool is not full. If it is full,
+        wait up to 'timeout' seconds (forever if None) for a connection
+        to be returned, then raise PYIFError. The QueueManager must be
+        given back with put()."""
+
+        cond = self.__cond
+        start = now = time.time()
+        waited = False
+        while 1:
+            reserved = False
+            cond.acquire()
+            try:
+                if self.__closed:
+                    raise PYIFError('The pool is closed')
+                stale = self.__closable(self.__prune(now))
+                conn = self.__takeIdle(now)
+                if conn is None:
+                    if self.__size() < self.max_size:
+                        self.__pending += 1
+                        reserved = True
+                    elif stale:
+                        # Disconnect them before waiting.
+                        pass
+                    elif timeout is not None and now - start >= timeout:
+                        raise PYIFError('No connection available in the pool')
+                    else:
+                        if not waited:
+                            self.__metrics['waits'] += 1
+                            waited = True
+                        # Wake up when an idle connection can be evicted
+                        # to make room, if that's before the timeout.
+                        wait = self.__nextEviction(now)
+                        if timeout is not None and \
+                           (wait is None or wait > timeout - (now - start)):
+                            wait = timeout - (now - start)
+                        if wait is None:
+                            cond.wait()
+                        else:
+                            cond.wait(wait)
+                        now = time.time()
+                        continue
+            finally:
+                cond.release()
+
+            for i in stale:
+                self.__disconnect(i)
+
+            if conn is not None:
+                validated = now - conn.last_validated >= self.validate_after
+                valid = not validated or self.validate(conn.qmgr)
+                cond.acquire()
+                try:
+                    if validated:
+                        self.__metrics['validations'] += 1
+                    if valid:
+                        self.__metrics['reuses'] += 1
+                    else:
+                        self.__metrics['evictions_invalid'] += 1
+                finally:
+                    cond.release()
+                if not valid:
+                    self.__disconnect(conn)
+                    continue
+                if validated:
+                    conn.last_validated = now
+            elif not reserved:
+                now = time.time()
+                continue
+            else:
+                try:
+                    conn = self.__create()
+                finally:
+                    cond.acquire()
+                    try:
+                        self.__pending -= 1
+                        if conn is not None:
+                            self.__metrics['creates'] += 1
+                        cond.notify()
+                    finally:
+                        cond.release()
+            break
+
+        conn.thread = threading.currentThread()
+        cond.acquire()
+        try:
+            self.__inUse[id(conn.qmgr)] = conn
+            self.__metrics['checkouts'] += 1
+            if waited:
+                self.__metrics['wait_time'] += time.time() - start
+        finally:
+            cond.release()
+        return conn.qmgr
+
+    def put(self, qmgr, discard=False):
+        """put(qmgr[, discard])
+
+        Give back the QueueManager 'qmgr' obtained from get(). If
+        'discard' is true, or the connection has reached max_lifetime
+        or the pool is closed, it is disconnected instead of being kept
+        for reuse. Pass discard=True after an error showing the
+        connection is broken."""
+
+        cond = self.__cond
+        now = time.time()
+        cond.acquire()
+        try:
+            conn = self.__inUse.pop(id(qmgr))
+            conn.last_used = conn.last_validated = now
+            keep = not (discard or self.__closed or self.__expired(conn, now))
+            if keep:
+                self.__idle.append(conn)
+                stale = []
+            elif discard:
+                self.__metrics['discards'] += 1
+                stale = [conn]
+            else:
+                if not self.__closed:
+                    self.__metrics['evictions_lifetime'] += 1
+                stale = [conn]
+            stale = self.__closable(stale)
+            cond.notify()
+        finally:
+            cond.release()
+        for i in stale:
+            self.__disconnect(i)
+
+    def connection(self, timeout=None):
+        """connection([timeout])
+
+        Return a context manager for the 'with' statement, checking out
+        a QueueManager with get(timeout) and giving it back with put()
+        at the end of the block. The connection is discarded if the
+        block raises an MQMIError showing that it is broken."""
+
+        return _PoolCheckout(self, timeout)
+
+    def metrics(self):
+        """metrics()
+
+        Return the pool counters as a dictionary, along with the number
+        of connections idle and in use."""
+
+        self.__cond.acquire()
+        try:
+            rv = self.__metrics.copy()
+            rv['idle'] = len(self.__idle)
+            rv['in_use'] = len(self.__inUse)
+        finally:
+            self.__cond.release()
+        return rv
+
+    def close(self):
+        """close()
+
+        Disconnect the idle connections. Those in use are disconnected
+        when given back, as are, with thread_bound, the idle connections
+        of other threads when their thread gives one back."""
+
+        self.__cond.acquire()
+        try:
+            self.__closed = True
+            idle = self.__closable(self.__idle)
+            self.__idle = []
+            self.__cond.notifyAll()
+        finally:
+            self.__cond.release()
+        for conn in idle:
+            self.__disconnect(conn)
+
+
+#
+# Event loop support, with trollius, the Python 2 port of asyncio. The
+# MQI calls block, so each connection is driven by a worker thread of
+# its own (MQ connection handles are bound to the thread which created
+# them) and the async classes hand the calls to it, returning Futures
+# of the event loop.
+#
+
+try:
+    import trollius
+except ImportError:
+    trollius = None
+
+
+class _AsyncWorker(object):
+    """Thread running the calls made on behalf of one AsyncQueueManager
+    and resolving their Futures in the event loop. Module Private."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.__requests = collections.deque()
+        self.__cond = threading.Condition()
+        self.__stopped = False
+        self.__thread = threading.Thread(target=self.run,
+                                         name='pymqi-async')
+        self.__thread.setDaemon(True)
+        self.__thread.start()
+
+    def submit(self, func, *args):
+        """submit(func, *args)
+
+        Return a Future of the event loop resolved with the result of
+        func(*args) once the worker thread has called it."""
+
+        future = trollius.Future(loop=self.loop)
+        cond = self.__cond
+        cond.acquire()
+        try:
+            if self.__stopped:
+                raise PYIFError('The AsyncQueueManager has been closed')
+            self.__requests.append((future, func, args))
+            cond.notify()
+        finally:
+            cond.release()
+        return future
+
+    def run(self):
+        "Thread body: run the submitted calls in order."
+        cond = self.__cond
+        while 1:
+            cond.acquire()
+            try:
+                while not self.__requests and not self.__stopped:
+                    cond.wait()
+                if not self.__requests:
+                    return
+                future, func, args = self.__requests.popleft()
+            finally:
+                cond.release()
+            try:
+                result = apply(func, args)
+            except Exception, e:
+                self.loop.call_soon_threadsafe(self.__setException, future, e)
+            else:
+                self.loop.call_soon_threadsafe(self.__setResult, future,
+                                               result)
+
+    def __setResult(self, future, result):
+        if not future.cancelled():
+            future.set_result(result)
+
+    def __setException(self, future, e):
+        if not future.cancelled():
+            future.set_exception(e)
+
+    def stop(self):
+        """stop()
+
+        Let the thread run the calls already submitted, then end."""
+
+        cond = self.__cond
+        cond.acquire()
+        try:
+            self.__stopped = True
+            cond.notify()
+        finally:
+            cond.release()
+
+
+class AsyncQueueManager(object):
+    """AsyncQueueManager is the trollius counterpart of QueueManager. All
+    the MQI calls of the connection, and of the AsyncQueues opened with
+    it, are made by a worker thread dedicated to this object, so they
+    block neither the event loop nor each other's connections. The
+    methods return trollius Futures, which coroutines wait for with
+    'yield From(future)'.
+
+    The calls of a connection run one at a time, in the order they
+    were made. A get waiting for a message delays the calls made after
+    it on the same connection, open several AsyncQueueManagers to wait
+    on several queues at once.
+
+    Requires trollius."""
+
+    def __init__(self, name='', loop=None):
+        """AsyncQueueManager([name, loop])
+
+        Create the worker thread of the connection and connect it to
+        the Queue Manager 'name' (default value ''). If 'name' is None,
+        the connection is deferred until connect(), connectWithOptions()
+        or connectTCPClient() is called. 'loop' is the event loop of the
+        Futures, trollius.get_event_loop() by default.
+
+        The Future of the connection is the 'connected' attribute, None
+        if the connection is deferred. If the connection fails, its
+        error is also raised by every call made until a connection
+        succeeds."""
+
+        if trollius is None:
+            raise PYIFError('trollius is required')
+        if loop is None:
+            loop = trollius.get_event_loop()
+        self.loop = loop
+        self.__worker = _AsyncWorker(loop)
+        # Not connected yet, so no MQI call is made on this thread.
+        self.__qmgr = QueueManager(None)
+        self.__connectError = None
+        self.connected = None
+        if name != None:
+            self.connected = self.connect(name)
+
+    def __connect(self, method, args, kw):
+        try:
+            apply(getattr(self.__qmgr, method), args, kw)
+        except Exception, e:
+            self.__connectError = e
+            raise
+        self.__connectError = None
+
+    def __checked(self, func, args):
+        if self.__connectError is not None:
+            raise self.__connectError
+        return apply(func, args)
+
+    def _submit(self, func, *args):
+        "Run func(*args) on the worker thread. Module Private."
+        return self.__worker.submit(self.__checked, func, args)
+
+    def _call(self, method, *args):
+        """Run the QueueManager 'method' with args on the worker thread.
+        Module Private."""
+        return self.__worker.submit(self.__checked,
+                                    getattr(self.__qmgr, method), args)
+
+    def get_queue_manager(self):
+        """get_queue_manager()
+
+        Return the QueueManager driven by the worker thread. It must
+        only be used from that thread."""
+
+        return self.__qmgr
+
+    def connect(self, name):
+        """connect(name)
+
+        Return a Future of QueueManager.connect(name)."""
+
+        return self.__worker.submit(self.__connect, 'connect', (name,), {})
+
+    def connectWithOptions(self, name, *bwopts, **kw):
+        """connectWithOptions(name [, opts=cnoopts][ ,cd=mqcd][ ,sco=mqsco])
+
+        Return a Future of QueueManager.connectWithOptions()."""
+
+        return self.__worker.submit(self.__connect, 'connectWithOptions',
+                                    (name,) + bwopts, kw)
+
+    def connectTCPClient(self, name, cd, channelName, connectString):
+        """connectTCPClient(name, cd, channelName, connectString)
+
+        Return a Future of QueueManager.connectTCPClient()."""
+
+        return self.__worker.submit(self.__connect, 'connectTCPClient',
+                                    (name, cd, channelName, connectString),
+                                    {})
+
+    def disconnect(self):
+        """disconnect()
+
+        Return a Future of QueueManager.disconnect()."""
+
+        return self._call('disconnect')
+
+    def begin(self):
+        """begin()
+
+        Return a Future of QueueManager.begin()."""
+
+        return self._call('begin')
+
+    def commit(self):
+        """commit()
+
+        Return a Future of QueueManager.commit()."""
+
+        return self._call('commit')
+
+    def backout(self):
+        """backout()
+
+        Return a Future of QueueManager.backout()."""
+
+        return self._call('backout')
+
+    def put1(self, qDesc, msg, *opts):
+        """put1(qDesc, msg [, mDesc, putOpts])
+
+        Return a Future of QueueManager.put1()."""
+
+        return apply(self._call, ('put1', qDesc, msg) + opts)
+
+    def inquire(self, attribute):
+        """inquire(attribute)
+
+        Return a Future of QueueManager.inquire(attribute)."""
+
+        return self._call('inquire', attribute)
+
+    def close(self):
+        """close()
+
+        Disconnect, if connected, and end the worker thread. Return a
+        Future resolved once the connection is closed."""
+
+        future = self.__worker.submit(self.__close)
+        self.__worker.stop()
+        return future
+
+    def __close(self):
+        try:
+            self.__qmgr.disconnect()
+        except PYIFError:
+            # Not connected
+            pass
+
+    # Backward compatibility
+    connect_with_options = connectWithOptions
+    connect_tcp_client = connectTCPClient
+
+
+class AsyncQueue(object):
+    """AsyncQueue is the trollius counterpart of Queue. Its calls are
+    made by the worker thread of its AsyncQueueManager and return
+    trollius Futures.
+
+    A get which waits (MQGMO_WAIT) is split into MQGETs waiting at most
+    wait_slice milliseconds each, so that cancelling its Future stops
+    the wait within wait_slice milliseconds and frees the connection
+    for the next calls. A cancellation only takes effect between two
+    MQGETs: if the MQGET under way returns a message, the message is
+    the result and the cancellation is denied, so that no message is
+    lost.
+
+    A coroutine consumes the queue by calling next_message() until
+    its Future resolves to None:
+
+        while True:
+            item = yield From(queue.next_message())
+            if item is None:
+                break
+            message, mDesc = item
+
+    Each call waits up to iter_wait_interval milliseconds for a
+    message; with MQWI_UNLIMITED, the default, the loop only ends
+    with an error or by being cancelled."""
+
+    # Longest single MQGET wait, in milliseconds.
+    wait_slice = 500
+    iter_wait_interval = CMQC.MQWI_UNLIMITED
+
+    # Result of a sliced get stopped by a cancellation.
+    __getCancelled = object()
+
+    def __init__(self, qMgr, *opts):
+        """AsyncQueue(qMgr, [qDesc [,openOpts]])
+
+        Associate an AsyncQueue with the AsyncQueueManager 'qMgr'. The
+        arguments are those of Queue(); if openOpts is passed, the open
+        is submitted now and any error is raised by the next call."""
+
+        if len(opts) > 2:
+            raise exceptions.TypeError, 'Too many args'
+        self.__qMgr = qMgr
+        self.__queue = Queue(qMgr.get_queue_manager())
+        self.__openError = None
+        if opts:
+            qMgr._submit(self.__open, opts)
+
+    def __open(self, opts):
+        try:
+            apply(self.__queue.open, opts)
+        except Exception, e:
+            self.__openError = e
+            raise
+
+    def __checkOpen(self):
+        "Raise the error of the open submitted by __init__, once."
+        if self.__openError is not None:
+            e, self.__openError = self.__openError, None
+            raise e
+
+    def __checked(self, method, args):
+        self.__checkOpen()
+        return apply(getattr(self.__queue, method), args)
+
+    def __call(self, method, *args):
+        return self.__qMgr._submit(self.__checked, method, args)
+
+    def get_queue(self):
+        """get_queue()
+
+        Return the Queue driven by the worker thread. It must only be
+        used from that thread."""
+
+        return self.__queue
+
+    def open(self, qDesc, *opts):
+        """open(qDesc [,openOpts])
+
+        Return a Future of Queue.open()."""
+
+        return apply(self.__call, ('open', qDesc) + opts)
+
+    def put(self, msg, *opts):
+        """put(msg[, mDesc ,putOpts])
+
+        Return a Future of Queue.put(). mDesc and putOpts are updated
+        once the Future is done."""
+
+        return apply(self.__call, ('put', msg) + opts)
+
+    def get(self, maxLength=None, *opts):
+        """get([maxLength [, mDesc, getOpts]])
+
+        Return a Future of the message returned by Queue.get(). mDesc
+        and getOpts are updated once the Future is done. Cancelling the
+        Future stops a waiting get within wait_slice milliseconds,
+        unless a message is got meanwhile, which is then the result."""
+
+        cancelled = threading.Event()
+        got = self.__qMgr._submit(self.__slicedGet, cancelled, maxLength,
+                                  opts)
+        return self.__qMgr.loop.create_task(self.__waitGot(got, cancelled))
+
+    def __waitGot(self, got, cancelled):
+        """Coroutine of get(). A cancellation is passed to the sliced get
+        and only honoured if it ends without a message."""
+        while 1:
+            try:
+                message = yield trollius.From(
+                    trollius.shield(got, loop=self.__qMgr.loop))
+            except trollius.CancelledError:
+                if got.cancelled():
+                    raise
+                cancelled.set()
+                continue
+            if message is self.__getCancelled:
+                raise trollius.CancelledError()
+            raise trollius.Return(message)
+
+    def __slicedGet(self, cancelled, maxLength, opts):
+        "Queue.get() waiting at most wait_slice ms per MQGET."
+        self.__checkOpen()
+        mDesc, getOpts = apply(commonQArgs, opts)
+        if getOpts == None:
+            getOpts = gmo()
+        if not getOpts.Options & CMQC.MQGMO_WAIT:
+            return self.__queue.get(maxLength, mDesc, getOpts)
+
+        waitInterval = remaining = getOpts.WaitInterval
+        try:
+            while not cancelled.isSet():
+                if remaining == CMQC.MQWI_UNLIMITED:
+                    getOpts.WaitInterval = self.wait_slice
+                else:
+                    getOpts.WaitInterval = min(self.wait_slice, remaining)
+                    remaining = remaining - getOpts.WaitInterval
+                try:
+                    return self.__queue.get(maxLength, mDesc, getOpts)
+                except MQMIError, e:
+                    if e.reason != CMQC.MQRC_NO_MSG_AVAILABLE or \
+                       remaining == 0:
+                        raise
+        finally:
+            getOpts.WaitInterval = waitInterval
+        return self.__getCancelled
+
+    def close(self, options=CMQC.MQCO_NONE):
+        """close([options])
+
+        Return a Future of Queue.close()."""
+
+        return self.__call('close', options)
+
+    def inquire(self, attribute):
+        """inquire(attribute)
+
+        Return a Future of Queue.inquire(attribute)."""
+
+        return self.__call('inquire', attribute)
+
+    def set(self, attribute, arg):
+        """set(attribute, arg)
+
+        Return a Future of Queue.set()."""
+
+        return self.__call('set', attribute, arg)
+
+    def next_message(self):
+        """next_message()
+
+        Return a Future of the next (message, md) tuple, where md is the
+        pymqi.md() of the message, or of None if no message arrives
+        within iter_wait_interval milliseconds. Cancelling the Future
+        stops the wait as for get()."""
+
+        return self.__qMgr.loop.create_task(self.__nextMessage())
+
+    def __nextMessage(self):
+        "Coroutine of next_message()."
+        mDesc = md()
+        getOpts = gmo(Options=CMQC.MQGMO_WAIT | CMQC.MQGMO_FAIL_IF_QUIESCING,
+                      WaitInterval=self.iter_wait_interval)
+        try:
+            message = yield trollius.From(self.get(None, mDesc, getOpts))
+        except MQMIError, e:
+            if e.reason == CMQC.MQRC_NO_MSG_AVAILABLE:
+                raise trollius.Return(None)
+            raise
+        raise trollius.Return((message, mDesc))
@@ -0,0 +1,35 @@
+""" Microbenchmark of the MQOpts structures used on every Queue.put and
+Queue.get call. Run it with 'python benchmark_mqopts.py'.
+"""
+
+# stdlib
+import sys
+import timeit
+
+sys.path.insert(0, "..")
+
+number = 100000
+
+statements = [
+    ('md()', 'pymqi.md()'),
+    ('gmo()', 'pymqi.gmo()'),
+    ('pmo()', 'pymqi.pmo()'),
+    ('md.pack()', 'md.pack()'),
+    ('md.unpack()', 'md.unpack(md_buff)'),
+    ('gmo.pack()', 'gmo.pack()'),
+    ('gmo.unpack()', 'gmo.unpack(gmo_buff)'),
+    ('pmo.pack()', 'pmo.pack()'),
+    ('pmo.unpack()', 'pmo.unpack(pmo_buff)'),
+    ('od.pack()', 'od.pack()'),
+]
+
+setup = """
+import pymqi
+md, gmo, pmo, od = pymqi.md(), pymqi.gmo(), pymqi.pmo(), pymqi.od()
+md_buff, gmo_buff, pmo_buff = md.pack(), gmo.pack(), pmo.pack()
+"""
+
+if __name__ == '__main__':
+    for name, stmt in statements:
+        elapsed = timeit.timeit(stmt, setup, number=number)
+        print '%-14s %8.2f usec/call' % (name, elapsed / number * 1e6)
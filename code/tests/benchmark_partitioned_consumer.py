@@ -0,0 +1,78 @@
+""" Throughput of pymqi.PartitionedConsumer against the number of worker
+threads, with MQGET, MQCMIT and MQBACK served by an in-process fake
+queue so that no queue manager is needed. The handler sleeps to stand
+for the I/O bound work (database writes, HTTP calls) which the workers
+overlap. Run it with 'python benchmark_partitioned_consumer.py'.
+"""
+
+# stdlib
+import sys
+import time
+
+sys.path.insert(0, "..")
+
+# testfixtures
+from testfixtures import Replacer
+
+# PyMQI
+import pymqi
+import CMQC
+
+messages = 2000
+keys = 64
+handler_delay = 0.0005
+worker_counts = [1, 2, 4, 8, 16]
+
+
+class FakeBackend(object):
+    """ A QueueManager and a queue of 'messages' messages spread over
+    'keys' CorrelIds.
+    """
+    def __init__(self):
+        self.queued = [('message %d' % i, '%024d' % (i % keys))
+                       for i in range(messages)]
+        self.queued.reverse()
+
+    def getHandle(self):
+        return 1
+
+    def commit(self):
+        pass
+
+    def backout(self):
+        raise AssertionError('Unexpected backout')
+
+    def MQGET(self, qmgr, queue, md, gmo, length):
+        if not self.queued:
+            return ('', md, gmo, 0, CMQC.MQCC_FAILED,
+                    CMQC.MQRC_NO_MSG_AVAILABLE)
+        msg, correlId = self.queued.pop()
+        return (msg, pymqi.md(CorrelId=correlId).pack(), gmo, len(msg),
+                CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+
+def handler(msg, md):
+    time.sleep(handler_delay)
+
+
+def run(workers):
+    backend = FakeBackend()
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQGET', backend.MQGET)
+        queue = pymqi.Queue(backend)
+        queue.set_handle(2)
+        consumer = pymqi.PartitionedConsumer(backend, queue, handler,
+                                             workers=workers, batch_size=200,
+                                             wait_interval=0)
+        start = time.time()
+        consumer.run()
+        elapsed = time.time() - start
+        consumer.close()
+    return messages / elapsed
+
+
+if __name__ == '__main__':
+    print '%d messages, %d keys, %.1f ms per message' % (
+        messages, keys, handler_delay * 1000)
+    for workers in worker_counts:
+        print '%3d workers %10.0f msgs/s' % (workers, run(workers))
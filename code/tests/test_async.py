@@ -0,0 +1,314 @@
+""" Tests for the pymqi.AsyncQueueManager and pymqi.AsyncQueue classes.
+"""
+
+# stdlib
+import sys
+import threading
+
+sys.path.insert(0, "..")
+
+# nose
+from nose.tools import eq_
+from nose.plugins.skip import SkipTest
+
+# testfixtures
+from testfixtures import Replacer
+
+# PyMQI
+import pymqi
+import CMQC
+
+
+def _run(loop, future, timeout=5):
+    return loop.run_until_complete(pymqi.trollius.wait_for(future, timeout,
+                                                          loop=loop))
+
+
+def _setup():
+    if pymqi.trollius is None:
+        raise SkipTest('trollius is not installed')
+    loop = pymqi.trollius.new_event_loop()
+    return loop
+
+
+def _MQCONN(name):
+    return (1, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+
+def _MQDISC(qmgr):
+    return (CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+
+def _connect(r, loop):
+    r.replace('pymqi.pymqe.MQCONN', _MQCONN)
+    r.replace('pymqi.pymqe.MQDISC', _MQDISC)
+    qmgr = pymqi.AsyncQueueManager('QM01', loop=loop)
+    queue = pymqi.AsyncQueue(qmgr)
+    _run(loop, qmgr._submit(lambda: queue.get_queue().set_handle(2)))
+    return qmgr, queue
+
+
+def test_calls_run_on_one_thread():
+    """ All the calls of an AsyncQueueManager and its queues are made by
+    the same worker thread, never by the event loop's.
+    """
+    loop = _setup()
+    threads = []
+
+    def _MQCONN(name):
+        threads.append(threading.currentThread())
+        return (1, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQPUT(qmgr, queue, md, pmo, msg):
+        threads.append(threading.currentThread())
+        return (md, pmo, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQCMIT(qmgr):
+        threads.append(threading.currentThread())
+        return (CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQCONN', _MQCONN)
+        r.replace('pymqi.pymqe.MQPUT', _MQPUT)
+        r.replace('pymqi.pymqe.MQCMIT', _MQCMIT)
+        r.replace('pymqi.pymqe.MQDISC', _MQDISC)
+        qmgr = pymqi.AsyncQueueManager('QM01', loop=loop)
+        queue = pymqi.AsyncQueue(qmgr)
+        _run(loop, qmgr._submit(lambda: queue.get_queue().set_handle(2)))
+
+        _run(loop, queue.put('message'))
+        _run(loop, qmgr.commit())
+        _run(loop, qmgr.close())
+
+    eq_(len(threads), 3)
+    eq_(len(set(threads)), 1)
+    assert threads[0] is not threading.currentThread()
+    loop.close()
+
+
+def test_cancel_waiting_get():
+    """ Cancelling the Future of a waiting get ends the wait at the next
+    slice and lets the following calls run.
+    """
+    loop = _setup()
+    waits = []
+
+    def _MQGET(qmgr, queue, md, gmo, length):
+        getOpts = pymqi.gmo()
+        getOpts.unpack(gmo)
+        waits.append(getOpts.WaitInterval)
+        return ('', md, gmo, 0, CMQC.MQCC_FAILED, CMQC.MQRC_NO_MSG_AVAILABLE)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQGET', _MQGET)
+        qmgr, queue = _connect(r, loop)
+        queue.wait_slice = 10
+
+        getOpts = pymqi.gmo(Options=CMQC.MQGMO_WAIT,
+                            WaitInterval=CMQC.MQWI_UNLIMITED)
+        future = queue.get(None, pymqi.md(), getOpts)
+        loop.run_until_complete(pymqi.trollius.sleep(0.05, loop=loop))
+        future.cancel()
+
+        # The worker is free again once the wait has been abandoned.
+        eq_(_run(loop, qmgr._submit(lambda: 'done')), 'done')
+        eq_(getOpts.WaitInterval, CMQC.MQWI_UNLIMITED)
+        assert len(waits) > 1
+        eq_(set(waits), set([10]))
+
+        # A finite wait is split too, and raises once it has elapsed.
+        del waits[:]
+        getOpts = pymqi.gmo(Options=CMQC.MQGMO_WAIT, WaitInterval=25)
+        try:
+            _run(loop, queue.get(None, pymqi.md(), getOpts))
+        except pymqi.MQMIError, e:
+            eq_(e.reason, CMQC.MQRC_NO_MSG_AVAILABLE)
+        else:
+            raise AssertionError('MQMIError not raised')
+        eq_(waits, [10, 10, 5])
+        _run(loop, qmgr.close())
+    loop.close()
+
+
+def test_cancel_denied_for_a_message():
+    """ A get cancelled while its MQGET returns a message resolves to the
+    message instead of losing it.
+    """
+    loop = _setup()
+    started = threading.Event()
+    release = threading.Event()
+
+    def _MQGET(qmgr, queue, md, gmo, length):
+        started.set()
+        release.wait(5)
+        return ('message', md, gmo, 7, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQGET', _MQGET)
+        qmgr, queue = _connect(r, loop)
+
+        getOpts = pymqi.gmo(Options=CMQC.MQGMO_WAIT,
+                            WaitInterval=CMQC.MQWI_UNLIMITED)
+        future = queue.get(None, pymqi.md(), getOpts)
+        loop.run_until_complete(pymqi.trollius.sleep(0, loop=loop))
+        started.wait(5)
+        future.cancel()
+        loop.run_until_complete(pymqi.trollius.sleep(0.01, loop=loop))
+        release.set()
+
+        eq_(_run(loop, future), 'message')
+        assert not future.cancelled()
+        _run(loop, qmgr.close())
+    loop.close()
+
+
+def test_connect_and_open_errors():
+    """ A failed connection is reported by its Future and by the next
+    calls, a failed open by the next call of the AsyncQueue.
+    """
+    loop = _setup()
+
+    def _MQCONN_FAILED(name):
+        return (0, CMQC.MQCC_FAILED, CMQC.MQRC_Q_MGR_NAME_ERROR)
+
+    def _MQOPEN(qmgr, qDesc, options):
+        return (0, qDesc, CMQC.MQCC_FAILED, CMQC.MQRC_UNKNOWN_OBJECT_NAME)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQCONN', _MQCONN_FAILED)
+        r.replace('pymqi.pymqe.MQDISC', _MQDISC)
+        r.replace('pymqi.pymqe.MQOPEN', _MQOPEN)
+        qmgr = pymqi.AsyncQueueManager('QM01', loop=loop)
+        for future in (qmgr.connected, qmgr.commit()):
+            try:
+                _run(loop, future)
+            except pymqi.MQMIError, e:
+                eq_(e.reason, CMQC.MQRC_Q_MGR_NAME_ERROR)
+            else:
+                raise AssertionError('MQMIError not raised')
+
+        r.replace('pymqi.pymqe.MQCONN', _MQCONN)
+        _run(loop, qmgr.connect('QM01'))
+        queue = pymqi.AsyncQueue(qmgr, 'Q1', CMQC.MQOO_OUTPUT)
+        try:
+            _run(loop, queue.put('message'))
+        except pymqi.MQMIError, e:
+            eq_(e.reason, CMQC.MQRC_UNKNOWN_OBJECT_NAME)
+        else:
+            raise AssertionError('MQMIError not raised')
+        _run(loop, qmgr.close())
+    loop.close()
+
+
+def test_next_message():
+    """ next_message() resolves to (message, md) tuples, and to None when
+    no message arrives within iter_wait_interval.
+    """
+    loop = _setup()
+    messages = ['a', 'b']
+
+    def _MQGET(qmgr, queue, md, gmo, length):
+        if not messages:
+            return ('', md, gmo, 0, CMQC.MQCC_FAILED,
+                    CMQC.MQRC_NO_MSG_AVAILABLE)
+        message = messages.pop(0)
+        return (message, md, gmo, len(message), CMQC.MQCC_OK,
+                CMQC.MQRC_NONE)
+
+    @pymqi.trollius.coroutine
+    def consume(queue, received):
+        while True:
+            item = yield pymqi.trollius.From(queue.next_message())
+            if item is None:
+                break
+            received.append(item[0])
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQGET', _MQGET)
+        qmgr, queue = _connect(r, loop)
+        queue.iter_wait_interval = 0
+
+        received = []
+        _run(loop, consume(queue, received))
+        eq_(received, ['a', 'b'])
+        _run(loop, qmgr.close())
+    loop.close()
+
+
+class _DummyQueueManager(object):
+    def getHandle(self):
+        return 1
+
+
+class _DummyAsyncQueueManager(object):
+    def get_queue_manager(self):
+        return _DummyQueueManager()
+
+
+def _sliced_get(queue, cancelled, getOpts):
+    return queue._AsyncQueue__slicedGet(cancelled, None,
+                                        (pymqi.md(), getOpts))
+
+
+def test_sliced_get():
+    """ The worker thread splits a waiting get into MQGETs of at most
+    wait_slice milliseconds, stops between two of them once cancelled
+    and restores the caller's WaitInterval.
+    """
+    waits = []
+    # Set by the third MQGET once armed.
+    cancelled = []
+
+    def _MQGET(qmgr, queue, md, gmo, length):
+        getOpts = pymqi.gmo()
+        getOpts.unpack(gmo)
+        waits.append(getOpts.WaitInterval)
+        if len(waits) == 3 and cancelled:
+            cancelled[0].set()
+        return ('', md, gmo, 0, CMQC.MQCC_FAILED, CMQC.MQRC_NO_MSG_AVAILABLE)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQGET', _MQGET)
+        queue = pymqi.AsyncQueue(_DummyAsyncQueueManager())
+        queue.get_queue().set_handle(2)
+        queue.wait_slice = 10
+
+        # A finite wait raises once it has elapsed.
+        getOpts = pymqi.gmo(Options=CMQC.MQGMO_WAIT, WaitInterval=25)
+        try:
+            _sliced_get(queue, threading.Event(), getOpts)
+        except pymqi.MQMIError, e:
+            eq_(e.reason, CMQC.MQRC_NO_MSG_AVAILABLE)
+        else:
+            raise AssertionError('MQMIError not raised')
+        eq_(waits, [10, 10, 5])
+        eq_(getOpts.WaitInterval, 25)
+
+        # An unlimited wait ends with the cancellation.
+        del waits[:]
+        cancelled.append(threading.Event())
+        getOpts = pymqi.gmo(Options=CMQC.MQGMO_WAIT,
+                            WaitInterval=CMQC.MQWI_UNLIMITED)
+        result = _sliced_get(queue, cancelled[0], getOpts)
+        eq_(result, pymqi.AsyncQueue._AsyncQueue__getCancelled)
+        eq_(waits, [10, 10, 10])
+        eq_(getOpts.WaitInterval, CMQC.MQWI_UNLIMITED)
+
+
+def test_sliced_get_keeps_message():
+    """ A message returned by the MQGET under way when the get is
+    cancelled is the result of the get.
+    """
+    cancelled = threading.Event()
+
+    def _MQGET(qmgr, queue, md, gmo, length):
+        cancelled.set()
+        return ('message', md, gmo, 7, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQGET', _MQGET)
+        queue = pymqi.AsyncQueue(_DummyAsyncQueueManager())
+        queue.get_queue().set_handle(2)
+        getOpts = pymqi.gmo(Options=CMQC.MQGMO_WAIT,
+                            WaitInterval=CMQC.MQWI_UNLIMITED)
+        eq_(_sliced_get(queue, cancelled, getOpts), 'message')
@@ -0,0 +1,259 @@
+""" Tests for pymqi.ConsumerPool class.
+"""
+
+# stdlib
+import os
+import sys
+import time
+import signal
+import multiprocessing
+
+sys.path.insert(0, "..")
+
+# nose
+from nose.tools import eq_
+
+# testfixtures
+from testfixtures import Replacer
+
+# PyMQI
+import pymqi
+import CMQC
+
+
+class _FakeQueueManager(object):
+    """ Stands for the QueueManager each worker connects, the messages
+    come from a queue shared by the processes.
+    """
+    def __init__(self, messages, dead_letter_queue='DLQ'):
+        self.messages = messages
+        self.dead_letter_queue = dead_letter_queue
+
+    def getHandle(self):
+        return 1
+
+    def inquire(self, attribute):
+        eq_(attribute, CMQC.MQCA_DEAD_LETTER_Q_NAME)
+        return self.dead_letter_queue.ljust(48)
+
+    def commit(self):
+        pass
+
+    def backout(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+def _pool(r, messages, handler, moved=None, backout_queue='Q1.BACKOUT',
+          put_reason=CMQC.MQRC_NONE, **kw):
+    def _MQOPEN(qmgr, od, options):
+        return (2, od, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQINQ(qmgr, handle, attribute):
+        if attribute == CMQC.MQIA_BACKOUT_THRESHOLD:
+            return (3, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+        return (backout_queue.ljust(48), CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQPUT(qmgr, queue, md, pmo, msg):
+        if put_reason:
+            return (md, pmo, CMQC.MQCC_FAILED, put_reason)
+        putOpts = pymqi.pmo()
+        putOpts.unpack(pmo)
+        moved.put((msg, putOpts.Options & CMQC.MQPMO_SYNCPOINT))
+        return (md, pmo, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQCLOSE(qmgr, handle, options):
+        return (CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQGET(qmgr, queue, md, gmo, length):
+        try:
+            msg = messages.get(True, 0.01)
+        except Exception:
+            return ('', md, gmo, 0, CMQC.MQCC_FAILED,
+                    CMQC.MQRC_NO_MSG_AVAILABLE)
+        if msg.startswith('poison'):
+            md = pymqi.md(BackoutCount=3).pack()
+        return (msg, md, gmo, len(msg), CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    r.replace('pymqi.pymqe.MQOPEN', _MQOPEN)
+    r.replace('pymqi.pymqe.MQINQ', _MQINQ)
+    r.replace('pymqi.pymqe.MQPUT', _MQPUT)
+    r.replace('pymqi.pymqe.MQCLOSE', _MQCLOSE)
+    r.replace('pymqi.pymqe.MQGET', _MQGET)
+    kw.setdefault('connect', lambda: _FakeQueueManager(messages))
+    return pymqi.ConsumerPool(queue_name='Q1', handler=handler,
+                              wait_interval=10, **kw)
+
+
+def _wait_for(pool, count):
+    deadline = time.time() + 10
+    while pool.stats()['total']['messages'] < count and \
+          time.time() < deadline:
+        pool.check()
+        time.sleep(0.01)
+
+
+def test_workers_and_counters():
+    """ The workers share the messages and report their counters through
+    shared memory.
+    """
+    messages = multiprocessing.Queue()
+    for i in range(20):
+        messages.put('message %d' % i)
+    handled = multiprocessing.Queue()
+
+    with Replacer() as r:
+        pool = _pool(r, messages, lambda msg, md: handled.put(os.getpid()),
+                     processes=2, batch_size=5)
+        pool.start()
+        _wait_for(pool, 20)
+        pool.stop(5)
+
+    stats = pool.stats()
+    eq_(stats['total']['messages'], 20)
+    eq_(stats['total']['errors'], 0)
+    eq_(len(stats['workers']), 2)
+    assert stats['total']['throughput'] > 0
+    pids = set([handled.get() for i in range(20)])
+    assert len(pids) <= 2
+
+
+def test_restart_and_errors():
+    """ A worker dying is restarted, a handler error is counted and its
+    unit of work backed out.
+    """
+    messages = multiprocessing.Queue()
+    for msg in ('ok', 'fail', 'exit', 'ok', 'ok'):
+        messages.put(msg)
+
+    def handler(msg, md):
+        if msg == 'fail':
+            raise ValueError(msg)
+        if msg == 'exit':
+            os._exit(1)
+
+    with Replacer() as r:
+        pool = _pool(r, messages, handler, processes=1)
+        pool.start()
+        _wait_for(pool, 3)
+        pool.stop(5)
+
+    total = pool.stats()['total']
+    eq_(total['messages'], 3)
+    eq_(total['errors'], 1)
+    eq_(total['backouts'], 1)
+    eq_(total['restarts'], 1)
+
+
+def test_poison_messages():
+    """ A message backed out BOTHRESH times is moved to the backout
+    queue under syncpoint, or to the dead-letter queue without one, and
+    not handled.
+    """
+    messages = multiprocessing.Queue()
+    moved = multiprocessing.Queue()
+    for msg in ('ok', 'poison 1', 'ok'):
+        messages.put(msg)
+    handled = multiprocessing.Queue()
+
+    with Replacer() as r:
+        pool = _pool(r, messages, lambda msg, md: handled.put(msg),
+                     moved, processes=1)
+        pool.start()
+        _wait_for(pool, 2)
+        pool.stop(5)
+    eq_(pool.stats()['total']['poisoned'], 1)
+    eq_(moved.get(True, 1), ('poison 1', CMQC.MQPMO_SYNCPOINT))
+
+    for msg in ('poison 2', 'ok'):
+        messages.put(msg)
+    with Replacer() as r:
+        pool = _pool(r, messages, lambda msg, md: handled.put(msg),
+                     moved, '', processes=1)
+        pool.start()
+        _wait_for(pool, 1)
+        pool.stop(5)
+    eq_(pool.stats()['total']['poisoned'], 1)
+    msg, options = moved.get(True, 1)
+    header = pymqi.DLH()
+    header.unpack(msg[:len(header.pack())])
+    eq_(header.Reason, CMQC.MQRC_BACKOUT_THRESHOLD_REACHED)
+    eq_(header.DestQName.strip('\0'), 'Q1')
+    eq_(msg[len(header.pack()):], 'poison 2')
+    eq_(options, CMQC.MQPMO_SYNCPOINT)
+    eq_([handled.get(True, 1) for i in range(3)], ['ok', 'ok', 'ok'])
+
+
+def test_poison_message_not_moved():
+    """ A poison message which can't be moved aside, for want of a
+    queue or because the put fails, is backed out and its worker
+    restarted after a delay.
+    """
+    def connect():
+        return _FakeQueueManager(messages, '')
+
+    for kw in ({'put_reason': CMQC.MQRC_Q_FULL},
+               {'backout_queue': '', 'connect': connect}):
+        messages = multiprocessing.Queue()
+        messages.put('poison 3')
+        handled = multiprocessing.Queue()
+        with Replacer() as r:
+            pool = _pool(r, messages, lambda msg, md: handled.put(msg),
+                         processes=1, restart_delay=60, **kw)
+            pool.start()
+            deadline = time.time() + 0.5
+            while time.time() < deadline:
+                pool.check()
+                time.sleep(0.01)
+            pool.stop(5)
+        total = pool.stats()['total']
+        eq_(total['poisoned'], 1)
+        eq_(total['backouts'], 1)
+        eq_(total['commits'], 0)
+        eq_(total['restarts'], 0)
+        eq_(handled.empty(), True)
+
+
+def test_sigterm_stops_one_worker():
+    """ SIGTERM stops the worker it is sent to, which is restarted, and
+    not the other ones.
+    """
+    messages = multiprocessing.Queue()
+
+    with Replacer() as r:
+        pool = _pool(r, messages, lambda msg, md: None, processes=2)
+        pool.start()
+        time.sleep(0.1)
+        workers = dict([(worker.name, worker) for worker in
+                        multiprocessing.active_children()])
+        os.kill(workers['pymqi-consumer-0'].pid, signal.SIGTERM)
+        workers['pymqi-consumer-0'].join(5)
+        eq_(workers['pymqi-consumer-1'].is_alive(), True)
+        eq_(pool.check(), 1)
+        pool.stop(5)
+    eq_(pool.stats()['total']['restarts'], 1)
+
+
+def test_connect_failure_backoff():
+    """ A worker which can't connect is restarted after a delay doubled
+    after every failure.
+    """
+    def connect():
+        raise pymqi.MQMIError(CMQC.MQCC_FAILED,
+                              CMQC.MQRC_Q_MGR_NOT_AVAILABLE)
+
+    messages = multiprocessing.Queue()
+    with Replacer() as r:
+        pool = _pool(r, messages, lambda msg, md: None, processes=1,
+                     connect=connect, restart_delay=0.05)
+        pool.start()
+        deadline = time.time() + 1
+        while time.time() < deadline:
+            pool.check()
+            time.sleep(0.01)
+        pool.stop(5)
+    # Restarted after 0.05, 0.1, 0.2 and 0.4 seconds.
+    restarts = pool.stats()['total']['restarts']
+    assert 2 <= restarts <= 5, restarts
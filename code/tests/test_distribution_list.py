@@ -0,0 +1,113 @@
+""" Tests for pymqi.DistributionList class.
+"""
+
+# stdlib
+import sys
+import ctypes
+import struct
+
+sys.path.insert(0, "..")
+
+# nose
+from nose.tools import eq_
+
+# testfixtures
+from testfixtures import Replacer
+
+# PyMQI
+import pymqi
+import CMQC
+
+
+class _DummyQueueManager(object):
+    def getHandle(self):
+        return 1
+
+
+def _write_responses(address, responses):
+    recs = ''.join([struct.pack(pymqi.MQLONG_TYPE * 2, comp, reason)
+                    for comp, reason in responses])
+    ctypes.memmove(address, recs, len(recs))
+
+
+def test_open_and_put():
+    """ The destinations are passed as MQOR records of a version 2 MQOD,
+    MsgIds and CorrelIds as MQPMR records, and the MQRR response records
+    give the outcome for each destination.
+    """
+    calls = {}
+
+    def _MQOPEN(qmgr, od, options):
+        qDesc = pymqi.od()
+        qDesc.unpack(od)
+        eq_(qDesc.Version, CMQC.MQOD_VERSION_2)
+        eq_(qDesc.RecsPresent, 3)
+        calls['objects'] = ctypes.string_at(qDesc.ObjectRecPtr, 3 * 96)
+        _write_responses(qDesc.ResponseRecPtr,
+                         [(CMQC.MQCC_OK, CMQC.MQRC_NONE)] * 3)
+        qDesc.KnownDestCount = 3
+        return (5, qDesc.pack(), CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQPUT(qmgr, handle, md, pmo, msg):
+        putOpts = pymqi.pmo()
+        putOpts.unpack(pmo)
+        eq_(handle, 5)
+        eq_(putOpts.Version, CMQC.MQPMO_VERSION_2)
+        eq_(putOpts.PutMsgRecFields,
+            CMQC.MQPMRF_MSG_ID | CMQC.MQPMRF_CORREL_ID)
+        recs = ctypes.string_at(putOpts.PutMsgRecPtr, 3 * 48)
+        calls['put'] = recs
+        # The queue manager fills in the MsgIds it generates.
+        ctypes.memmove(putOpts.PutMsgRecPtr + 48, 'G' * 24, 24)
+        _write_responses(putOpts.ResponseRecPtr,
+                         [(CMQC.MQCC_OK, CMQC.MQRC_NONE),
+                          (CMQC.MQCC_OK, CMQC.MQRC_NONE),
+                          (CMQC.MQCC_FAILED, CMQC.MQRC_Q_FULL)])
+        return (md, pmo, CMQC.MQCC_WARNING, CMQC.MQRC_MULTIPLE_REASONS)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQOPEN', _MQOPEN)
+        r.replace('pymqi.pymqe.MQPUT', _MQPUT)
+
+        dl = pymqi.DistributionList(_DummyQueueManager(),
+                                    ['Q1', ('Q2', 'QM2'), 'Q3'])
+        eq_(calls['objects'][:2], 'Q1')
+        eq_(calls['objects'][96:98], 'Q2')
+        eq_(calls['objects'][144:147], 'QM2')
+        eq_(dl.open_results, [(CMQC.MQCC_OK, CMQC.MQRC_NONE)] * 3)
+        eq_(dl.known_dest_count, 3)
+
+        putOpts = pymqi.pmo()
+        results = dl.put('message', None, putOpts,
+                         ['A' * 24, None, 'C' * 24],
+                         ['1' * 24, '2' * 24, '3' * 24])
+        eq_(calls['put'][:48], 'A' * 24 + '1' * 24)
+        eq_(calls['put'][48:96], '\0' * 24 + '2' * 24)
+        eq_(results, [('A' * 24, CMQC.MQCC_OK, CMQC.MQRC_NONE),
+                      ('G' * 24, CMQC.MQCC_OK, CMQC.MQRC_NONE),
+                      ('C' * 24, CMQC.MQCC_FAILED, CMQC.MQRC_Q_FULL)])
+        eq_(putOpts.PutMsgRecPtr, 0)
+        eq_(putOpts.ResponseRecPtr, 0)
+
+
+def test_put_same_reason():
+    """ Without MQRC_MULTIPLE_REASONS every destination has the reason of
+    the call, and a common failure is raised.
+    """
+    def _MQOPEN(qmgr, od, options):
+        return (5, od, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQPUT(qmgr, handle, md, pmo, msg):
+        return (md, pmo, CMQC.MQCC_FAILED, CMQC.MQRC_PUT_INHIBITED)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQOPEN', _MQOPEN)
+        r.replace('pymqi.pymqe.MQPUT', _MQPUT)
+
+        dl = pymqi.DistributionList(_DummyQueueManager(), ['Q1', 'Q2'])
+        try:
+            dl.put('message')
+        except pymqi.MQMIError, e:
+            eq_(e.reason, CMQC.MQRC_PUT_INHIBITED)
+        else:
+            raise AssertionError('MQMIError not raised')
@@ -0,0 +1,248 @@
+""" Tests for pymqi.MessageHandle class.
+"""
+
+# stdlib
+import sys
+
+sys.path.insert(0, "..")
+
+# nose
+from nose.tools import eq_, assert_raises
+from nose.plugins.skip import SkipTest
+
+# testfixtures
+from testfixtures import Replacer
+
+# PyMQI
+import pymqi
+import CMQC
+
+
+class _DummyQueueManager(object):
+    def get_handle(self):
+        return 1
+
+
+def _MQCRTMH(conn_handle, cmho):
+    return CMQC.MQCC_OK, CMQC.MQRC_NONE, 10
+
+
+def _require_extension():
+    if not getattr(pymqi.pymqe, '__file__', '').endswith(('.so', '.pyd')):
+        raise SkipTest('pymqe is not the compiled extension')
+
+
+def test_get_all():
+    """ get_all() reads the properties in one pymqe call and raises the
+    errors of MQINQMP.
+    """
+    calls = []
+    properties = {'JMSType': 'order', 'priority': 4, 'urgent': True}
+
+    def _MQINQMP_ALL(conn_handle, msg_handle, name, impo_options,
+                     value_length):
+        calls.append((conn_handle, msg_handle, name, impo_options,
+                      value_length))
+        if name == 'bad':
+            return {}, CMQC.MQCC_FAILED, CMQC.MQRC_HMSG_ERROR
+        return dict(properties), CMQC.MQCC_OK, CMQC.MQRC_NONE
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQCRTMH', _MQCRTMH)
+        r.replace('pymqi.pymqe.MQINQMP_ALL', _MQINQMP_ALL)
+        handle = pymqi.MessageHandle(_DummyQueueManager())
+        eq_(handle.properties.get_all(), properties)
+        try:
+            handle.properties.get_all('bad')
+        except pymqi.MQMIError, e:
+            eq_(e.reason, CMQC.MQRC_HMSG_ERROR)
+        else:
+            raise AssertionError('MQMIError not raised')
+
+    eq_(calls[0], (1, 10, '%', CMQC.MQIMPO_NONE,
+                   pymqi.MessageHandle.default_value_length))
+
+
+def test_get_passes_pd_options():
+    """ get() passes the MQPD options, not the MQIMPO ones, as such.
+    """
+    calls = []
+
+    def _MQINQMP(conn_handle, msg_handle, impo_options, name, pd_options,
+                 property_type, max_value_length):
+        calls.append((impo_options, pd_options))
+        return CMQC.MQCC_OK, CMQC.MQRC_NONE, 'value'
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQCRTMH', _MQCRTMH)
+        r.replace('pymqi.pymqe.MQINQMP', _MQINQMP)
+        handle = pymqi.MessageHandle(_DummyQueueManager())
+        eq_(handle.properties.get('name', impo_options=CMQC.MQIMPO_INQ_NEXT),
+            'value')
+
+    eq_(calls, [(CMQC.MQIMPO_INQ_NEXT, CMQC.MQPD_NONE)])
+
+
+def test_update():
+    """ update() sets properties of mixed types in one pymqe call, with
+    the default MQSMPO and MQPD packed once.
+    """
+    calls = []
+
+    def _MQSETMP_MANY(conn_handle, msg_handle, smpo, pd, properties):
+        calls.append((smpo, pd, sorted(properties)))
+        for index, (name, property_type, value) in enumerate(properties):
+            if name == 'bad':
+                return CMQC.MQCC_FAILED, CMQC.MQRC_PROPERTY_NAME_ERROR, index
+        return CMQC.MQCC_OK, CMQC.MQRC_NONE, -1
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQCRTMH', _MQCRTMH)
+        r.replace('pymqi.pymqe.MQSETMP_MANY', _MQSETMP_MANY)
+        handle = pymqi.MessageHandle(_DummyQueueManager())
+        handle.properties.update({'a': True, 'b': 7, 'c': 2 ** 40,
+                                  'd': 0.5, 'e': 'text',
+                                  'f': bytearray('\0\1'), 'g': None,
+                                  'h': (3, CMQC.MQTYPE_INT16)})
+        try:
+            handle.properties.update([('ok', 1), ('bad', 1)])
+        except pymqi.MQMIError, e:
+            eq_(e.reason, CMQC.MQRC_PROPERTY_NAME_ERROR)
+            eq_(e.index, 1)
+            eq_(e.property_name, 'bad')
+        else:
+            raise AssertionError('MQMIError not raised')
+        try:
+            handle.properties.update({'x': object()})
+        except TypeError:
+            pass
+        else:
+            raise AssertionError('TypeError not raised')
+
+    smpo, pd, properties = calls[0]
+    eq_(smpo, pymqi.SMPO().pack())
+    eq_(pd, pymqi.PD().pack())
+    eq_(properties, [('a', CMQC.MQTYPE_BOOLEAN, True),
+                     ('b', CMQC.MQTYPE_INT32, 7),
+                     ('c', CMQC.MQTYPE_INT64, 2 ** 40),
+                     ('d', CMQC.MQTYPE_FLOAT64, 0.5),
+                     ('e', CMQC.MQTYPE_STRING, 'text'),
+                     ('f', CMQC.MQTYPE_BYTE_STRING, bytearray('\0\1')),
+                     ('g', CMQC.MQTYPE_NULL, None),
+                     ('h', CMQC.MQTYPE_INT16, 3)])
+    eq_(len(calls), 2)
+
+
+def test_update_conversions():
+    """ MQSETMP_MANY refuses integers out of the range of their MQTYPE
+    and unicode byte strings, and encodes unicode strings, before any
+    property is set.
+    """
+    _require_extension()
+    smpo = pymqi.SMPO().pack()
+    pd = pymqi.PD().pack()
+    for property_type, value in ((CMQC.MQTYPE_INT8, 128),
+                                 (CMQC.MQTYPE_INT8, -129),
+                                 (CMQC.MQTYPE_INT16, 0x8000),
+                                 (CMQC.MQTYPE_INT32, -0x80000001)):
+        assert_raises(OverflowError, pymqi.pymqe.MQSETMP_MANY, 0, 0, smpo,
+                      pd, [('p', property_type, value)])
+    assert_raises(UnicodeEncodeError, pymqi.pymqe.MQSETMP_MANY, 0, 0,
+                  smpo, pd, [('p', CMQC.MQTYPE_STRING, u'\u20ac')])
+    assert_raises(TypeError, pymqi.pymqe.MQSETMP_MANY, 0, 0, smpo, pd,
+                  [('p', CMQC.MQTYPE_BYTE_STRING, u'abc')])
+
+
+def test_pool_and_get_with_properties():
+    """ get_with_properties() gets the message into a pooled handle and
+    returns its properties; the pool reuses handles and deletes the
+    extra ones.
+    """
+    created = []
+    deleted = []
+    handles = []
+
+    def _MQCRTMH(conn_handle, cmho):
+        created.append(len(created) + 10)
+        return CMQC.MQCC_OK, CMQC.MQRC_NONE, created[-1]
+
+    def _MQDLTMH(conn_handle, msg_handle, dmho):
+        deleted.append(msg_handle)
+        return CMQC.MQCC_OK, CMQC.MQRC_NONE
+
+    def _MQGET(qmgr, queue, md, gmo, length):
+        getOpts = pymqi.gmo()
+        getOpts.unpack(gmo)
+        eq_(getOpts.Options & CMQC.MQGMO_PROPERTIES_IN_HANDLE,
+            CMQC.MQGMO_PROPERTIES_IN_HANDLE)
+        handles.append(getOpts.MsgHandle)
+        return 'msg', md, gmo, 3, CMQC.MQCC_OK, CMQC.MQRC_NONE
+
+    def _MQINQMP_ALL(conn_handle, msg_handle, name, impo_options,
+                     value_length):
+        return {'handle': msg_handle}, CMQC.MQCC_OK, CMQC.MQRC_NONE
+
+    class _QueueManager(_DummyQueueManager):
+        def getHandle(self):
+            return 1
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQCRTMH', _MQCRTMH)
+        r.replace('pymqi.pymqe.MQDLTMH', _MQDLTMH)
+        r.replace('pymqi.pymqe.MQGET', _MQGET)
+        r.replace('pymqi.pymqe.MQINQMP_ALL', _MQINQMP_ALL)
+        qmgr = _QueueManager()
+        queue = pymqi.Queue(qmgr)
+        queue.set_handle(2)
+        pool = pymqi.MessageHandlePool(qmgr, size=1)
+
+        eq_(queue.get_with_properties(pool), ('msg', {'handle': 10}))
+        getOpts = pymqi.gmo()
+        eq_(queue.get_with_properties(pool, None, pymqi.md(), getOpts),
+            ('msg', {'handle': 10}))
+        eq_(handles, [10, 10])
+        # The caller's getOpts doesn't keep the pooled handle.
+        eq_(getOpts.pack(), pymqi.gmo().pack())
+
+        # Without a pool, the handle lives for the call only.
+        eq_(queue.get_with_properties(), ('msg', {'handle': 11}))
+        eq_(deleted, [11])
+
+        first, second = pool.get(), pool.get()
+        pool.put(first)
+        pool.put(second)
+        eq_(deleted, [11, 12])
+        eq_(pool.metrics(), {'creates': 2, 'reuses': 2, 'deletes': 1,
+                             'idle': 1})
+        pool.close()
+        eq_(deleted, [11, 12, 10])
+        eq_(first.msg_handle, CMQC.MQHM_UNUSABLE_HMSG)
+        eq_(second.msg_handle, CMQC.MQHM_UNUSABLE_HMSG)
+
+
+def test_to_and_from_buffer():
+    """ to_buffer() grows its buffer to the length MQMHBUF asks for and
+    from_buffer() returns the message MQBUFMH leaves.
+    """
+    lengths = []
+
+    def _MQMHBUF(conn_handle, msg_handle, mhbo, name, md, max_length):
+        lengths.append(max_length)
+        rfh2 = 'x' * 5000
+        if max_length < len(rfh2):
+            return (rfh2[:max_length], md, len(rfh2), CMQC.MQCC_FAILED,
+                    CMQC.MQRC_PROPERTY_VALUE_TOO_BIG)
+        return rfh2, md, len(rfh2), CMQC.MQCC_OK, CMQC.MQRC_NONE
+
+    def _MQBUFMH(conn_handle, msg_handle, bmho, md, msg):
+        return msg[5000:], md, CMQC.MQCC_OK, CMQC.MQRC_NONE
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQCRTMH', _MQCRTMH)
+        r.replace('pymqi.pymqe.MQMHBUF', _MQMHBUF)
+        r.replace('pymqi.pymqe.MQBUFMH', _MQBUFMH)
+        handle = pymqi.MessageHandle(_DummyQueueManager())
+        rfh2 = handle.to_buffer()
+        eq_(len(rfh2), 5000)
+        eq_(lengths, [4096, 5000])
+        eq_(handle.from_buffer(rfh2 + 'body'), 'body')
@@ -0,0 +1,184 @@
+""" Tests for pymqi.MQOpts and its precompiled pack/unpack codecs.
+"""
+
+# stdlib
+import copy_reg
+import pickle
+import struct
+import sys
+
+sys.path.insert(0, "..")
+
+# nose
+from nose.tools import eq_, assert_true, assert_raises
+from nose.plugins.skip import SkipTest
+
+# PyMQI
+import pymqi
+import CMQC
+
+
+def test_codec_shared_between_instances():
+    """ Structures with the same layout share one precompiled codec.
+    """
+    eq_(pymqi._getCodec(pymqi.md._fields, pymqi.md),
+        pymqi._getCodec(list(pymqi.md._fields)))
+    assert_true(pymqi.od()._MQOpts__codec is pymqi.od()._MQOpts__codec)
+
+
+def test_pack_unpack_round_trip():
+    """ pack() and unpack() are still each other's inverse and agree with
+    a plain struct.pack of the member list.
+    """
+    for cls in (pymqi.md, pymqi.gmo, pymqi.pmo, pymqi.od):
+        opts = cls()
+        fmt = ''.join([i[2] for i in cls._fields])
+        values = [getattr(opts, i[0]) for i in cls._fields]
+        eq_(opts.pack(), struct.pack(fmt, *values))
+        eq_(opts.get_length(), struct.calcsize(fmt))
+
+    md = pymqi.md(Priority=7, MsgId='1' * 24, Format=CMQC.MQFMT_STRING)
+    other = pymqi.md()
+    other.unpack(md.pack())
+    eq_(other.Priority, 7)
+    eq_(other.MsgId, '1' * 24)
+    eq_(other.Format, CMQC.MQFMT_STRING)
+
+
+def test_array_members_are_not_shared():
+    """ Array members (such as MQCD.MsgCompList) are flattened when
+    packing and each instance gets its own copy of the default.
+    """
+    cd1 = pymqi.cd()
+    cd2 = pymqi.cd()
+    cd1.MsgCompList[0] = 7
+    eq_(cd2.MsgCompList[0], 0)
+    eq_(len(cd1.pack()), cd1.get_length())
+
+
+def test_invalid_member():
+    """ Unknown members are still rejected by the constructor.
+    """
+    assert_raises(AttributeError, pymqi.md, NoSuchMember=1)
+
+
+def test_descriptors_use_slots():
+    """ md, gmo and pmo have no __dict__, be they slotted MQOpts or the
+    pymqe native structures, reject unknown attributes and still support
+    the dictionary-style API.
+    """
+    for cls in (pymqi.md, pymqi.gmo, pymqi.pmo):
+        opts = cls()
+        assert_true(not hasattr(opts, '__dict__'))
+        eq_(sorted(opts.get().keys()), sorted([i[0] for i in cls._fields]))
+        assert_raises(AttributeError, setattr, opts, 'NoSuchMember', 1)
+
+    md = pymqi.md()
+    md['Priority'] = 3
+    eq_(md.Priority, 3)
+    eq_(md.get()['Priority'], 3)
+
+
+def test_pickle():
+    """ Structures survive a pickle round trip, with or without __slots__.
+    """
+    import pickle
+
+    for opts in (pymqi.md(Priority=4), pymqi.od(ObjectName='Q1')):
+        for protocol in (0, 2):
+            copy = pickle.loads(pickle.dumps(opts, protocol))
+            eq_(copy.pack(), opts.pack())
+
+
+def test_struct_arg():
+    """ MQOpts structures are packed for the pymqe calls, the pymqe native
+    structures are passed as they are.
+    """
+    od = pymqi.od(ObjectName='Q1')
+    eq_(pymqi._structArg(od), od.pack())
+
+    md = pymqi.md(Priority=2)
+    if isinstance(md, pymqi._nativeOpts):
+        assert_true(pymqi._structArg(md) is md)
+    else:
+        eq_(pymqi._structArg(md), md.pack())
+
+
+class _OldPickle(object):
+    """ Pickles as the MQOpts based md, gmo & pmo did, with their
+    (members, values) state.
+    """
+    def __init__(self, cls, protocol, **kw):
+        self.cls = cls
+        self.protocol = protocol
+        self.values = dict([(i[0], i[1]) for i in cls._fields])
+        self.values.update(kw)
+
+    # Checked by the pickler against the class to build.
+    __class__ = property(lambda self: self.cls)
+
+    def __reduce_ex__(self, protocol):
+        state = (list(self.cls._fields), self.values)
+        if self.protocol < 2:
+            return (copy_reg._reconstructor, (self.cls, object, None), state)
+        return (copy_reg.__newobj__, (self.cls,), state)
+
+
+def test_unpickle_old_state():
+    """ md, gmo & pmo pickled with their old (members, values) state load
+    with the values they were pickled with.
+    """
+    for cls, kw in ((pymqi.md, {'Priority': 4, 'MsgId': 'id'}),
+                    (pymqi.gmo, {'WaitInterval': 100}),
+                    (pymqi.pmo, {'Options': CMQC.MQPMO_SYNCPOINT})):
+        for protocol in (0, 2):
+            data = pickle.dumps(_OldPickle(cls, protocol, **kw), protocol)
+            copy = pickle.loads(data)
+            assert_true(isinstance(copy, cls))
+            eq_(copy.pack(), apply(cls, (), kw).pack())
+
+
+class _Opts(pymqi.MQOpts):
+    """ An MQOpts of any member list.
+    """
+
+
+def test_native_pack_matches_mqopts():
+    """ The native structures pack as the MQOpts ones, member for member
+    and with the same defaults.
+    """
+    if not pymqi._nativeOpts:
+        raise SkipTest('pymqe has no native structures')
+    for native, cls, kw in (
+        (pymqi.pymqe.MQMD, pymqi.md,
+         {'Priority': 4, 'MsgId': 'id', 'Expiry': 100, 'Format': 'MQSTR',
+          'GroupId': 'group', 'OriginalLength': 10}),
+        (pymqi.pymqe.MQGMO, pymqi.gmo,
+         {'Options': CMQC.MQGMO_WAIT, 'WaitInterval': 100,
+          'MatchOptions': CMQC.MQMO_MATCH_MSG_ID, 'MsgHandle': 5}),
+        (pymqi.pymqe.MQPMO, pymqi.pmo,
+         {'Options': CMQC.MQPMO_SYNCPOINT, 'Context': 3,
+          'ResolvedQName': 'Q1'})):
+        for values in ({}, kw):
+            eq_(apply(native, (), values).pack(),
+                apply(_Opts, (cls._fields,), values).pack())
+
+
+def test_native_integer_range():
+    """ Native structures refuse integers their members can't hold rather
+    than wrap them, as struct.pack does for MQOpts.
+    """
+    if not pymqi._nativeOpts:
+        raise SkipTest('pymqe has no native structures')
+    mDesc = pymqi.pymqe.MQMD()
+    for value in (-0x80000000, 0x7fffffff):
+        mDesc.Priority = value
+        eq_(mDesc.Priority, value)
+    for value in (-0x80000001, 0x80000000):
+        assert_raises(OverflowError, setattr, mDesc, 'Priority', value)
+    getOpts = pymqi.pymqe.MQGMO()
+    for value in (-0x80, 0x7f):
+        getOpts.GroupStatus = value
+        eq_(getOpts.GroupStatus, value)
+    for value in (-0x81, 0x80):
+        assert_raises(OverflowError, setattr, getOpts, 'GroupStatus', value)
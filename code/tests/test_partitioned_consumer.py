@@ -0,0 +1,119 @@
+""" Tests for pymqi.PartitionedConsumer class.
+"""
+
+# stdlib
+import sys
+import threading
+
+sys.path.insert(0, "..")
+
+# nose
+from nose.tools import eq_
+
+# testfixtures
+from testfixtures import Replacer
+
+# PyMQI
+import pymqi
+import CMQC
+
+
+class _Backend(object):
+    """ A queue of messages under syncpoint, and its QueueManager.
+    """
+    def __init__(self, messages):
+        self.queued = list(messages)
+        self.uncommitted = []
+        self.commits = 0
+        self.backouts = 0
+
+    def getHandle(self):
+        return 1
+
+    def commit(self):
+        self.commits += 1
+        self.uncommitted = []
+
+    def backout(self):
+        self.backouts += 1
+        self.queued[:0] = self.uncommitted
+        self.uncommitted = []
+
+    def MQGET(self, qmgr, queue, md, gmo, length):
+        getOpts = pymqi.gmo()
+        getOpts.unpack(gmo)
+        eq_(getOpts.Options & CMQC.MQGMO_SYNCPOINT, CMQC.MQGMO_SYNCPOINT)
+        if not self.queued:
+            return ('', md, gmo, 0, CMQC.MQCC_FAILED,
+                    CMQC.MQRC_NO_MSG_AVAILABLE)
+        msg, correlId = self.queued.pop(0)
+        self.uncommitted.append((msg, correlId))
+        return (msg, pymqi.md(CorrelId=correlId).pack(), gmo, len(msg),
+                CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+
+def _consumer(r, backend, handler, **kw):
+    r.replace('pymqi.pymqe.MQGET', backend.MQGET)
+    queue = pymqi.Queue(backend)
+    queue.set_handle(2)
+    return pymqi.PartitionedConsumer(backend, queue, handler, **kw)
+
+
+def test_order_per_key():
+    """ The messages of a key are handled in order by a single thread,
+    and each batch is committed.
+    """
+    messages = [('%s-%d' % (key, i), key) for i in range(20)
+                for key in ('a', 'b', 'c', 'd')]
+    backend = _Backend(messages)
+    lock = threading.Lock()
+    handled = {}
+
+    def handler(msg, md):
+        lock.acquire()
+        key = md.CorrelId.strip('\0')
+        handled.setdefault(key, []).append((msg, threading.currentThread()))
+        lock.release()
+
+    with Replacer() as r:
+        consumer = _consumer(r, backend, handler, workers=3, batch_size=16,
+                             partition_size=4)
+        eq_(consumer.run(), 80)
+        consumer.close()
+
+    for key in ('a', 'b', 'c', 'd'):
+        eq_([msg for msg, thread in handled[key]],
+            ['%s-%d' % (key, i) for i in range(20)])
+        eq_(len(set([thread for msg, thread in handled[key]])), 1)
+    eq_(backend.commits, 5)
+    eq_(consumer.stats['batches'], 5)
+
+
+def test_backout_on_handler_error():
+    """ A failing handler backs the whole batch out and the error is
+    raised by run_batch().
+    """
+    backend = _Backend([('m%d' % i, 'k%d' % i) for i in range(6)])
+    failures = ['m4']
+
+    def handler(msg, md):
+        if msg in failures:
+            failures.remove(msg)
+            raise ValueError(msg)
+
+    with Replacer() as r:
+        consumer = _consumer(r, backend, handler, workers=2, batch_size=3)
+        eq_(consumer.run_batch(), 3)
+        try:
+            consumer.run_batch()
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('ValueError not raised')
+        eq_(backend.backouts, 1)
+        eq_([msg for msg, key in backend.queued], ['m3', 'm4', 'm5'])
+
+        eq_(consumer.run(), 3)
+        consumer.close()
+    eq_(consumer.stats['messages'], 6)
+    eq_(consumer.stats['backouts'], 1)
@@ -0,0 +1,191 @@
+""" Tests for pymqi.QueueManagerPool class.
+"""
+
+# stdlib
+import sys
+import threading
+import time
+
+sys.path.insert(0, "..")
+
+# nose
+from nose.tools import eq_
+
+# PyMQI
+import pymqi
+import CMQC
+
+
+class _DummyQueueManager(object):
+    """ Stands for a connected pymqi.QueueManager.
+    """
+    def __init__(self):
+        self.valid = True
+        self.connected = True
+        self.inquiries = 0
+        self.disconnected_by = None
+
+    def inquire(self, attribute):
+        self.inquiries += 1
+        if not self.valid:
+            raise pymqi.MQMIError(CMQC.MQCC_FAILED,
+                                  CMQC.MQRC_CONNECTION_BROKEN)
+        return 700
+
+    def disconnect(self):
+        self.connected = False
+        self.disconnected_by = threading.currentThread()
+
+
+def test_reuse_and_limits():
+    """ Connections are reused, created up to max_size, and get() times
+    out when the pool is exhausted.
+    """
+    made = []
+
+    def factory():
+        made.append(_DummyQueueManager())
+        return made[-1]
+
+    pool = pymqi.QueueManagerPool(factory, min_size=1, max_size=2)
+    eq_(len(made), 1)
+
+    first = pool.get()
+    eq_(first, made[0])
+    second = pool.get()
+    eq_(len(made), 2)
+
+    try:
+        pool.get(timeout=0.01)
+    except pymqi.PYIFError:
+        pass
+    else:
+        raise AssertionError('PYIFError not raised')
+
+    pool.put(second)
+    eq_(pool.get(), second)
+    pool.put(second)
+    pool.put(first, discard=True)
+    eq_(first.connected, False)
+
+    metrics = pool.metrics()
+    eq_(metrics['creates'], 2)
+    eq_(metrics['checkouts'], 3)
+    eq_(metrics['reuses'], 2)
+    eq_(metrics['waits'], 1)
+    eq_(metrics['discards'], 1)
+    eq_(metrics['idle'], 1)
+    eq_(metrics['in_use'], 0)
+
+    pool.close()
+    eq_(second.connected, False)
+
+
+def test_validation_and_eviction():
+    """ Idle connections are validated with an inquire and evicted after
+    their idle timeout, their lifetime or a failed validation.
+    """
+    made = []
+
+    def factory():
+        made.append(_DummyQueueManager())
+        return made[-1]
+
+    pool = pymqi.QueueManagerPool(factory, validate_after=0)
+    qmgr = pool.get()
+    pool.put(qmgr)
+    eq_(pool.get(), qmgr)
+    eq_(qmgr.inquiries, 1)
+
+    qmgr.valid = False
+    pool.put(qmgr)
+    replacement = pool.get()
+    assert replacement is not qmgr
+    eq_(qmgr.connected, False)
+    pool.put(replacement)
+
+    pool.idle_timeout = 0
+    other = pool.get()
+    pool.put(other)
+    pool.max_lifetime = 0
+    pool.get()
+    metrics = pool.metrics()
+    eq_(metrics['evictions_invalid'], 1)
+    eq_(metrics['evictions_idle'] + metrics['evictions_lifetime'], 2)
+    eq_(metrics['creates'], 4)
+
+
+def test_thread_affinity():
+    """ With thread_bound set, a thread never reuses a connection made
+    by another thread.
+    """
+    pool = pymqi.QueueManagerPool(_DummyQueueManager, thread_bound=True)
+    mine = pool.get()
+    pool.put(mine)
+
+    theirs = []
+
+    def other_thread():
+        theirs.append(pool.get())
+        pool.put(theirs[0])
+
+    thread = threading.Thread(target=other_thread)
+    thread.start()
+    thread.join()
+
+    assert theirs[0] is not mine
+    eq_(pool.get(), mine)
+
+
+def test_thread_bound_full_pool():
+    """ With thread_bound set and the pool full of another thread's idle
+    connection, get() wakes up at its idle timeout and makes its own
+    connection; the other connection is only disconnected by its thread.
+    """
+    pool = pymqi.QueueManagerPool(_DummyQueueManager, max_size=1,
+                                  idle_timeout=0.05, thread_bound=True)
+    theirs = []
+    gave_back = threading.Event()
+    finish = threading.Event()
+
+    def other_thread():
+        theirs.append(pool.get())
+        pool.put(theirs[0])
+        gave_back.set()
+        finish.wait(5)
+        pool.put(pool.get())
+
+    thread = threading.Thread(target=other_thread)
+    thread.start()
+    gave_back.wait(5)
+
+    start = time.time()
+    mine = pool.get(timeout=5)
+    assert time.time() - start < 1
+    assert mine is not theirs[0]
+    eq_(theirs[0].connected, True)
+
+    pool.put(mine)
+    finish.set()
+    thread.join()
+    eq_(theirs[0].connected, False)
+    assert theirs[0].disconnected_by is thread
+
+
+def test_connection_context():
+    """ The connection() context manager gives the QueueManager back and
+    discards it on a connection error.
+    """
+    pool = pymqi.QueueManagerPool(_DummyQueueManager)
+    with pool.connection() as qmgr:
+        pass
+    eq_(pool.metrics()['idle'], 1)
+
+    try:
+        with pool.connection() as qmgr:
+            raise pymqi.MQMIError(CMQC.MQCC_FAILED,
+                                  CMQC.MQRC_CONNECTION_BROKEN)
+    except pymqi.MQMIError:
+        pass
+    eq_(qmgr.connected, False)
+    eq_(pool.metrics()['idle'], 0)
@@ -0,0 +1,891 @@
+""" Tests for pymqi.Queue class.
+"""
+
+# stdlib
+import gc
+import sys
+import threading
+import time
+
+sys.path.insert(0, "..")
+
+# nose
+from nose.plugins.skip import SkipTest
+from nose.tools import eq_, assert_raises, assert_true
+
+# testfixtures
+from testfixtures import Replacer
+
+# PyMQI
+import pymqi
+import CMQC
+
+
+class _DummyQueueManager(object):
+    def getHandle(self):
+        return 1
+
+
+def _make_queue():
+    queue = pymqi.Queue(_DummyQueueManager())
+    queue.set_handle(2)
+    return queue
+
+
+def _require_extension():
+    if not getattr(pymqi.pymqe, '__file__', '').endswith(('.so', '.pyd')):
+        raise SkipTest('pymqe is not the compiled extension')
+
+
+def test_put_unicode_payload():
+    """ A unicode message is put as its default encoding, as a str would
+    be, never as the internal storage of the unicode object. Encoding
+    errors are raised before MQPUT is called.
+    """
+    _require_extension()
+    mDesc = pymqi.md().pack()
+    putOpts = pymqi.pmo().pack()
+    assert_raises(UnicodeEncodeError, pymqi.pymqe.MQPUT, 0, 0, mDesc,
+                  putOpts, u'\u20ac')
+    assert_raises(UnicodeEncodeError, pymqi.pymqe.MQPUT1, 0,
+                  pymqi.od().pack(), mDesc, putOpts, u'\u20ac')
+    assert_raises(TypeError, pymqi.pymqe.MQGET_INTO, 0, 0, mDesc,
+                  pymqi.gmo().pack(), u'abc')
+
+
+def test_get_buffer_sizer():
+    """ The first MQGET's buffer follows a high percentile of the lengths
+    observed, within the configured limits.
+    """
+    sizer = pymqi._GetBufferSizer(4096, 65536)
+    eq_(sizer.length, 4096)
+
+    for i in range(sizer.recalculate_every):
+        sizer.observe(30000, False)
+    eq_(sizer.length, 32768)
+    eq_(sizer.retries_avoided, sizer.recalculate_every)
+
+    # A single outlier doesn't move the percentile ..
+    sizer.observe(1000000, True)
+    eq_(sizer.length, 32768)
+
+    # .. but it's never beyond the maximum when most messages are large.
+    for i in range(sizer.window):
+        sizer.observe(1000000, True)
+    eq_(sizer.length, 65536)
+    eq_(sizer.stats()['retries'], sizer.window + 1)
+
+
+def test_get_adapts_buffer_length():
+    """ Queue.get() without a maxLength retries a truncated get once and
+    sizes subsequent gets so that they don't need to retry.
+    """
+    message = 'x' * 20000
+    lengths = []
+
+    def _MQGET(qmgr, queue, md, gmo, length):
+        lengths.append(length)
+        if length < len(message):
+            return (message[:length], md, gmo, len(message),
+                    CMQC.MQCC_FAILED, CMQC.MQRC_TRUNCATED_MSG_FAILED)
+        return (message, md, gmo, len(message), CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQGET', _MQGET)
+        queue = _make_queue()
+
+        eq_(queue.get(), message)
+        eq_(lengths, [4096, 20000])
+
+        del lengths[:]
+        eq_(queue.get(), message)
+        eq_(lengths, [20480])
+
+        stats = queue.get_buffer_stats()
+        eq_(stats['gets'], 2)
+        eq_(stats['retries'], 1)
+        eq_(stats['retries_avoided'], 1)
+
+
+def test_get_many():
+    """ Queue.get_many() unpacks one md per message, returns an empty
+    list, rather than raising MQRC_NO_MSG_AVAILABLE, for an empty queue,
+    raises warnings with the batch attached and leaves getOpts alone.
+    """
+    calls = []
+
+    def _MQGET_MANY(qmgr, queue, md, gmo, max_messages, max_bytes):
+        calls.append((max_messages, max_bytes))
+        opts = pymqi.gmo()
+        opts.unpack(gmo)
+        if len(calls) == 1:
+            eq_(opts.WaitInterval, 500)
+            eq_(opts.Options & CMQC.MQGMO_WAIT, CMQC.MQGMO_WAIT)
+        if len(calls) == 3:
+            return ([('t', pymqi.md().pack())], gmo, 10, CMQC.MQCC_WARNING,
+                    CMQC.MQRC_TRUNCATED_MSG_ACCEPTED)
+        if len(calls) > 1:
+            return ([], gmo, 0, CMQC.MQCC_FAILED, CMQC.MQRC_NO_MSG_AVAILABLE)
+        messages = []
+        for priority in range(3):
+            messages.append((str(priority), pymqi.md(Priority=priority).pack()))
+        return (messages, gmo, 0, CMQC.MQCC_FAILED, CMQC.MQRC_NO_MSG_AVAILABLE)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQGET_MANY', _MQGET_MANY)
+        queue = _make_queue()
+        getOpts = pymqi.gmo()
+
+        messages = queue.get_many(10, 1000, 500, None, getOpts)
+        eq_([msg for msg, md in messages], ['0', '1', '2'])
+        eq_([md.Priority for msg, md in messages], [0, 1, 2])
+        eq_(getOpts.WaitInterval, 0)
+        eq_(getOpts.Options & CMQC.MQGMO_WAIT, 0)
+
+        eq_(queue.get_many(10), [])
+        eq_(calls, [(10, 1000), (10, queue.get_buffer_max)])
+
+        try:
+            queue.get_many(10)
+        except pymqi.MQMIError, e:
+            eq_(e.reason, CMQC.MQRC_TRUNCATED_MSG_ACCEPTED)
+            eq_([msg for msg, md in e.messages], ['t'])
+        else:
+            raise AssertionError('MQMIError not raised')
+
+
+def test_get_into():
+    """ Queue.get_into() gets the message into the caller's buffer,
+    returns its length, updates md and getOpts and raises warnings.
+    """
+    calls = []
+
+    def _MQGET_INTO(qmgr, queue, md, gmo, buffer):
+        calls.append(buffer)
+        if len(calls) == 2:
+            buffer[:] = 'x' * len(buffer)
+            return (md, gmo, 20, CMQC.MQCC_WARNING,
+                    CMQC.MQRC_TRUNCATED_MSG_FAILED)
+        buffer[:3] = 'abc'
+        msgDesc = pymqi.md()
+        msgDesc.unpack(md)
+        msgDesc.Priority = 7
+        getOpts = pymqi.gmo()
+        getOpts.unpack(gmo)
+        getOpts.ReturnedLength = 3
+        return (msgDesc.pack(), getOpts.pack(), 3, CMQC.MQCC_OK,
+                CMQC.MQRC_NONE)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQGET_INTO', _MQGET_INTO)
+        queue = _make_queue()
+        buffer = bytearray(8)
+        mDesc = pymqi.md()
+        getOpts = pymqi.gmo()
+
+        eq_(queue.get_into(buffer, mDesc, getOpts), 3)
+        assert calls[0] is buffer
+        eq_(str(buffer[:3]), 'abc')
+        eq_(mDesc.Priority, 7)
+        eq_(getOpts.ReturnedLength, 3)
+
+        try:
+            queue.get_into(memoryview(buffer)[:4], mDesc, getOpts)
+        except pymqi.MQMIError, e:
+            eq_(e.comp, CMQC.MQCC_WARNING)
+            eq_(e.reason, CMQC.MQRC_TRUNCATED_MSG_FAILED)
+        else:
+            raise AssertionError('MQMIError not raised')
+        eq_(str(buffer), 'xxxx' + '\0' * 4)
+
+
+def test_get_many_next_doesnt_fit():
+    """ A message which doesn't fit in what is left of max_bytes ends the
+    batch, which is returned; MQRC_TRUNCATED_MSG_FAILED is only raised
+    when the first message doesn't fit.
+    """
+    batches = [['a', 'b'], []]
+
+    def _MQGET_MANY(qmgr, queue, md, gmo, max_messages, max_bytes):
+        messages = batches.pop(0)
+        return ([(msg, pymqi.md().pack()) for msg in messages], gmo, 600,
+                CMQC.MQCC_WARNING, CMQC.MQRC_TRUNCATED_MSG_FAILED)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQGET_MANY', _MQGET_MANY)
+        queue = _make_queue()
+
+        eq_([msg for msg, md in queue.get_many(10, 500)], ['a', 'b'])
+        try:
+            queue.get_many(10, 500)
+        except pymqi.MQMIError, e:
+            eq_(e.comp, CMQC.MQCC_WARNING)
+            eq_(e.reason, CMQC.MQRC_TRUNCATED_MSG_FAILED)
+        else:
+            raise AssertionError('MQMIError not raised')
+
+
+def test_put_many():
+    """ Queue.put_many() passes batches of normalized messages to pymqe,
+    asks for syncpoint when committing and numbers failures across
+    batches.
+    """
+    calls = []
+
+    def _MQPUT_MANY(qmgr, queue, md, pmo, messages, commit_every):
+        calls.append((pmo, list(messages), commit_every))
+        msg_ids = ['%024d' % len(calls)] * len(messages)
+        failures = []
+        if len(calls) == 2:
+            msg_ids[0] = None
+            failures.append((0, CMQC.MQCC_FAILED, CMQC.MQRC_Q_FULL))
+        return msg_ids, failures
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQPUT_MANY', _MQPUT_MANY)
+        queue = _make_queue()
+        queue.put_many_batch = 3
+        putOpts = pymqi.pmo()
+
+        msg_ids, failures = queue.put_many(
+            ['a', ('b', {'CorrelId': 'c' * 24, 'Priority': 3}), 'c', 'd'],
+            put_opts=putOpts, commit_every=2)
+
+        # The syncpoint is asked for in a copy of the caller's pmo.
+        passed = pymqi.pmo()
+        passed.unpack(calls[0][0])
+        eq_(passed.Options & CMQC.MQPMO_SYNCPOINT, CMQC.MQPMO_SYNCPOINT)
+        eq_(putOpts.Options, pymqi.pmo().Options)
+        # Batches are a multiple of commit_every.
+        eq_([c[1] for c in calls],
+            [[('a', None, None, None), ('b', None, 'c' * 24, 3)],
+             [('c', None, None, None), ('d', None, None, None)]])
+        eq_([c[2] for c in calls], [2, 2])
+        eq_(msg_ids, ['%024d' % 1, '%024d' % 1, None, '%024d' % 2])
+        eq_(len(failures), 1)
+        eq_(failures[0][0], 2)
+        eq_(failures[0][1].reason, CMQC.MQRC_Q_FULL)
+
+
+def test_put_many_priority_range():
+    """ A Priority override out of the range of an MQLONG is refused by
+    MQPUT_MANY before any MQPUT.
+    """
+    _require_extension()
+    mDesc = pymqi.md().pack()
+    putOpts = pymqi.pmo().pack()
+    for priority in (2 ** 31, -2 ** 31 - 1):
+        assert_raises(OverflowError, pymqi.pymqe.MQPUT_MANY, 0, 0, mDesc,
+                      putOpts, [('a', None, None, priority)], 0)
+
+
+def test_put_many_stopped():
+    """ When pymqe abandons a batch on a broken connection, the messages of
+    its uncommitted unit of work and the remaining ones are reported
+    failed with that reason, as are those of the following batches.
+    """
+    calls = []
+
+    def _MQPUT_MANY(qmgr, queue, md, pmo, messages, commit_every):
+        calls.append(list(messages))
+        # The first unit of work is committed, the put of its second
+        # message stops the next one, which pymqe backs out.
+        if len(calls) == 1:
+            return (['%024d' % 1] * 2 + [None] * 2,
+                    [(2, CMQC.MQCC_FAILED, CMQC.MQRC_HCONN_ERROR),
+                     (3, CMQC.MQCC_FAILED, CMQC.MQRC_HCONN_ERROR)])
+        return ([None] * len(messages),
+                [(i, CMQC.MQCC_FAILED, CMQC.MQRC_HCONN_ERROR)
+                 for i in range(len(messages))])
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQPUT_MANY', _MQPUT_MANY)
+        queue = _make_queue()
+        queue.put_many_batch = 4
+        msg_ids, failures = queue.put_many('abcdef', commit_every=2)
+
+    eq_(len(calls), 2)
+    eq_(msg_ids, ['%024d' % 1] * 2 + [None] * 4)
+    eq_([index for index, error in failures], [2, 3, 4, 5])
+    eq_(set([error.reason for index, error in failures]),
+        set([CMQC.MQRC_HCONN_ERROR]))
+
+
+def test_iter_messages():
+    """ Queue.iter_messages() yields the messages got by its thread in
+    order, waits on every get and ends on MQRC_NO_MSG_AVAILABLE.
+    """
+    messages = ['a', 'b', 'c']
+    options = []
+
+    def _MQGET(qmgr, queue, md, gmo, length):
+        getOpts = pymqi.gmo()
+        getOpts.unpack(gmo)
+        options.append((getOpts.Options, getOpts.WaitInterval))
+        if not messages:
+            return ('', md, gmo, 0, CMQC.MQCC_FAILED,
+                    CMQC.MQRC_NO_MSG_AVAILABLE)
+        message = messages.pop(0)
+        return (message, md, gmo, len(message), CMQC.MQCC_OK,
+                CMQC.MQRC_NONE)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQGET', _MQGET)
+        queue = _make_queue()
+
+        received = [msg for msg, md in queue.iter_messages(2, 250)]
+        eq_(received, ['a', 'b', 'c'])
+        eq_(options[0][0] & CMQC.MQGMO_WAIT, CMQC.MQGMO_WAIT)
+        eq_(options[0][1], 250)
+
+
+def test_iter_messages_own_connection():
+    """ The iter_messages() thread connects the way the queue manager
+    did, opens the queue again, gets on its own connection and
+    disconnects at the end.
+    """
+    calls = []
+
+    def _MQCONN(name):
+        calls.append(('MQCONN', name, threading.currentThread().getName()))
+        return (len(calls), CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQOPEN(qmgr, qDesc, options):
+        calls.append(('MQOPEN', qmgr))
+        return (100 + qmgr, qDesc, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQGET(qmgr, queue, md, gmo, length):
+        calls.append(('MQGET', qmgr, queue))
+        getOpts = pymqi.gmo()
+        getOpts.unpack(gmo)
+        eq_(getOpts.Options & (CMQC.MQGMO_SYNCPOINT |
+                               CMQC.MQGMO_NO_SYNCPOINT),
+            CMQC.MQGMO_SYNCPOINT)
+        return ('', md, gmo, 0, CMQC.MQCC_FAILED, CMQC.MQRC_NO_MSG_AVAILABLE)
+
+    def _MQCLOSE(qmgr, handle, options):
+        calls.append(('MQCLOSE', qmgr, handle))
+        return (CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQDISC(qmgr):
+        calls.append(('MQDISC', qmgr))
+        return (CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQCONN', _MQCONN)
+        r.replace('pymqi.pymqe.MQOPEN', _MQOPEN)
+        r.replace('pymqi.pymqe.MQGET', _MQGET)
+        r.replace('pymqi.pymqe.MQCLOSE', _MQCLOSE)
+        r.replace('pymqi.pymqe.MQDISC', _MQDISC)
+        qmgr = pymqi.QueueManager('QM01')
+        queue = pymqi.Queue(qmgr, 'Q1')
+
+        eq_(list(queue.iter_messages()), [])
+        eq_(calls[0], ('MQCONN', 'QM01', 'MainThread'))
+        eq_(calls[1][:2], ('MQCONN', 'QM01'))
+        assert_true(calls[1][2] != 'MainThread')
+        eq_(calls[2:], [('MQOPEN', 2), ('MQGET', 2, 102),
+                        ('MQCLOSE', 2, 102), ('MQDISC', 2)])
+
+        # The thread owns the unit of work whatever the caller asks.
+        getOpts = pymqi.gmo(Options=CMQC.MQGMO_NO_SYNCPOINT)
+        eq_(list(queue.iter_messages(16, 1000, True, pymqi.md(),
+                                     getOpts)), [])
+        eq_(getOpts.Options, CMQC.MQGMO_NO_SYNCPOINT)
+
+
+def test_iter_messages_commits_returned_messages():
+    """ On its own connection the iter_messages() thread commits the
+    messages once they have all been returned, and backs out those
+    never returned when stopped.
+    """
+    messages = []
+    calls = []
+
+    def _MQCONN(name):
+        return (1, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQOPEN(qmgr, qDesc, options):
+        return (2, qDesc, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQGET(qmgr, queue, md, gmo, length):
+        if not messages:
+            return ('', md, gmo, 0, CMQC.MQCC_FAILED,
+                    CMQC.MQRC_NO_MSG_AVAILABLE)
+        message = messages.pop(0)
+        calls.append('MQGET')
+        return (message, md, gmo, len(message), CMQC.MQCC_OK,
+                CMQC.MQRC_NONE)
+
+    def _MQCMIT(qmgr):
+        calls.append('MQCMIT')
+        return (CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQBACK(qmgr):
+        calls.append('MQBACK')
+        return (CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQCLOSE(qmgr, handle, options):
+        return (CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQDISC(qmgr):
+        return (CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQCONN', _MQCONN)
+        r.replace('pymqi.pymqe.MQOPEN', _MQOPEN)
+        r.replace('pymqi.pymqe.MQGET', _MQGET)
+        r.replace('pymqi.pymqe.MQCMIT', _MQCMIT)
+        r.replace('pymqi.pymqe.MQBACK', _MQBACK)
+        r.replace('pymqi.pymqe.MQCLOSE', _MQCLOSE)
+        r.replace('pymqi.pymqe.MQDISC', _MQDISC)
+        qmgr = pymqi.QueueManager('QM01')
+        queue = pymqi.Queue(qmgr, 'Q1')
+
+        # All the messages are returned, and committed.
+        messages[:] = ['a', 'b', 'c', 'd']
+        received = [msg for msg, md in queue.iter_messages(2)]
+        eq_(received, ['a', 'b', 'c', 'd'])
+        eq_(calls.count('MQGET'), 4)
+        eq_(calls[-1], 'MQCMIT')
+        assert_true('MQBACK' not in calls)
+        eq_(queue.iter_messages_stats(),
+            {'returned': 4, 'unconsumed': 0, 'backed_out': 0})
+
+        # 'b' is got before 'a' is returned, so neither is committed.
+        messages[:] = ['a', 'b', 'c']
+        del calls[:]
+        prefetcher = pymqi._MessagePrefetcher(
+            None, 2, 1000, True, pymqi.md(), pymqi.gmo(),
+            (qmgr._newConnection, pymqi.od(ObjectName='Q1'),
+             CMQC.MQOO_INPUT_AS_Q_DEF))
+        prefetcher.start()
+        while len(calls) < 2:
+            time.sleep(0.01)
+        eq_(prefetcher.next()[0], 'a')
+        eq_(prefetcher.stop(), 1)
+        eq_(prefetcher.backed_out, 2)
+        eq_(calls, ['MQGET', 'MQGET', 'MQBACK'])
+        eq_(messages, ['c'])
+
+
+def test_iter_messages_raises_errors():
+    """ An error met by the iter_messages() thread is raised by the
+    generator.
+    """
+    def _MQGET(qmgr, queue, md, gmo, length):
+        return ('', md, gmo, 0, CMQC.MQCC_FAILED, CMQC.MQRC_GET_INHIBITED)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQGET', _MQGET)
+        queue = _make_queue()
+
+        try:
+            list(queue.iter_messages())
+        except pymqi.MQMIError, e:
+            eq_(e.reason, CMQC.MQRC_GET_INHIBITED)
+        else:
+            raise AssertionError('MQMIError not raised')
+
+
+def test_put_and_get_stream():
+    """ put_stream() puts a file as segments flagged in logical order,
+    get_stream() writes them back one by one.
+    """
+    import StringIO
+    data = ''.join([chr(i % 256) for i in range(2500)])
+    segments = []
+
+    def _MQPUT(qmgr, queue, md, pmo, msg):
+        mDesc = pymqi.md()
+        mDesc.unpack(md)
+        putOpts = pymqi.pmo()
+        putOpts.unpack(pmo)
+        eq_(mDesc.Version, CMQC.MQMD_VERSION_2)
+        eq_(putOpts.Options & CMQC.MQPMO_LOGICAL_ORDER,
+            CMQC.MQPMO_LOGICAL_ORDER)
+        segments.append((msg.tobytes(), mDesc.MsgFlags))
+        return (md, pmo, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQGET_INTO(qmgr, queue, md, gmo, buffer):
+        getOpts = pymqi.gmo()
+        getOpts.unpack(gmo)
+        eq_(getOpts.Options & CMQC.MQGMO_LOGICAL_ORDER,
+            CMQC.MQGMO_LOGICAL_ORDER)
+        msg, flags = segments.pop(0)
+        buffer[:len(msg)] = msg
+        if flags & CMQC.MQMF_LAST_SEGMENT:
+            getOpts.SegmentStatus = CMQC.MQSS_LAST_SEGMENT
+        else:
+            getOpts.SegmentStatus = CMQC.MQSS_SEGMENT
+        return (md, getOpts.pack(), len(msg), CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQPUT', _MQPUT)
+        r.replace('pymqi.pymqe.MQGET_INTO', _MQGET_INTO)
+        queue = _make_queue()
+
+        putOpts = pymqi.pmo()
+        eq_(queue.put_stream(StringIO.StringIO(data), 1000, pymqi.md(),
+                             putOpts), 2500)
+        eq_(putOpts.Options, pymqi.pmo().Options)
+        eq_([len(msg) for msg, flags in segments], [1000, 1000, 500])
+        eq_([flags for msg, flags in segments],
+            [CMQC.MQMF_SEGMENT, CMQC.MQMF_SEGMENT,
+             CMQC.MQMF_SEGMENT | CMQC.MQMF_LAST_SEGMENT])
+
+        out = StringIO.StringIO()
+        getOpts = pymqi.gmo(MatchOptions=CMQC.MQMO_MATCH_MSG_ID)
+        eq_(queue.get_stream(out, 1000, pymqi.md(), getOpts), 2500)
+        eq_(out.getvalue(), data)
+        eq_(segments, [])
+        eq_(getOpts.MatchOptions, CMQC.MQMO_MATCH_MSG_ID)
+        eq_(getOpts.Options, CMQC.MQGMO_NO_WAIT)
+
+
+def test_put_group_and_group_consumer():
+    """ put_group() flags the messages of a group, GroupConsumer yields
+    the groups one by one and skips what's left of a group it leaves.
+    """
+    queued = []
+    msg_ids = []
+
+    def _MQPUT(qmgr, queue, md, pmo, msg):
+        mDesc = pymqi.md()
+        mDesc.unpack(md)
+        putOpts = pymqi.pmo()
+        putOpts.unpack(pmo)
+        eq_(putOpts.Options & CMQC.MQPMO_LOGICAL_ORDER,
+            CMQC.MQPMO_LOGICAL_ORDER)
+        if mDesc.MsgFlags & CMQC.MQMF_LAST_MSG_IN_GROUP:
+            status = CMQC.MQGS_LAST_MSG_IN_GROUP
+        else:
+            status = CMQC.MQGS_MSG_IN_GROUP
+        queued.append((msg, status))
+        mDesc.GroupId = 'G' * 24
+        if putOpts.Options & CMQC.MQPMO_NEW_MSG_ID:
+            mDesc.MsgId = '%024d' % len(queued)
+        msg_ids.append(mDesc.MsgId)
+        return (mDesc.pack(), pmo, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQGET(qmgr, queue, md, gmo, length):
+        getOpts = pymqi.gmo()
+        getOpts.unpack(gmo)
+        eq_(getOpts.Options & CMQC.MQGMO_LOGICAL_ORDER,
+            CMQC.MQGMO_LOGICAL_ORDER)
+        if not queued:
+            return ('', md, gmo, 0, CMQC.MQCC_FAILED,
+                    CMQC.MQRC_NO_MSG_AVAILABLE)
+        msg, getOpts.GroupStatus = queued.pop(0)
+        return (msg, md, getOpts.pack(), len(msg), CMQC.MQCC_OK,
+                CMQC.MQRC_NONE)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQPUT', _MQPUT)
+        r.replace('pymqi.pymqe.MQGET', _MQGET)
+        queue = _make_queue()
+
+        eq_(queue.put_group(['a1', 'a2', 'a3']), 'G' * 24)
+        putOpts = pymqi.pmo()
+        queue.put_group(['b1', 'b2'], pymqi.md(), putOpts)
+        eq_(putOpts.Options, pymqi.pmo().Options)
+        queue.put_group(['c1'])
+        eq_([status for msg, status in queued],
+            [CMQC.MQGS_MSG_IN_GROUP, CMQC.MQGS_MSG_IN_GROUP,
+             CMQC.MQGS_LAST_MSG_IN_GROUP, CMQC.MQGS_MSG_IN_GROUP,
+             CMQC.MQGS_LAST_MSG_IN_GROUP, CMQC.MQGS_LAST_MSG_IN_GROUP])
+        eq_(len(set(msg_ids)), 6)
+
+        groups = []
+        for group in pymqi.GroupConsumer(queue):
+            if not groups:
+                # Leave the first group after one message.
+                groups.append([group.next()])
+            else:
+                groups.append(list(group))
+        eq_(groups, [['a1'], ['b1', 'b2'], ['c1']])
+
+
+def test_register_callback():
+    """ Messages, removed or browsed, and errors delivered through MQCB
+    reach the callbacks, the other calls are ignored.
+    """
+    registered = {}
+    received = []
+    errors = []
+
+    def MQCB(qmgr, operation, callback, qHandle, mDesc, getOpts, maxLength):
+        registered[operation] = (callback, qHandle, maxLength)
+        return CMQC.MQCC_OK, CMQC.MQRC_NONE
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQCB', MQCB)
+        queue = _make_queue()
+        queue.register_callback(
+            lambda queue, msg, md: received.append((msg, md.CorrelId)),
+            on_error=lambda queue, e: errors.append(e.reason))
+        queue.deregister_callback()
+
+    dispatch, qHandle, maxLength = registered[CMQC.MQOP_REGISTER]
+    eq_(qHandle, 2)
+    eq_(maxLength, CMQC.MQCBD_FULL_MSG_LENGTH)
+    eq_(registered[CMQC.MQOP_DEREGISTER][1], 2)
+
+    rawMDesc = pymqi.md(CorrelId='c1').pack()
+    rawGetOpts = pymqi.gmo().pack()
+    dispatch(2, CMQC.MQCBCT_START_CALL, '', '', '', CMQC.MQCC_OK,
+             CMQC.MQRC_NONE)
+    dispatch(2, CMQC.MQCBCT_MSG_REMOVED, 'abc', rawMDesc, rawGetOpts,
+             CMQC.MQCC_OK, CMQC.MQRC_NONE)
+    dispatch(2, CMQC.MQCBCT_MSG_NOT_REMOVED, 'def', rawMDesc, rawGetOpts,
+             CMQC.MQCC_OK, CMQC.MQRC_NONE)
+    dispatch(2, CMQC.MQCBCT_MSG_NOT_REMOVED, 'gh', rawMDesc, rawGetOpts,
+             CMQC.MQCC_WARNING, CMQC.MQRC_TRUNCATED_MSG_FAILED)
+    dispatch(2, CMQC.MQCBCT_MSG_NOT_REMOVED, '', '', '', CMQC.MQCC_FAILED,
+             CMQC.MQRC_CONNECTION_BROKEN)
+    dispatch(2, CMQC.MQCBCT_EVENT_CALL, '', '', '', CMQC.MQCC_OK,
+             CMQC.MQRC_NONE)
+    dispatch(2, CMQC.MQCBCT_EVENT_CALL, '', '', '', CMQC.MQCC_WARNING,
+             CMQC.MQRC_Q_MGR_QUIESCING)
+
+    eq_(received, [('abc', 'c1'.ljust(24, '\0')),
+                   ('def', 'c1'.ljust(24, '\0'))])
+    eq_(errors, [CMQC.MQRC_TRUNCATED_MSG_FAILED,
+                 CMQC.MQRC_CONNECTION_BROKEN, CMQC.MQRC_Q_MGR_QUIESCING])
+
+
+def test_async_put():
+    """ async_put switches put() and put_many() to MQPMO_ASYNC_RESPONSE.
+    """
+    options = []
+
+    def MQPUT(qmgr, handle, md, pmo, msg):
+        putOpts = pymqi.pmo()
+        putOpts.unpack(pmo)
+        options.append(putOpts.Options)
+        return md, pmo, CMQC.MQCC_OK, CMQC.MQRC_NONE
+
+    def MQPUT_MANY(qmgr, handle, md, pmo, messages, commitEvery):
+        putOpts = pymqi.pmo()
+        putOpts.unpack(pmo)
+        options.append(putOpts.Options)
+        return ['id'] * len(messages), []
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQPUT', MQPUT)
+        r.replace('pymqi.pymqe.MQPUT_MANY', MQPUT_MANY)
+        queue = _make_queue()
+        queue.put('a')
+        queue.put('b', None, pymqi.pmo(Options=CMQC.MQPMO_SYNC_RESPONSE),
+                  async_put=True)
+        putOpts = pymqi.pmo()
+        queue.put_many(['c', 'd'], put_opts=putOpts, async_put=True)
+        eq_(putOpts.Options, pymqi.pmo().Options)
+        try:
+            queue.put('e', asynch=True)
+        except TypeError:
+            pass
+        else:
+            raise AssertionError('TypeError not raised')
+
+    eq_([bool(o & CMQC.MQPMO_ASYNC_RESPONSE) for o in options],
+        [False, True, True])
+    eq_(options[1] & CMQC.MQPMO_SYNC_RESPONSE, 0)
+
+
+def test_check_selector():
+    """ Message selectors are checked locally like the queue manager
+    would, and the valid ones cached.
+    """
+    for selector in ["Color = 'red'",
+                     "Color = 'red' AND Weight > 2500",
+                     "NOT (a <> 1 OR b IS NOT NULL)",
+                     "Root.MQMD.Priority >= 5 and JMSType LIKE 'ord%'",
+                     "name NOT LIKE 'a\\_%' ESCAPE '\\'",
+                     "x BETWEEN -1.5 AND 2e3 OR y NOT IN ('a', 'it''s')",
+                     "urgent = TRUE AND (n * 2 + 1) / 3 < 10",
+                     "x = 0x1F OR x IN (0XFF, 0x0a)",
+                     "Root.MQMD.MsgId = 0x414D5120514D3031202020202020"
+                     "202020202020202039C6BA4D20002B02",
+                     "Root.MQMD.CorrelId <> 0x00 AND n > -0x10"]:
+        pymqi._checkSelector(selector)
+        eq_(selector in pymqi._validSelectors, True)
+
+    for selector in ["", "Color =", "Color = 'red", "a AND", "(a = 1",
+                     "a IN ()", "a NOT 1", "a LIKE b", "a ! b",
+                     "a BETWEEN 1 OR 2", "x = 0x", "x = 0x1G",
+                     "x = 0x1F.5"]:
+        try:
+            pymqi._checkSelector(selector)
+        except pymqi.MQMIError, e:
+            eq_(e.reason, CMQC.MQRC_SELECTOR_SYNTAX_ERROR)
+        else:
+            raise AssertionError('%r accepted' % selector)
+
+
+def test_open_selected():
+    """ Queues opened with the same selector share a cached handle which
+    close() leaves open.
+    """
+    # Queues left over by other tests must not be closed while MQCLOSE
+    # is replaced.
+    gc.collect()
+    opened = []
+    closed = []
+
+    def _MQCONN(name):
+        return (1, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQOPEN(qmgr, qDesc, options):
+        qd = pymqi.od()
+        qd.unpack(qDesc)
+        opened.append((qd.ObjectName.strip('\0 '), qd.Version,
+                       qd.get_vs('SelectionString'), options))
+        return (100 + len(opened), qDesc, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQCLOSE(qmgr, handle, options):
+        closed.append(handle)
+        return (CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQCONN', _MQCONN)
+        r.replace('pymqi.pymqe.MQOPEN', _MQOPEN)
+        r.replace('pymqi.pymqe.MQCLOSE', _MQCLOSE)
+        qmgr = pymqi.QueueManager('QM01')
+
+        red = pymqi.Queue(qmgr)
+        red.open_selected('Q1', "Color = 'red'")
+        eq_(red.get_handle(), 101)
+        red.close()
+
+        again = pymqi.Queue(qmgr)
+        again.open_selected('Q1', "Color = 'red'")
+        blue = pymqi.Queue(qmgr)
+        blue.open_selected('Q1', "Color = 'blue'")
+        eq_((again.get_handle(), blue.get_handle()), (101, 102))
+        del again, blue
+        eq_(closed, [])
+
+        try:
+            pymqi.Queue(qmgr).open_selected('Q1', "Color = ")
+        except pymqi.MQMIError, e:
+            eq_(e.reason, CMQC.MQRC_SELECTOR_SYNTAX_ERROR)
+        else:
+            raise AssertionError('MQMIError not raised')
+
+        qmgr.clear_handle_cache()
+        eq_(sorted(closed), [101, 102])
+
+    eq_(opened, [('Q1', CMQC.MQOD_VERSION_4, "Color = 'red'",
+                  CMQC.MQOO_INPUT_AS_Q_DEF),
+                 ('Q1', CMQC.MQOD_VERSION_4, "Color = 'blue'",
+                  CMQC.MQOO_INPUT_AS_Q_DEF)])
+
+
+def test_open_selected_in_use():
+    """ A selector handle in use is not closed by put_to() evictions nor
+    by clear_handle_cache(), only once its last Queue closes. Browsing
+    queues don't share their handle.
+    """
+    gc.collect()
+    opened = []
+    closed = []
+
+    def _MQCONN(name):
+        return (1, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQOPEN(qmgr, qDesc, options):
+        opened.append(options)
+        return (100 + len(opened), qDesc, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQPUT(qmgr, handle, md, pmo, msg):
+        return (md, pmo, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQCLOSE(qmgr, handle, options):
+        closed.append(handle)
+        return (CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQCONN', _MQCONN)
+        r.replace('pymqi.pymqe.MQOPEN', _MQOPEN)
+        r.replace('pymqi.pymqe.MQPUT', _MQPUT)
+        r.replace('pymqi.pymqe.MQCLOSE', _MQCLOSE)
+        qmgr = pymqi.QueueManager('QM01')
+        qmgr.handle_cache_size = 1
+
+        first = pymqi.Queue(qmgr)
+        first.open_selected('Q1', "Color = 'red'")
+        second = pymqi.Queue(qmgr)
+        second.open_selected('Q1', "Color = 'red'")
+        eq_(first.get_handle(), 101)
+        eq_(second.get_handle(), 101)
+
+        qmgr.put_to('Q2', 'a')
+        qmgr.put_to('Q3', 'b')
+        eq_(closed, [102])
+        qmgr.clear_handle_cache()
+        eq_(closed, [102, 103])
+
+        first.close()
+        qmgr.clear_handle_cache()
+        eq_(closed, [102, 103])
+        second.close()
+        qmgr.clear_handle_cache()
+        eq_(closed, [102, 103, 101])
+
+        browsers = [pymqi.Queue(qmgr), pymqi.Queue(qmgr)]
+        for browser in browsers:
+            browser.open_selected('Q1', "Color = 'red'",
+                                  CMQC.MQOO_BROWSE)
+        eq_([browser.get_handle() for browser in browsers], [104, 105])
+        for browser in browsers:
+            browser.close()
+        eq_(closed, [102, 103, 101, 104, 105])
+
+
+def test_subscription_selector_with_sub_desc():
+    """ The selector of a Subscription is set in the sub_desc it is given,
+    unless that selects otherwise.
+    """
+    selections = []
+
+    def _MQSUB(qmgr, sd, queue):
+        sub_desc = pymqi.SD()
+        sub_desc.unpack(sd)
+        selections.append(sub_desc.get_vs('SelectionString'))
+        return (sd, 3, 4, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    class _QueueManager(object):
+        def getHandle(self):
+            return 1
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQSUB', _MQSUB)
+        sub_desc = pymqi.SD(Options=CMQC.MQSO_CREATE |
+                            CMQC.MQSO_NON_DURABLE | CMQC.MQSO_MANAGED)
+        sub_desc.set_vs('ObjectString', 'prices')
+        pymqi.Subscription(_QueueManager(), sub_desc,
+                           selector="Color = 'red'")
+        eq_(selections, ["Color = 'red'"])
+
+        sub_desc.set_vs('SelectionString', "Color = 'blue'")
+        try:
+            pymqi.Subscription(_QueueManager()).sub(sub_desc,
+                                                    selector="Color = 'red'")
+        except pymqi.PYIFError:
+            pass
+        else:
+            raise AssertionError('PYIFError not raised')
+        eq_(len(selections), 1)
+
+
+def test_set_vs_keeps_buffer():
+    """ set_vs() keeps the string alive with the structure.
+    """
+    qd = pymqi.od(Version=CMQC.MQOD_VERSION_4)
+    qd.set_vs('SelectionStringVSPtr', 'a' * 100)
+    eq_(qd.SelectionStringVSLength, 100)
+    eq_(qd.get_vs('SelectionString'), 'a' * 100)
+    qd.set_vs('SelectionString', None)
+    eq_(qd.SelectionStringVSPtr, 0)
+    eq_(qd.SelectionStringVSLength, 0)
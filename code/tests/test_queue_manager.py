@@ -3,6 +3,8 @@
 
 # stdlib
 import sys
+import threading
+import time
 from uuid import uuid4
 
 sys.path.insert(0, "..")
@@ -15,6 +17,7 @@ from testfixtures import Replacer
 
 # PyMQI
 import pymqi
+import CMQC
 
 
 def test_is_connected():
@@ -50,3 +53,210 @@ def test_is_connected():
             qmgr.connectTCPClient(queue_manager, pymqi.cd(), channel, conn_info)
 
             eq_(qmgr.is_connected, expected)
+
+
+def test_put_to_handle_cache():
+    """ put_to() opens each destination once, closes the least recently
+    used handle when the cache is full and drops a handle MQ rejects.
+    """
+    with Replacer() as r:
+        opened = []
+        closed = []
+        put = []
+
+        def _MQCONN(name):
+            return (1, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+        def _MQOPEN(qmgr, od, options):
+            qDesc = pymqi.od()
+            qDesc.unpack(od)
+            opened.append(qDesc.ObjectName.strip('\0 '))
+            return (100 + len(opened), od, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+        def _MQCLOSE(qmgr, handle, options):
+            closed.append(handle)
+            return (CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+        def _MQPUT(qmgr, handle, md, pmo, msg):
+            put.append((handle, msg))
+            if msg == 'deleted':
+                return (md, pmo, CMQC.MQCC_FAILED, CMQC.MQRC_Q_DELETED)
+            return (md, pmo, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+        r.replace('pymqi.pymqe.MQCONN', _MQCONN)
+        r.replace('pymqi.pymqe.MQOPEN', _MQOPEN)
+        r.replace('pymqi.pymqe.MQCLOSE', _MQCLOSE)
+        r.replace('pymqi.pymqe.MQPUT', _MQPUT)
+
+        qmgr = pymqi.QueueManager('QM01')
+        qmgr.handle_cache_size = 2
+
+        qmgr.put_to('Q1', 'a')
+        qmgr.put_to('Q2', 'b')
+        qmgr.put_to('Q1', 'c')
+        # Q2 is the least recently used handle.
+        qmgr.put_to('Q3', 'd')
+
+        eq_(opened, ['Q1', 'Q2', 'Q3'])
+        eq_(closed, [102])
+        eq_(put, [(101, 'a'), (102, 'b'), (101, 'c'), (103, 'd')])
+
+        try:
+            qmgr.put_to('Q3', 'deleted')
+        except pymqi.MQMIError, e:
+            eq_(e.reason, CMQC.MQRC_Q_DELETED)
+        else:
+            raise AssertionError('MQMIError not raised')
+        eq_(closed, [102, 103])
+
+        eq_(qmgr.handle_cache_stats(),
+            {'hits': 2, 'misses': 3, 'evictions': 1, 'size': 1})
+
+        qmgr.clear_handle_cache()
+        eq_(closed, [102, 103, 101])
+        eq_(qmgr.handle_cache_stats()['size'], 0)
+
+
+def test_put_to_threads():
+    """ Threads sharing the connection may put_to() at the same time:
+    each handle is opened once per stay in the cache, closed once, and
+    never used once closed.
+    """
+    with Replacer() as r:
+        lock = threading.Lock()
+        opened = {}
+        closed = []
+        errors = []
+
+        def _MQCONN(name):
+            return (1, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+        def _MQOPEN(qmgr, od, options):
+            lock.acquire()
+            handle = 100 + len(opened)
+            opened[handle] = True
+            lock.release()
+            time.sleep(0.0001)
+            return (handle, od, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+        def _MQCLOSE(qmgr, handle, options):
+            closed.append(handle)
+            opened[handle] = False
+            return (CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+        def _MQPUT(qmgr, handle, md, pmo, msg):
+            time.sleep(0.0001)
+            if not opened[handle]:
+                return (md, pmo, CMQC.MQCC_FAILED, CMQC.MQRC_HOBJ_ERROR)
+            return (md, pmo, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+        r.replace('pymqi.pymqe.MQCONN', _MQCONN)
+        r.replace('pymqi.pymqe.MQOPEN', _MQOPEN)
+        r.replace('pymqi.pymqe.MQCLOSE', _MQCLOSE)
+        r.replace('pymqi.pymqe.MQPUT', _MQPUT)
+
+        qmgr = pymqi.QueueManager('QM01')
+        qmgr.handle_cache_size = 2
+
+        def producer(index):
+            try:
+                for i in range(50):
+                    qmgr.put_to('Q%d' % ((i + index) % 4), 'message')
+            except Exception, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=producer, args=(i,))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        eq_(errors, [])
+        eq_(len(closed), len(set(closed)))
+        stats = qmgr.handle_cache_stats()
+        eq_(stats['hits'] + stats['misses'], 200)
+        eq_(stats['misses'], len(opened))
+        eq_(stats['evictions'], len(closed))
+        eq_(stats['size'], len(opened) - len(closed))
+
+
+def test_handle_cache_key():
+    """ Opens of the same queue under different alternate user ids get
+    different cached handles.
+    """
+    with Replacer() as r:
+        opened = []
+
+        def _MQCONN(name):
+            return (1, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+        def _MQOPEN(qmgr, od, options):
+            opened.append(options)
+            return (100 + len(opened), od, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+        def _MQPUT(qmgr, handle, md, pmo, msg):
+            return (md, pmo, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+        r.replace('pymqi.pymqe.MQCONN', _MQCONN)
+        r.replace('pymqi.pymqe.MQOPEN', _MQOPEN)
+        r.replace('pymqi.pymqe.MQPUT', _MQPUT)
+
+        qmgr = pymqi.QueueManager('QM01')
+        for user in ('alice', 'bob', 'alice'):
+            qmgr.put_to(pymqi.od(ObjectName='Q1', AlternateUserId=user), 'a')
+        eq_(len(opened), 2)
+        eq_(qmgr.handle_cache_stats()['hits'], 1)
+
+
+def test_start_and_stop_consuming():
+    """ start_consuming() and stop_consuming() drive MQCTL.
+    """
+    calls = []
+
+    def MQCTL(handle, operation, options):
+        calls.append((handle, operation, options))
+        return CMQC.MQCC_OK, CMQC.MQRC_NONE
+
+    def _MQCONN(name):
+        return (1, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQCONN', _MQCONN)
+        r.replace('pymqi.pymqe.MQCTL', MQCTL)
+        qmgr = pymqi.QueueManager('QM01')
+        qmgr.start_consuming()
+        qmgr.start_consuming(wait=True)
+        qmgr.stop_consuming()
+
+    eq_(calls, [(1, CMQC.MQOP_START, CMQC.MQCTLO_FAIL_IF_QUIESCING),
+                (1, CMQC.MQOP_START_WAIT, CMQC.MQCTLO_FAIL_IF_QUIESCING),
+                (1, CMQC.MQOP_STOP, CMQC.MQCTLO_NONE)])
+
+
+def test_check_async_status():
+    """ check_async_status() turns the MQSTS returned by MQSTAT into a
+    dictionary.
+    """
+    def _MQCONN(name):
+        return (1, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def _MQSTAT(handle, statType, sts):
+        eq_(statType, CMQC.MQSTAT_TYPE_ASYNC_ERROR)
+        sts = pymqi.STS(CompCode=CMQC.MQCC_FAILED,
+                        Reason=CMQC.MQRC_Q_FULL, PutSuccessCount=10,
+                        PutFailureCount=2, ObjectName='Q1',
+                        ResolvedObjectName='Q1.LOCAL',
+                        ResolvedQMgrName='QM01')
+        return (sts.pack(), CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQCONN', _MQCONN)
+        r.replace('pymqi.pymqe.MQSTAT', _MQSTAT)
+        qmgr = pymqi.QueueManager('QM01')
+        status = qmgr.check_async_status()
+
+    eq_(status['error'].reason, CMQC.MQRC_Q_FULL)
+    del status['error']
+    eq_(status, {'succeeded': 10, 'warnings': 0, 'failed': 2,
+                 'object_name': 'Q1.LOCAL', 'queue_manager_name': 'QM01'})
@@ -0,0 +1,221 @@
+""" Tests for pymqi.RequestReplyClient class.
+"""
+
+# stdlib
+import sys
+import threading
+import time
+
+sys.path.insert(0, "..")
+
+# nose
+from nose.tools import eq_
+
+# testfixtures
+from testfixtures import Replacer
+
+# PyMQI
+import pymqi
+import CMQC
+
+
+class _DummyQueueManager(object):
+    def __init__(self, handle=1):
+        self.handle = handle
+        self.disconnected = False
+
+    def getHandle(self):
+        return self.handle
+
+    def _newConnection(self):
+        return _DummyQueueManager(2)
+
+    def disconnect(self):
+        self.disconnected = True
+
+
+class _Backend(object):
+    """ Replies to requests put on handle 1 through the reply queue,
+    handle 2, when told to.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []
+        self.replies = []
+        self.gets = set()
+        self.hold = None
+
+    def MQOPEN(self, qmgr, od, options):
+        qDesc = pymqi.od()
+        qDesc.unpack(od)
+        if qDesc.ObjectName.startswith('REQUEST'):
+            return (1, od, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+        return (2, od, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def MQPUT(self, qmgr, handle, md, pmo, msg):
+        mDesc = pymqi.md()
+        mDesc.unpack(md)
+        if self.hold is not None and msg == 'held':
+            self.hold.wait()
+        self.lock.acquire()
+        self.requests.append((qmgr, msg, mDesc))
+        self.lock.release()
+        return (mDesc.pack(), pmo, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def reply(self, msg, correlId):
+        self.lock.acquire()
+        self.replies.append((msg, pymqi.md(CorrelId=correlId).pack()))
+        self.lock.release()
+
+    def MQGET(self, qmgr, handle, md, gmo, length):
+        self.lock.acquire()
+        self.gets.add(qmgr)
+        try:
+            if self.replies:
+                msg, mDesc = self.replies.pop(0)
+                return (msg, mDesc, gmo, len(msg), CMQC.MQCC_OK,
+                        CMQC.MQRC_NONE)
+        finally:
+            self.lock.release()
+        time.sleep(0.005)
+        return ('', md, gmo, 0, CMQC.MQCC_FAILED, CMQC.MQRC_NO_MSG_AVAILABLE)
+
+    def MQCLOSE(self, qmgr, handle, options):
+        return (CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+
+def _client(r, backend, **kw):
+    for name in ('MQOPEN', 'MQPUT', 'MQGET', 'MQCLOSE'):
+        r.replace('pymqi.pymqe.' + name, getattr(backend, name))
+    return pymqi.RequestReplyClient(_DummyQueueManager(), 'REQUEST.Q',
+                                    'REPLY.Q', wait_interval=10, **kw)
+
+
+def test_replies_routed_by_correl_id():
+    """ Replies arriving in any order reach the future of the request
+    whose MsgId they carry as CorrelId.
+    """
+    backend = _Backend()
+    with Replacer() as r:
+        client = _client(r, backend)
+        first = client.request('first')
+        second = client.request('second')
+
+        qmgr, msg, mDesc = backend.requests[0]
+        eq_(qmgr, 1)
+        eq_(len(mDesc.MsgId), CMQC.MQ_MSG_ID_LENGTH)
+        assert first.msg_id != second.msg_id
+        eq_(mDesc.MsgType, CMQC.MQMT_REQUEST)
+        eq_(mDesc.ReplyToQ.strip('\0 '), 'REPLY.Q')
+        eq_(client.in_flight(), 2)
+
+        backend.reply('reply to second', second.msg_id)
+        backend.reply('reply to first', first.msg_id)
+        eq_(first.result(1)[0], 'reply to first')
+        eq_(second.result(1)[0], 'reply to second')
+        eq_(client.in_flight(), 0)
+        eq_(backend.gets, set([2]))
+        client.close()
+
+
+def test_timeout_and_late_reply():
+    """ A request without a reply times out, its reply is then handed to
+    on_late_reply.
+    """
+    backend = _Backend()
+    late = []
+    with Replacer() as r:
+        client = _client(r, backend,
+                         on_late_reply=lambda msg, md: late.append(msg))
+        future = client.request('request', timeout=0.02)
+        try:
+            future.result(1)
+        except pymqi.ReplyTimeout:
+            pass
+        else:
+            raise AssertionError('ReplyTimeout not raised')
+
+        backend.reply('late', future.msg_id)
+        deadline = time.time() + 1
+        while not late and time.time() < deadline:
+            time.sleep(0.005)
+        eq_(late, ['late'])
+        eq_(client.late_replies, 1)
+        client.close()
+
+
+def test_bounded_in_flight():
+    """ request() blocks while max_in_flight requests are pending, and
+    close() fails those.
+    """
+    backend = _Backend()
+    with Replacer() as r:
+        client = _client(r, backend, max_in_flight=1)
+        first = client.request('first')
+        sent = []
+        thread = threading.Thread(
+            target=lambda: sent.append(client.request('second')))
+        thread.start()
+        time.sleep(0.05)
+        eq_(sent, [])
+
+        eq_(first.cancel(), True)
+        thread.join(1)
+        eq_(len(sent), 1)
+
+        client.close()
+        try:
+            sent[0].result(1)
+        except pymqi.PYIFError:
+            pass
+        else:
+            raise AssertionError('PYIFError not raised')
+
+
+def test_put_outside_lock():
+    """ A reply is delivered while another request is being put.
+    """
+    backend = _Backend()
+    backend.hold = threading.Event()
+    with Replacer() as r:
+        client = _client(r, backend)
+        first = client.request('first')
+        thread = threading.Thread(target=lambda: client.request('held'))
+        thread.start()
+        time.sleep(0.02)
+
+        backend.reply('reply to first', first.msg_id)
+        eq_(first.result(1)[0], 'reply to first')
+        backend.hold.set()
+        thread.join(1)
+        eq_(client.in_flight(), 1)
+        client.close()
+
+
+def test_reply_queue_open_error():
+    """ An error opening the reply queue on the reader's connection is
+    raised by the constructor, which disconnects it.
+    """
+    backend = _Backend()
+    readers = []
+
+    def factory():
+        readers.append(_DummyQueueManager(2))
+        return readers[-1]
+
+    def MQOPEN(qmgr, od, options):
+        if qmgr == 2:
+            return (0, od, CMQC.MQCC_FAILED, CMQC.MQRC_NOT_AUTHORIZED)
+        return backend.MQOPEN(qmgr, od, options)
+
+    with Replacer() as r:
+        r.replace('pymqi.pymqe.MQOPEN', MQOPEN)
+        r.replace('pymqi.pymqe.MQCLOSE', backend.MQCLOSE)
+        try:
+            pymqi.RequestReplyClient(_DummyQueueManager(), 'REQUEST.Q',
+                                     'REPLY.Q', factory=factory)
+        except pymqi.MQMIError, e:
+            eq_(e.reason, CMQC.MQRC_NOT_AUTHORIZED)
+        else:
+            raise AssertionError('MQMIError not raised')
+        eq_(readers[0].disconnected, True)
@@ -0,0 +1,190 @@
+""" Tests for pymqi.UnitOfWork class.
+"""
+
+# stdlib
+import sys
+
+sys.path.insert(0, "..")
+
+# nose
+from nose.tools import eq_
+
+# testfixtures
+from testfixtures import Replacer
+
+# PyMQI
+import pymqi
+import CMQC
+
+
+class _Backend(object):
+    """ A queue of messages under syncpoint, and its QueueManager.
+    """
+    def __init__(self, messages):
+        self.queued = list(messages)
+        self.uncommitted = []
+        self.put = []
+        self.commits = 0
+        self.backouts = 0
+        self.waits = []
+
+    def getHandle(self):
+        return 1
+
+    def commit(self):
+        self.commits += 1
+        self.uncommitted = []
+
+    def backout(self):
+        self.backouts += 1
+        self.queued[:0] = self.uncommitted
+        self.uncommitted = []
+
+    def MQGET(self, qmgr, queue, md, gmo, length):
+        getOpts = pymqi.gmo()
+        getOpts.unpack(gmo)
+        eq_(getOpts.Options & CMQC.MQGMO_SYNCPOINT, CMQC.MQGMO_SYNCPOINT)
+        self.waits.append(getOpts.WaitInterval)
+        if not self.queued:
+            return ('', md, gmo, 0, CMQC.MQCC_FAILED,
+                    CMQC.MQRC_NO_MSG_AVAILABLE)
+        msg = self.queued.pop(0)
+        self.uncommitted.append(msg)
+        return (msg, md, gmo, len(msg), CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+    def MQPUT(self, qmgr, queue, md, pmo, msg):
+        putOpts = pymqi.pmo()
+        putOpts.unpack(pmo)
+        eq_(putOpts.Options & CMQC.MQPMO_SYNCPOINT, CMQC.MQPMO_SYNCPOINT)
+        self.put.append(msg)
+        return (md, pmo, CMQC.MQCC_OK, CMQC.MQRC_NONE)
+
+
+def _queue(r, backend):
+    r.replace('pymqi.pymqe.MQGET', backend.MQGET)
+    r.replace('pymqi.pymqe.MQPUT', backend.MQPUT)
+    queue = pymqi.Queue(backend)
+    queue.set_handle(2)
+    return queue
+
+
+def test_commit_by_messages_and_on_idle():
+    """ Work is committed every max_messages, the rest once the queue
+    is empty.
+    """
+    backend = _Backend(['m%d' % i for i in range(7)])
+    with Replacer() as r:
+        queue = _queue(r, backend)
+        uow = pymqi.UnitOfWork(backend, max_messages=3, max_latency=60000)
+        eq_(uow.run(queue, lambda msg, md, uow: None), 7)
+
+    eq_(backend.commits, 3)
+    stats = uow.stats()
+    eq_(stats['messages'], 7)
+    eq_(stats['by_messages'], 2)
+    eq_(stats['on_idle'], 1)
+    eq_(dict(stats['batch_size'])[1], 1)
+    eq_(dict(stats['batch_size'])[5], 2)
+    eq_(sum(count for bound, count in stats['commit_latency_ms']), 3)
+    # Far from max_latency, no wait is cut short.
+    eq_(backend.waits, [1000] * 9)
+
+
+class _Clock(object):
+    """ Stands for the time module, moved forward by hand.
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+def test_commit_by_latency():
+    """ While work is pending, the MQGET wait is cut short to the time
+    left before max_latency, and the work is committed once it has
+    elapsed.
+    """
+    backend = _Backend(['a', 'b'])
+    clock = _Clock()
+
+    def handler(msg, md, uow):
+        clock.now += 0.25
+
+    with Replacer() as r:
+        r.replace('pymqi.time', clock)
+        queue = _queue(r, backend)
+        uow = pymqi.UnitOfWork(backend, max_latency=400)
+        eq_(uow.run(queue, handler, wait_interval=1000), 2)
+
+    # 'b' is waited for until 400 ms after 'a' was got, at 250 ms.
+    eq_(backend.waits, [1000, 150, 1000])
+    eq_(backend.commits, 1)
+    stats = uow.stats()
+    eq_(stats['by_latency'], 1)
+    eq_(stats['on_idle'], 0)
+    eq_(dict(stats['batch_size'])[2], 1)
+
+
+def test_options_left_alone():
+    """ get() and put() ask for syncpoint and cut the wait short in
+    copies of the caller's gmo and pmo.
+    """
+    backend = _Backend(['a', 'b'])
+    with Replacer() as r:
+        queue = _queue(r, backend)
+        uow = pymqi.UnitOfWork(backend, max_latency=60000)
+        options = CMQC.MQGMO_NO_SYNCPOINT | CMQC.MQGMO_WAIT
+        getOpts = pymqi.gmo(Options=options,
+                            WaitInterval=CMQC.MQWI_UNLIMITED)
+        eq_(uow.get(queue, None, pymqi.md(), getOpts), 'a')
+        eq_(uow.get(queue, None, pymqi.md(), getOpts), 'b')
+        putOpts = pymqi.pmo(Options=CMQC.MQPMO_NO_SYNCPOINT)
+        uow.put(queue, 'c', pymqi.md(), putOpts)
+
+    eq_(backend.waits[0], CMQC.MQWI_UNLIMITED)
+    assert backend.waits[1] <= 60000
+    eq_((getOpts.Options, getOpts.WaitInterval),
+        (options, CMQC.MQWI_UNLIMITED))
+    eq_(putOpts.Options, CMQC.MQPMO_NO_SYNCPOINT)
+    eq_(uow.pending(), 3)
+
+
+def test_commit_by_bytes():
+    """ Messages and their puts count toward max_bytes.
+    """
+    backend = _Backend(['x' * 10] * 4)
+    with Replacer() as r:
+        queue = _queue(r, backend)
+        uow = pymqi.UnitOfWork(backend, max_bytes=40)
+        uow.run(queue, lambda msg, md, uow: uow.put(queue, msg))
+
+    eq_(len(backend.put), 4)
+    eq_(uow.stats()['by_bytes'], 2)
+    eq_(uow.stats()['bytes'], 80)
+
+
+def test_backout_on_handler_error():
+    """ An exception in the handler backs the unit of work out.
+    """
+    backend = _Backend(['a', 'b', 'c'])
+
+    def handler(msg, md, uow):
+        if msg == 'b':
+            raise ValueError(msg)
+
+    with Replacer() as r:
+        queue = _queue(r, backend)
+        uow = pymqi.UnitOfWork(backend, max_messages=10)
+        try:
+            uow.run(queue, handler)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('ValueError not raised')
+
+    eq_(backend.backouts, 1)
+    eq_(backend.commits, 0)
+    eq_(backend.queued, ['a', 'b', 'c'])
+    eq_(uow.pending(), 0)
+    eq_(uow.stats()['backouts'], 1)